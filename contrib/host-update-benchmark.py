@@ -0,0 +1,659 @@
+#!/usr/bin/python
+
+#
+# host-update-benchmark - benchmark of engine-host-update on a mock engine
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Offline benchmark and soak test of engine-host-update.
+
+A local stand-in engine serves the subset of the REST API used by the
+tool through the oVirt Python SDK v4, simulating the state machine of
+every host with configurable delays and failure rate. The tool is run
+against it for each of the requested scenarios, measuring the wall clock
+time, the API calls per host and the maximum number of hosts unavailable
+at the same time, overall and per cluster.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+from xml.sax.saxutils import escape
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+    from urlparse import urlparse
+
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..',
+    'packaging',
+    'bin',
+    'engine-host-update.py',
+)
+
+PASSWORD = 'benchmark'
+
+API_PREFIX = '/ovirt-engine/api'
+SSO_TOKEN = '/ovirt-engine/sso/oauth/token'
+SSO_LOGOUT = '/ovirt-engine/services/sso-logout'
+
+# default delays of the host transitions, in seconds
+DELAYS = collections.OrderedDict((
+    ('start', 1),
+    ('maintenance', 3),
+    ('install', 10),
+    ('activate', 3),
+    ('reboot', 10),
+))
+
+# transition delays vary by up to this fraction
+JITTER = 0.2
+
+SCENARIOS = collections.OrderedDict((
+    ('sequential', ''),
+    ('parallel', '--parallel 4 --max-unavailable 2'),
+    ('parallel-polling', '--parallel 4 --max-unavailable 2 --no-events'),
+))
+
+_RE_SEARCH_TERM = re.compile(r'^\s*(?P<key>\w+)\s*=\s*(?P<value>\S+)\s*$')
+_RE_HOST_ACTION = re.compile(
+    r'^/hosts/(?P<id>[^/]+)/(?P<action>activate|deactivate|install|upgrade)$'
+)
+
+
+class MockEngine(object):
+    """
+    Hosts of the stand-in engine and their state machines, along with
+    the metrics of a run.
+    """
+
+    def __init__(
+        self,
+        hosts,
+        clusters,
+        node_ratio,
+        delays,
+        failure_rate,
+        seed,
+    ):
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._delays = delays
+        self._failure_rate = failure_rate
+        self.clusters = ['cluster%d' % i for i in range(clusters)]
+        self.hosts = collections.OrderedDict()
+        for i in range(hosts):
+            self.hosts['host-%04d' % i] = {
+                'id': 'host-%04d' % i,
+                'name': 'host%04d' % i,
+                'cluster': self.clusters[i % clusters],
+                'type': (
+                    'ovirt_node' if self._random.random() < node_ratio
+                    else 'rhel'
+                ),
+                'status': 'up',
+            }
+        self.events = []
+        self.calls = collections.Counter()
+        self.updated = set()
+        self.failed = set()
+        self.max_unavailable = 0
+        self.max_cluster_unavailable = 0
+
+    def call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def search(self, query):
+        """
+        Return the hosts matching an 'or' of name=... and cluster=... terms.
+        """
+        with self._lock:
+            if not query:
+                return [dict(host) for host in self.hosts.values()]
+            terms = []
+            for term in query.split(' or '):
+                match = _RE_SEARCH_TERM.match(term)
+                if match is None:
+                    raise ValueError('Unsupported search %s' % query)
+                terms.append((match.group('key'), match.group('value')))
+            return [
+                dict(host) for host in self.hosts.values()
+                if any(
+                    host['name' if key == 'name' else 'cluster'] == value
+                    for key, value in terms
+                )
+            ]
+
+    def list_events(self, max_count, from_id):
+        with self._lock:
+            events = [
+                event for event in self.events
+                if from_id is None or event[0] > from_id
+            ]
+            events.reverse()
+            return events[:max_count] if max_count else events
+
+    def action(self, host_id, action):
+        """
+        Start the transitions of the action, returning False if the host
+        is not in a state allowing it.
+        """
+        with self._lock:
+            host = self.hosts[host_id]
+            status = host['status']
+            failed = self._random.random() < self._failure_rate
+            if action == 'deactivate' and status == 'up':
+                transitions = [
+                    ('preparing_for_maintenance', 'start'),
+                    ('maintenance', 'maintenance'),
+                ]
+            elif action == 'activate' and status == 'maintenance':
+                transitions = [('up', 'activate')]
+            elif action == 'install' and status == 'maintenance':
+                transitions = [
+                    ('installing', 'start'),
+                    ('install_failed' if failed else 'maintenance', 'install'),
+                ]
+            elif (
+                action == 'upgrade' and
+                status == 'up' and
+                host['type'] == 'ovirt_node'
+            ):
+                transitions = [('installing', 'start')]
+                if failed:
+                    transitions.append(('install_failed', 'install'))
+                else:
+                    transitions += [
+                        ('reboot', 'install'),
+                        ('up', 'reboot'),
+                    ]
+            else:
+                return False
+            delays = [
+                self._delays[delay] * (
+                    1 + self._random.uniform(-JITTER, JITTER)
+                )
+                for _, delay in transitions
+            ]
+        thread = threading.Thread(
+            target=self._transition,
+            args=(host_id, action, [
+                (state, delay)
+                for (state, _), delay in zip(transitions, delays)
+            ]),
+        )
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _transition(self, host_id, action, transitions):
+        for state, delay in transitions:
+            time.sleep(delay)
+            with self._lock:
+                host = self.hosts[host_id]
+                previous = host['status']
+                host['status'] = state
+                self.events.append((len(self.events) + 1, host_id))
+                if state == 'install_failed':
+                    self.failed.add(host_id)
+                elif (
+                    (action, previous, state) in (
+                        ('install', 'installing', 'maintenance'),
+                        ('upgrade', 'reboot', 'up'),
+                    )
+                ):
+                    self.updated.add(host_id)
+                self._measure()
+
+    def _measure(self):
+        unavailable = collections.Counter(
+            host['cluster'] for host in self.hosts.values()
+            if host['status'] != 'up'
+        )
+        self.max_unavailable = max(
+            self.max_unavailable,
+            sum(unavailable.values()),
+        )
+        self.max_cluster_unavailable = max(
+            [self.max_cluster_unavailable] + list(unavailable.values())
+        )
+
+
+def host_xml(host):
+    return (
+        '<host href="{prefix}/hosts/{id}" id="{id}">'
+        '<name>{name}</name>'
+        '<status>{status}</status>'
+        '<type>{type}</type>'
+        '<cluster href="{prefix}/clusters/{cluster}" id="{cluster}"/>'
+        '</host>'
+    ).format(
+        prefix=API_PREFIX,
+        id=escape(host['id']),
+        name=escape(host['name']),
+        status=host['status'],
+        type=host['type'],
+        cluster=escape(host['cluster']),
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, body, content_type='application/xml'):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fault(self, code, reason):
+        self._reply(
+            code,
+            '<fault><reason>%s</reason><detail>%s</detail></fault>' % (
+                escape(reason),
+                escape(self.path),
+            ),
+        )
+
+    def _body(self):
+        return self.rfile.read(
+            int(self.headers.get('Content-Length', 0))
+        ).decode('utf-8')
+
+    def do_GET(self):
+        engine = self.server.engine
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        path = url.path[len(API_PREFIX):]
+        if not url.path.startswith(API_PREFIX):
+            self._fault(404, 'Not found')
+        elif path in ('', '/'):
+            engine.call('GET api')
+            self._reply(200, '<api/>')
+        elif path == '/hosts':
+            engine.call('GET hosts')
+            try:
+                hosts = engine.search(query.get('search'))
+            except ValueError as e:
+                self._fault(400, str(e))
+                return
+            self._reply(
+                200,
+                '<hosts>%s</hosts>' % ''.join(host_xml(h) for h in hosts),
+            )
+        elif path == '/events':
+            engine.call('GET events')
+            events = engine.list_events(
+                int(query['max']) if 'max' in query else None,
+                int(query['from']) if 'from' in query else None,
+            )
+            self._reply(
+                200,
+                '<events>%s</events>' % ''.join(
+                    '<event id="%d"><host id="%s"/></event>' % (
+                        event_id,
+                        escape(host_id),
+                    )
+                    for event_id, host_id in events
+                ),
+            )
+        elif path == '/clusters':
+            engine.call('GET clusters')
+            self._reply(
+                200,
+                '<clusters>%s</clusters>' % ''.join(
+                    '<cluster id="%s"><name>%s</name></cluster>' % (
+                        escape(cluster),
+                        escape(cluster),
+                    )
+                    for cluster in engine.clusters
+                ),
+            )
+        else:
+            self._fault(404, 'Not found')
+
+    def do_POST(self):
+        engine = self.server.engine
+        body = self._body()
+        if self.path == SSO_TOKEN:
+            engine.call('POST sso')
+            form = parse_qs(body)
+            if form.get('password') == [PASSWORD]:
+                reply = {'access_token': 'benchmark'}
+            else:
+                reply = {
+                    'error': 'access_denied',
+                    'error_description': 'Invalid password',
+                }
+            self._reply(200, json.dumps(reply), 'application/json')
+            return
+        if self.path == SSO_LOGOUT:
+            engine.call('POST sso-logout')
+            self._reply(200, '{}', 'application/json')
+            return
+        match = _RE_HOST_ACTION.match(self.path[len(API_PREFIX):])
+        if match is None or match.group('id') not in engine.hosts:
+            self._fault(404, 'Not found')
+            return
+        engine.call('POST hosts/%s' % match.group('action'))
+        if engine.action(match.group('id'), match.group('action')):
+            self._reply(200, '<action><status>complete</status></action>')
+        else:
+            self._fault(409, 'Operation Failed')
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, engine, certfile, keyfile):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.engine = engine
+        context = ssl.SSLContext(
+            getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+        )
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+
+def generate_certificate(workdir):
+    certfile = os.path.join(workdir, 'engine.pem')
+    keyfile = os.path.join(workdir, 'engine.key')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [
+                'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                '-subj', '/CN=127.0.0.1', '-days', '1',
+                '-keyout', keyfile, '-out', certfile,
+            ],
+            stdout=devnull,
+            stderr=devnull,
+        )
+    return certfile, keyfile
+
+
+def run(args, scenario, workdir, certfile, keyfile, seed):
+    """
+    Run the tool on the clusters of a new mock engine, returning the
+    metrics of the run.
+    """
+    engine = MockEngine(
+        args.hosts,
+        args.clusters,
+        args.node_ratio,
+        dict(
+            (name, delay * args.time_scale)
+            for name, delay in args.delays.items()
+        ),
+        args.failure_rate,
+        seed,
+    )
+    server = Server(engine, certfile, keyfile)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    home = tempfile.mkdtemp(dir=workdir)
+    env = dict(os.environ)
+    # journal and stats files of the tool
+    env['HOME'] = home
+    cmd = [
+        args.python,
+        SCRIPT,
+        '--engine', '127.0.0.1',
+        '--port', str(server.server_address[1]),
+        '--insecure',
+        '--password', PASSWORD,
+        '--clusters', ','.join(engine.clusters),
+        '--verify-time', str(args.verify_time),
+    ] + SCENARIOS.get(scenario, scenario).split()
+    start = time.time()
+    try:
+        with open(os.path.join(workdir, 'output.log'), 'a') as output:
+            output.write('# %s\n' % ' '.join(cmd))
+            output.flush()
+            code = subprocess.call(
+                cmd,
+                env=env,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            )
+        wall = time.time() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(home)
+
+    calls = sum(engine.calls.values())
+    return {
+        'scenario': scenario,
+        'seed': seed,
+        'code': code,
+        'wall': wall,
+        'calls': calls,
+        'calls_per_host': float(calls) / args.hosts,
+        'calls_by_request': dict(engine.calls),
+        'max_unavailable': engine.max_unavailable,
+        'max_cluster_unavailable': engine.max_cluster_unavailable,
+        'updated': len(engine.updated),
+        'failed': len(engine.failed),
+    }
+
+
+def report(results, output):
+    output.write(
+        '%-20s %5s %4s %9s %7s %10s %6s %8s %7s %6s\n' % (
+            'scenario',
+            'seed',
+            'rc',
+            'wall[s]',
+            'calls',
+            'calls/host',
+            'unavl',
+            'unavl/cl',
+            'updated',
+            'failed',
+        )
+    )
+    for r in results:
+        output.write(
+            '%-20s %5d %4d %9.1f %7d %10.1f %6d %8d %7d %6d\n' % (
+                r['scenario'][:20],
+                r['seed'],
+                r['code'],
+                r['wall'],
+                r['calls'],
+                r['calls_per_host'],
+                r['max_unavailable'],
+                r['max_cluster_unavailable'],
+                r['updated'],
+                r['failed'],
+            )
+        )
+
+
+def parse_delays(value):
+    delays = collections.OrderedDict(DELAYS)
+    for item in value.split(','):
+        name, _, delay = item.partition('=')
+        if name not in DELAYS:
+            raise argparse.ArgumentTypeError('Invalid delay %s' % name)
+        delays[name] = float(delay)
+    return delays
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Benchmark engine-host-update against a local mock engine '
+            'simulating the host state machines.'
+        ),
+    )
+    parser.add_argument(
+        '--hosts',
+        type=int,
+        default=8,
+        help='Number of hosts (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--clusters',
+        type=int,
+        default=2,
+        help='Number of clusters the hosts are spread over '
+             '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--node-ratio',
+        type=float,
+        default=0.0,
+        help='Fraction of oVirt Node hosts, upgraded instead of '
+             'reinstalled (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--failure-rate',
+        type=float,
+        default=0.0,
+        help='Probability of a host install or upgrade to fail '
+             '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--delays',
+        type=parse_delays,
+        default=DELAYS,
+        help=(
+            'Comma separated name=seconds delays of the host transitions, '
+            'out of: %s (default: %s)'
+        ) % (
+            ', '.join(DELAYS),
+            ','.join('%s=%s' % item for item in DELAYS.items()),
+        ),
+    )
+    parser.add_argument(
+        '--time-scale',
+        type=float,
+        default=1.0,
+        help='Factor applied to all the delays (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--verify-time',
+        type=int,
+        default=5,
+        help='Time the hosts have to stay up after the update '
+             '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        help=(
+            'Scenario to run, either one of: %s, or the engine-host-update '
+            'arguments to use, may be given more than once (default: all '
+            'the named scenarios)'
+        ) % ', '.join(SCENARIOS),
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Runs of every scenario, with successive seeds, for soak '
+             'testing (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the host types, delays and failures of the first '
+             'run (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--python',
+        default='/usr/bin/python',
+        help='Interpreter running engine-host-update, which requires '
+             'the oVirt Python SDK v4 (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--workdir',
+        help='Directory for the certificate and the output of the tool, '
+             'a temporary directory is used and removed if not specified.',
+    )
+    parser.add_argument(
+        '--json',
+        help='Write the results as JSON to this file as well',
+    )
+    args = parser.parse_args()
+
+    workdir = args.workdir
+    cleanup = workdir is None
+    if cleanup:
+        workdir = tempfile.mkdtemp(prefix='host-update-benchmark-')
+    try:
+        certfile, keyfile = generate_certificate(workdir)
+        results = []
+        for scenario in args.scenario or SCENARIOS:
+            for i in range(args.repeat):
+                results.append(
+                    run(
+                        args,
+                        scenario,
+                        workdir,
+                        certfile,
+                        keyfile,
+                        args.seed + i,
+                    )
+                )
+                report(results[-1:], sys.stderr)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+
+    report(results, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    sys.exit(1 if any(r['code'] for r in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
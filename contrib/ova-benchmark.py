@@ -0,0 +1,443 @@
+#!/usr/bin/python
+
+#
+# ova-benchmark - benchmark of the OVA pack/extract/query scripts
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Offline benchmark of the OVA scripts used by the ovirt-ova-* roles.
+
+Synthetic raw images are generated in a work directory, which may be on
+any file system or block device to be measured, then packed into an OVA,
+extracted back and queried, using each of the requested buffer sizes and
+copy engines. Every operation is measured for wall clock time, CPU time
+of the child processes and optionally the number of system calls.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROLES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..',
+    'packaging',
+    'playbooks',
+    'roles',
+)
+PACK_SCRIPT = os.path.join(ROLES_DIR, 'ovirt-ova-pack', 'files', 'pack_ova.py')
+EXTRACT_SCRIPT = os.path.join(
+    ROLES_DIR,
+    'ovirt-ova-extract',
+    'files',
+    'extract_ova.py',
+)
+QUERY_SCRIPT = os.path.join(
+    ROLES_DIR,
+    'ovirt-ova-query',
+    'files',
+    'query_ova.py',
+)
+
+# the scripts read the buffer size from this variable
+ENV_BUF_SIZE = 'OVIRT_OVA_BUF_SIZE'
+
+# images are generated in chunks, each either written or left as a hole
+CHUNK_SIZE = 1024**2
+BLOCK_SIZE = 512
+
+OVF = '<ovf:Envelope/>'
+
+ENGINES = ('script', 'dd')
+
+_RE_SIZE = re.compile(r'^(?P<value>\d+)(?P<unit>[kKmMgG]?)$')
+_RE_STRACE_TOTAL = re.compile(
+    r'^\s*100\.00\s+\S+\s+\S+\s+(?P<calls>\d+)\s+(?:\d+\s+)?total\s*$'
+)
+
+
+def parse_size(value):
+    match = _RE_SIZE.match(value)
+    if match is None:
+        raise argparse.ArgumentTypeError('Invalid size %s' % value)
+    return int(match.group('value')) * {
+        '': 1,
+        'k': 1024,
+        'm': 1024**2,
+        'g': 1024**3,
+    }[match.group('unit').lower()]
+
+
+def parse_buffer_size(value):
+    size = parse_size(value)
+    if size % BLOCK_SIZE:
+        raise argparse.ArgumentTypeError(
+            'Buffer size %s is not a multiple of %d' % (value, BLOCK_SIZE)
+        )
+    return size
+
+
+def generate_images(directory, count, size, sparseness, seed):
+    """
+    Create raw images of the given size, where about the given fraction
+    of the chunks is left as holes.
+    """
+    rand = random.Random(seed)
+    data = os.urandom(CHUNK_SIZE)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'image%d' % i)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+            for offset in range(0, size, CHUNK_SIZE):
+                if rand.random() >= sparseness:
+                    f.seek(offset)
+                    f.write(data[:min(CHUNK_SIZE, size - offset)])
+        paths.append(path)
+    return paths
+
+
+def run(args, env=None, strace=None):
+    """
+    Run the command, returning its wall clock time, its CPU time and the
+    number of system calls if strace output was requested.
+    """
+    if strace is not None:
+        args = ['strace', '-f', '-c', '-o', strace] + list(args)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(args, env=env, stdout=devnull)
+    wall = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (
+        after.ru_utime - before.ru_utime +
+        after.ru_stime - before.ru_stime
+    )
+    syscalls = None
+    if strace is not None:
+        with open(strace) as f:
+            for line in f:
+                match = _RE_STRACE_TOTAL.match(line)
+                if match is not None:
+                    syscalls = int(match.group('calls'))
+    return wall, cpu, syscalls
+
+
+def commands(engine, python, workdir, images, buf_size):
+    """
+    Return the (operation, args) to run for the engine, the dd engine
+    is a reference of plain direct I/O copies of the same data.
+    """
+    ova = os.path.join(workdir, 'benchmark.ova')
+    targets = [
+        os.path.join(workdir, 'extracted', os.path.basename(image))
+        for image in images
+    ]
+    if engine == 'script':
+        yield 'pack', [
+            python,
+            PACK_SCRIPT,
+            ova,
+            OVF,
+            '+'.join(
+                '%s::%d' % (image, os.path.getsize(image))
+                for image in images
+            ),
+        ]
+        yield 'extract', [
+            python,
+            EXTRACT_SCRIPT,
+            ova,
+            '+'.join(targets),
+        ]
+        yield 'query', [python, QUERY_SCRIPT, ova]
+    else:
+        sizes = [os.path.getsize(image) for image in images]
+        yield 'pack', [
+            'sh',
+            '-c',
+            ' && '.join(
+                'dd if=%s of=%s bs=%d iflag=direct oflag=direct,append '
+                'conv=notrunc status=none' % (image, ova, buf_size)
+                for image in images
+            ),
+        ]
+        yield 'extract', [
+            'sh',
+            '-c',
+            ' && '.join(
+                'dd if=%s of=%s bs=%d skip=%d count=%d '
+                'iflag=direct,skip_bytes,count_bytes oflag=direct '
+                'conv=notrunc status=none' % (
+                    ova,
+                    target,
+                    buf_size,
+                    sum(sizes[:i]),
+                    sizes[i],
+                )
+                for i, target in enumerate(targets)
+            ),
+        ]
+
+
+def direct_io_supported(directory):
+    # tmpfs rejects O_DIRECT with EINVAL before Linux 6.6
+    fd, path = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        os.close(os.open(path, os.O_RDONLY | os.O_DIRECT))
+    except OSError:
+        return False
+    finally:
+        os.unlink(path)
+    return True
+
+
+def prepare(workdir, images):
+    ova = os.path.join(workdir, 'benchmark.ova')
+    extracted = os.path.join(workdir, 'extracted')
+    if os.path.exists(extracted):
+        shutil.rmtree(extracted)
+    os.mkdir(extracted)
+    for image in images:
+        with open(os.path.join(extracted, os.path.basename(image)), 'w') as f:
+            f.truncate(os.path.getsize(image))
+    with open(ova, 'w'):
+        pass
+
+
+def benchmark(args, workdir, images):
+    total = sum(os.path.getsize(image) for image in images)
+    results = []
+    for engine in args.engines:
+        for buf_size in args.buffer_sizes:
+            env = dict(os.environ)
+            env[ENV_BUF_SIZE] = str(buf_size)
+            samples = collections.OrderedDict()
+            for i in range(args.repeat):
+                prepare(workdir, images)
+                for operation, cmd in commands(
+                    engine,
+                    args.python,
+                    workdir,
+                    images,
+                    buf_size,
+                ):
+                    samples.setdefault(operation, []).append(
+                        run(
+                            cmd,
+                            env=env,
+                            strace=(
+                                os.path.join(workdir, 'strace.out')
+                                if args.syscalls else None
+                            ),
+                        )
+                    )
+            for operation, runs in samples.items():
+                wall = min(r[0] for r in runs)
+                results.append({
+                    'engine': engine,
+                    'buffer_size': buf_size,
+                    'operation': operation,
+                    'bytes': total,
+                    'wall': wall,
+                    'gbps': (
+                        total / wall / 1024**3
+                        if wall and operation != 'query' else None
+                    ),
+                    'cpu': min(r[1] for r in runs),
+                    'syscalls': (
+                        min(r[2] for r in runs) if args.syscalls else None
+                    ),
+                })
+    return results
+
+
+def report(results, output):
+    output.write(
+        '%-8s %-8s %10s %10s %10s %10s %10s\n' % (
+            'engine',
+            'op',
+            'buffer',
+            'wall[s]',
+            'GB/s',
+            'cpu[s]',
+            'syscalls',
+        )
+    )
+    for r in results:
+        output.write(
+            '%-8s %-8s %10d %10.3f %10s %10.3f %10s\n' % (
+                r['engine'],
+                r['operation'],
+                r['buffer_size'],
+                r['wall'],
+                '%.3f' % r['gbps'] if r['gbps'] is not None else '-',
+                r['cpu'],
+                r['syscalls'] if r['syscalls'] is not None else '-',
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Benchmark the OVA pack/extract/query scripts over synthetic '
+            'sparse and dense raw images.'
+        ),
+    )
+    parser.add_argument(
+        '--workdir',
+        help=(
+            'Directory for the images and the OVA, e.g. on a file system '
+            'of a loopback block device. It must support direct I/O. A '
+            'temporary directory is used if not specified.'
+        ),
+    )
+    parser.add_argument(
+        '--count',
+        type=int,
+        default=2,
+        help='Number of images (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--size',
+        type=parse_size,
+        default='256M',
+        help='Size of every image, e.g. 1G (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--sparseness',
+        type=float,
+        default=0.0,
+        help=(
+            'Fraction of every image left as holes, between 0 and 1 '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the holes layout (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--buffer-sizes',
+        type=lambda v: [parse_buffer_size(s) for s in v.split(',')],
+        default='1M,8M,32M',
+        help='Comma separated copy buffer sizes (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--engines',
+        type=lambda v: v.split(','),
+        default=','.join(ENGINES),
+        help=(
+            'Comma separated copy engines out of: %s, where dd is a '
+            'reference of plain direct I/O copies (default: %%(default)s)'
+        ) % ', '.join(ENGINES),
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Runs per measurement, the best is reported '
+             '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--syscalls',
+        action='store_true',
+        help='Count system calls using strace, which slows down the runs',
+    )
+    parser.add_argument(
+        '--python',
+        default='/usr/bin/python',
+        help='Interpreter running the scripts (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--json',
+        help='Write the results as JSON to this file as well',
+    )
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        if engine not in ENGINES:
+            parser.error('Invalid engine %s' % engine)
+
+    if args.workdir is not None and not direct_io_supported(args.workdir):
+        parser.error(
+            'Direct I/O, as used by the scripts, is not supported in %s' % (
+                args.workdir,
+            )
+        )
+
+    workdir = args.workdir
+    cleanup = workdir is None
+    if cleanup:
+        workdir = tempfile.mkdtemp(prefix='ova-benchmark-', dir='/var/tmp')
+    try:
+        print(
+            'Generating %d images of %d bytes, sparseness %s, in %s' % (
+                args.count,
+                args.size,
+                args.sparseness,
+                workdir,
+            )
+        )
+        images = generate_images(
+            workdir,
+            args.count,
+            args.size,
+            args.sparseness,
+            args.seed,
+        )
+        results = benchmark(args, workdir, images)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+
+    report(results, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(
+                {
+                    'count': args.count,
+                    'size': args.size,
+                    'sparseness': args.sparseness,
+                    'results': results,
+                },
+                f,
+                indent=4,
+                sort_keys=True,
+            )
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
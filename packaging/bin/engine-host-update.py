@@ -21,20 +21,31 @@ from __future__ import print_function
 
 import atexit
 import getopt
+import json
 import logging
 import os
 import sys
+import threading
 import time
 
+try:
+    import ovirtsdk4
+    import ovirtsdk4.types
+except ImportError:
+    ovirtsdk4 = None
+
 try:
     import ovirtsdk.api
     import ovirtsdk.xml
 except ImportError:
-    print(
-        'This tools requires oVirt Python SDK v3.\n'
-        'Please install it with e.g. yum install ovirt-engine-sdk-python\n'
-    )
-    sys.exit(1)
+    if ovirtsdk4 is None:
+        print(
+            'This tools requires oVirt Python SDK v4 or v3.\n'
+            'Please install it with e.g. yum install python-ovirt-engine-sdk4'
+            '\n'
+        )
+        sys.exit(1)
+    ovirtsdk = None
 
 
 # Host states
@@ -66,8 +77,31 @@ HOST_INSTALL_FAILED_STATES = [
     HOST_STATE_ERROR,
 ]
 
+# Host update phases, in order, as recorded in the run journal
+HOST_PHASE_MAINTENANCE = 'maintenance'
+HOST_PHASE_INSTALLING = 'installing'
+HOST_PHASE_REBOOT = 'reboot'
+HOST_PHASE_ACTIVATE = 'activate'
+HOST_PHASE_VERIFY = 'verify'
+HOST_PHASE_DONE = 'done'
+
+HOST_PHASES = [
+    HOST_PHASE_MAINTENANCE,
+    HOST_PHASE_INSTALLING,
+    HOST_PHASE_REBOOT,
+    HOST_PHASE_ACTIVATE,
+    HOST_PHASE_VERIFY,
+    HOST_PHASE_DONE,
+]
+
+# Host update methods, the phase durations are recorded by method
+UPDATE_METHOD_REINSTALL = 'reinstall'
+UPDATE_METHOD_NODE = 'node'
+UPDATE_METHOD_NODE_LEGACY = 'node-legacy'
+
 OVIRT_NODE_LEGACY_HOST_TYPES = (
     'rhev-h',
+    'rhev_h',
     'RHEV_H',
 )
 
@@ -94,18 +128,55 @@ upgradeRebootTimeout = 900
 
 # Wait times are in seconds
 HOST_UP_VERIFY_TIME = 90
+hostUpVerifyTime = HOST_UP_VERIFY_TIME
 SLEEP_TIME = 5
 
 # Max tries
 MAX_NON_RESPONSIVE_COUNT = 10
 
+# Parallel processing
+defaultParallel = 1
+defaultMaxUnavailable = 1
+
+# Host state polling, states older than POLL_MAX_AGE seconds are
+# refreshed by a single query of up to MAX_QUERY_HOSTS hosts, failed
+# queries are retried after backing off up to MAX_POLL_BACKOFF seconds
+POLL_MAX_AGE = SLEEP_TIME / 2.0
+MAX_QUERY_HOSTS = 50
+MAX_POLL_BACKOFF = 60
+
+# Engine events are followed every EVENTS_INTERVAL seconds to wake up the
+# host workflows as soon as their host changes, backing off up to
+# MAX_EVENTS_INTERVAL seconds while no host changes, only as long as some
+# workflow is waiting, falling back to polling every SLEEP_TIME seconds
+# after MAX_EVENTS_FAILURES consecutive failures
+EVENTS_INTERVAL = 1
+MAX_EVENTS_INTERVAL = SLEEP_TIME
+MAX_EVENTS_FAILURES = 3
+
+# Durations of the last MAX_STATS_SAMPLES updates of every phase are kept
+MAX_STATS_SAMPLES = 20
+
 ENV_ADMIN_USER = 'OVIRT_ADMIN_USER'
 ENV_ADMIN_PASS = 'OVIRT_ADMIN_PASS'
 PASSWORD_FILE = '~/.host_update.cred'
+JOURNAL_FILE = '~/.host_update.journal'
+STATS_FILE = '~/.host_update.stats'
 
 hostsToUpdate = []
 clustersToUpdate = []
 
+hostStatePoller = None
+hostStatePollerLock = threading.Lock()
+useEvents = True
+runJournal = None
+runStats = None
+sdkVersion = 4 if ovirtsdk4 is not None else 3
+
+jsonOutput = None
+jsonOutputLock = threading.Lock()
+reportedStates = {}
+
 
 class TimeoutError(Exception):
     def __init__(self, value):
@@ -131,15 +202,651 @@ class InvalidHostName(Exception):
         return repr(self.value)
 
 
+ERROR_EXIT_CODES = (
+    (TimeoutError, 1),
+    (InvalidState, 2),
+    (InvalidHostName, 3),
+    (RuntimeError, 4),
+)
+
+
+class HostOutput(object):
+    """
+    Standard output shared by the threads processing hosts in parallel.
+
+    Only complete lines are written, each prefixed with the name of the
+    host processed by the writing thread, so that the progress of the
+    hosts does not get mixed.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def setHost(self, name):
+        if getattr(self._local, 'line', None):
+            self.write('\n')
+        self._local.host = name
+        self._local.line = ''
+
+    def write(self, s):
+        host = getattr(self._local, 'host', None)
+        with self._lock:
+            if host is None:
+                self._stream.write(s)
+            else:
+                lines = (self._local.line + s).split('\n')
+                self._local.line = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        self._stream.write('[%s] %s\n' % (host, line))
+            self._stream.flush()
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+
+class HostStatePoller(object):
+    """
+    Shared cache of the hosts, by id, and of the states of the hosts
+    being processed.
+
+    The states of all the hosts being processed are refreshed together
+    by a single search query once they are older than maxAge, however
+    many host workflows are waiting on them.
+    """
+
+    def __init__(self, api, maxAge=POLL_MAX_AGE, events=True):
+        self._api = api
+        self._maxAge = maxAge
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._ids = {}
+        self._hosts = {}
+        self._tracked = set()
+        self._polled = None
+        self._events = events
+        self._eventsWatcher = None
+        self._lastEventId = None
+        self._waiters = 0
+        self._changes = {}
+
+    def add(self, host):
+        with self._lock:
+            self._ids[host.get_name()] = host.get_id()
+            self._hosts[host.get_id()] = host
+
+    def host(self, name):
+        """
+        Return the host object, None for an invalid host name.
+        """
+        with self._lock:
+            hostId = self._ids.get(name)
+            if hostId is None:
+                hostObjs = self._api.hosts.list(name=name)
+                if not hostObjs:
+                    return None
+                self.add(hostObjs[0])
+                hostId = hostObjs[0].get_id()
+            return self._hosts[hostId]
+
+    def state(self, name):
+        """
+        Return the state of the host, None for an invalid host name.
+        """
+        with self._lock:
+            if self.host(name) is None:
+                return None
+            if name not in self._tracked:
+                self._tracked.add(name)
+                self._polled = None
+        delay = SLEEP_TIME
+        while True:
+            with self._lock:
+                if (
+                    self._polled is not None and
+                    time.time() - self._polled < self._maxAge
+                ) or self._poll():
+                    status = self._hosts[self._ids[name]].status
+                    if status is not None and status.state:
+                        return status.state
+                    self._polled = None
+                # back off without holding the lock, an engine event
+                # reporting a change wakes the workflow up earlier
+                self._changed.wait(delay)
+            delay = min(delay * 2, MAX_POLL_BACKOFF)
+
+    def release(self, name):
+        """
+        Stop refreshing the state of the host.
+        """
+        with self._lock:
+            self._tracked.discard(name)
+
+    def wait(self, name, timeout=SLEEP_TIME):
+        """
+        Wait until an engine event reports a change of the host, at most
+        timeout seconds, returning the seconds waited.
+
+        Without engine events this is a plain sleep of timeout seconds.
+        """
+        start = time.time()
+        with self._lock:
+            if self._events and self._eventsWatcher is None:
+                self._eventsWatcher = threading.Thread(
+                    target=self._watchEvents,
+                    name='host-events',
+                )
+                self._eventsWatcher.daemon = True
+                self._eventsWatcher.start()
+            hostId = self._ids.get(name)
+            changes = self._changes.get(hostId, 0)
+            self._waiters += 1
+            try:
+                while self._events:
+                    remaining = start + timeout - time.time()
+                    if (
+                        self._changes.get(hostId, 0) != changes or
+                        remaining <= 0
+                    ):
+                        return time.time() - start
+                    self._changed.wait(remaining)
+            finally:
+                self._waiters -= 1
+        # events are not available, plain polling
+        remaining = start + timeout - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        return time.time() - start
+
+    def _watchEvents(self):
+        """
+        Follow the engine events, marking the hosts they refer to as
+        changed and waking up the workflows waiting on them.
+
+        The watcher stops once no workflow is waiting, the next wait()
+        starts a new one, which continues from the last event seen.
+        """
+        lastId = self._lastEventId
+        failures = 0
+        interval = EVENTS_INTERVAL
+        while True:
+            try:
+                if lastId is None:
+                    # events are listed from the newest one
+                    events = self._api.events.list(max=1)
+                else:
+                    events = self._api.events.list(from_event_id=lastId)
+                failures = 0
+            except Exception as error:
+                failures += 1
+                logging.debug(
+                    'Got an exception while was '
+                    'trying to get engine events : %s' % (
+                        repr(error)
+                    )
+                )
+                if failures >= MAX_EVENTS_FAILURES:
+                    logging.debug('Falling back to polling host states.')
+                    with self._lock:
+                        self._events = False
+                        self._changed.notify_all()
+                    return
+                events = []
+
+            hostIds = set()
+            for event in events:
+                eventId = int(event.get_id())
+                if lastId is None or eventId > lastId:
+                    lastId = eventId
+                if event.get_host() is not None:
+                    hostIds.add(event.get_host().get_id())
+            if lastId is None:
+                lastId = 0
+
+            if hostIds:
+                with self._lock:
+                    for hostId in hostIds:
+                        self._changes[hostId] = (
+                            self._changes.get(hostId, 0) + 1
+                        )
+                    # the next state query has to refresh the states
+                    self._polled = None
+                    self._changed.notify_all()
+                interval = EVENTS_INTERVAL
+            else:
+                interval = min(interval * 2, MAX_EVENTS_INTERVAL)
+
+            time.sleep(interval)
+            with self._lock:
+                self._lastEventId = lastId
+                if not self._waiters:
+                    self._eventsWatcher = None
+                    return
+
+    def _poll(self):
+        """
+        Refresh the states of the tracked hosts, returning whether the
+        query succeeded.
+        """
+        names = sorted(self._tracked)
+        try:
+            for i in range(0, len(names), MAX_QUERY_HOSTS):
+                for host in self._api.hosts.list(
+                    query=' or '.join(
+                        'name=%s' % name
+                        for name in names[i:i + MAX_QUERY_HOSTS]
+                    ),
+                ):
+                    self.add(host)
+        except Exception as error:
+            logging.debug(
+                'Got an exception while was '
+                'trying to get hosts\' states : %s' % (
+                    repr(error)
+                )
+            )
+            return False
+        self._polled = time.time()
+        return True
+
+
+class HostScheduler(object):
+    """
+    Hands out the hosts to process to the parallel workers, in order,
+    while keeping at most maxUnavailable hosts of every cluster in
+    process at the same time.
+
+    Once stopped, no more hosts are handed out, the hosts already in
+    process are left to complete.
+    """
+
+    def __init__(self, hosts, hostClusters, maxUnavailable):
+        self._pending = list(hosts)
+        self._hostClusters = hostClusters
+        self._maxUnavailable = maxUnavailable
+        self._unavailable = {}
+        self._stopped = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Return the next host to process, None when done or stopped.
+        """
+        with self._condition:
+            while True:
+                if self._stopped or not self._pending:
+                    return None
+                for name in self._pending:
+                    cluster = self._hostClusters.get(name)
+                    if (
+                        self._unavailable.get(cluster, 0) <
+                        self._maxUnavailable
+                    ):
+                        self._pending.remove(name)
+                        self._unavailable[cluster] = (
+                            self._unavailable.get(cluster, 0) + 1
+                        )
+                        return name
+                # timeout keeps the main thread responsive to signals
+                self._condition.wait(SLEEP_TIME)
+
+    def release(self, name):
+        with self._condition:
+            self._unavailable[self._hostClusters.get(name)] -= 1
+            self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+class RunJournal(object):
+    """
+    Persistent journal of a run, holding the hosts to process and, for
+    every host, the phase it reached and the time each phase began.
+
+    The journal is rewritten atomically on every phase transition, so
+    that a resumed run continues each host from its recorded phase.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def load(self):
+        with open(self._path) as f:
+            self._journal = json.load(f)
+        return [str(name) for name in self._journal['hosts']]
+
+    def begin(self, hosts):
+        with self._lock:
+            self._journal = {
+                'hosts': list(hosts),
+                'started': time.time(),
+                'phases': {},
+            }
+            self._save()
+
+    def phase(self, name):
+        with self._lock:
+            entry = self._journal['phases'].get(name)
+            return str(entry['phase']) if entry is not None else None
+
+    def setPhase(self, name, phase):
+        with self._lock:
+            entry = self._journal['phases'].setdefault(name, {'times': {}})
+            entry['phase'] = phase
+            entry['times'][phase] = time.time()
+            self._save()
+
+    def pending(self):
+        """
+        Return the hosts not done yet, the ones in process first.
+        """
+        hosts = [
+            name for name in self._journal['hosts']
+            if self.phase(name) != HOST_PHASE_DONE
+        ]
+        return [str(name) for name in sorted(
+            hosts,
+            key=lambda name: self.phase(name) is None,
+        )]
+
+    def remove(self):
+        if self.exists():
+            os.unlink(self._path)
+
+    def _save(self):
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._journal, f, indent=4, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self._path)
+
+
+class RunStats(object):
+    """
+    Durations of the update phases of the hosts processed by the previous
+    runs, by update method, used to estimate the duration of new runs.
+
+    Only the hosts processed from the beginning to the end by a single
+    run are recorded.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._phases = {}
+
+    def setPhase(self, name, phase):
+        with self._lock:
+            self._phases.setdefault(name, []).append((phase, time.time()))
+
+    def record(self, name, method):
+        with self._lock:
+            transitions = self._phases.pop(name, [])
+            # other runs may have recorded their hosts meanwhile
+            stats = self._load()
+            for (phase, start), (_, end) in zip(
+                transitions,
+                transitions[1:],
+            ):
+                samples = stats.setdefault(method, {}).setdefault(phase, [])
+                samples.append(round(end - start, 1))
+                del samples[:-MAX_STATS_SAMPLES]
+            self._save(stats)
+
+    def estimate(self, method):
+        """
+        Return the estimated seconds to update a host by the method, the
+        sum of the median duration of each phase, None without history.
+        """
+        with self._lock:
+            phases = self._load().get(method)
+        if not phases:
+            return None
+        estimate = 0
+        for samples in phases.values():
+            estimate += sorted(samples)[len(samples) // 2]
+        return estimate
+
+    def _load(self):
+        # the history only serves the estimates, a missing, unreadable or
+        # corrupted one is ignored rather than failing the run
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path) as f:
+                stats = json.load(f)
+        except (IOError, OSError, ValueError) as error:
+            logging.warning(
+                'Ignoring the update history %s: %s' % (
+                    self._path,
+                    error,
+                )
+            )
+            return {}
+        if not isinstance(stats, dict):
+            logging.warning(
+                'Ignoring the invalid update history %s' % self._path
+            )
+            return {}
+        return stats
+
+    def _save(self, stats):
+        tmp = self._path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(stats, f, indent=4, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self._path)
+        except (IOError, OSError) as error:
+            logging.warning(
+                'Cannot save the update history %s: %s' % (
+                    self._path,
+                    error,
+                )
+            )
+
+
+class EntityV4(object):
+    """
+    SDK v3 like view of an SDK v4 entity.
+    """
+
+    def __init__(self, entity):
+        self._entity = entity
+
+    def __getattr__(self, name):
+        return getattr(self._entity, name)
+
+    def get_id(self):
+        return self._entity.id
+
+    def get_name(self):
+        return self._entity.name
+
+
+class HostStatusV4(object):
+    def __init__(self, state):
+        self.state = state
+
+
+class HostV4(EntityV4):
+    def __init__(self, api, host):
+        super(HostV4, self).__init__(host)
+        self._api = api
+        self._service = api.hostsService.host_service(host.id)
+
+    @property
+    def status(self):
+        status = self._entity.status
+        return HostStatusV4(status.value if status is not None else None)
+
+    def get_type(self):
+        vdsType = self._entity.type
+        return vdsType.value if vdsType is not None else None
+
+    def get_cluster(self):
+        return EntityV4(self._entity.cluster)
+
+    def activate(self):
+        self._api.call(self._service.activate)
+
+    def deactivate(self):
+        self._api.call(self._service.deactivate)
+
+    def install(self):
+        self._api.call(
+            self._service.install,
+            ssh=ovirtsdk4.types.Ssh(
+                authentication_method=(
+                    ovirtsdk4.types.SshAuthenticationMethod.PUBLICKEY
+                ),
+            ),
+            host=ovirtsdk4.types.Host(override_iptables=True),
+        )
+
+    def upgrade(self, image=None):
+        self._api.call(self._service.upgrade, image=image)
+
+
+class EventV4(EntityV4):
+    def get_host(self):
+        host = self._entity.host
+        return EntityV4(host) if host is not None else None
+
+
+class HostsV4(object):
+    def __init__(self, api):
+        self._api = api
+
+    def list(self, name=None, query=None):
+        hosts = self._api.call(
+            self._api.hostsService.list,
+            search=query if name is None else 'name=%s' % name,
+        )
+        return [HostV4(self._api, host) for host in hosts]
+
+
+class EventsV4(object):
+    def __init__(self, api):
+        self._api = api
+
+    def list(self, max=None, from_event_id=None):
+        return [
+            EventV4(event) for event in self._api.call(
+                self._api.eventsService.list,
+                max=max,
+                from_=from_event_id,
+            )
+        ]
+
+
+class ClustersV4(object):
+    def __init__(self, api):
+        self._api = api
+
+    def list(self):
+        return [
+            EntityV4(cluster) for cluster in self._api.call(
+                self._api.clustersService.list,
+            )
+        ]
+
+
+class APIV4(object):
+    """
+    The subset of the SDK v3 API used by this tool, over a single,
+    persistent SDK v4 connection.
+
+    The connection is not thread safe, its use by the host workflows
+    and by the host state poller is serialized.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._lock = threading.Lock()
+        system = connection.system_service()
+        self.hostsService = system.hosts_service()
+        self.eventsService = system.events_service()
+        self.clustersService = system.clusters_service()
+        self.hosts = HostsV4(self)
+        self.events = EventsV4(self)
+        self.clusters = ClustersV4(self)
+
+    def call(self, method, *args, **kwargs):
+        with self._lock:
+            return method(*args, **kwargs)
+
+    def disconnect(self):
+        with self._lock:
+            self._connection.close()
+
+
 def connect():
     """
     Connects to the oVirt/RHEV engine.
     """
+    url = 'https://{engineFqdn}:{port}/ovirt-engine/api'.format(
+        engineFqdn=engineFqdn,
+        port=port,
+    )
+    if sdkVersion == 4:
+        api = connectV4(url)
+    else:
+        api = connectV3(url)
+    logging.debug('Opened connection.')
+    atexit.register(disconnect)
+    return api
+
+
+def connectionError(err):
+    print(
+        'Error connecting to the engine at https://%s:%s' % (
+            engineFqdn,
+            port,
+        )
+    )
+    logging.debug(repr(err))
+    sys.exit(1)
+
+
+def connectV4(url):
+    connection = ovirtsdk4.Connection(
+        url=url,
+        username=username,
+        password=password,
+        ca_file=None if insecure else ca,
+        insecure=insecure,
+        timeout=connectionTimeout,
+    )
+    logging.debug('Connecting to %s with SDK v4.' % url)
+    try:
+        connection.test(raise_exception=True)
+    except ovirtsdk4.AuthError:
+        print(
+            'Authorization error. Invalid admin username and/or password.'
+        )
+        sys.exit(1)
+    except ovirtsdk4.Error as err:
+        connectionError(err)
+    return APIV4(connection)
+
+
+def connectV3(url):
     api_params = {
-        'url': 'https://{engineFqdn}:{port}/ovirt-engine/api'.format(
-            engineFqdn=engineFqdn,
-            port=port,
-        ),
+        'url': url,
         'username': username,
         'password': password,
         'timeout': connectionTimeout,
@@ -160,17 +867,46 @@ def connect():
             )
             sys.exit(1)
     except ovirtsdk.infrastructure.errors.ConnectionError as err:
-        print(
-            'Error connecting to the engine at https://%s:%s' % (
-                engineFqdn,
-                port,
+        connectionError(err)
+    return api
+
+
+def installHost(host):
+    if sdkVersion == 4:
+        host.install()
+    else:
+        host.install(
+            ovirtsdk.xml.params.Action(
+                ssh=ovirtsdk.xml.params.SSH(
+                    authentication_method='publickey'
+                ),
+                host=ovirtsdk.xml.params.Host(override_iptables=True),
             )
         )
-        logging.debug(repr(err))
-        sys.exit(1)
-    logging.debug('Opened connection.')
-    atexit.register(disconnect)
-    return api
+
+
+def upgradeHost(host, image=None):
+    if sdkVersion == 4:
+        host.upgrade(image=image)
+    elif image is not None:
+        host.upgrade(ovirtsdk.xml.params.Action(image=image))
+    else:
+        host.upgrade()
+
+
+def isConflict(error):
+    """
+    Return True if the engine refused the request due to a conflict.
+    """
+    if sdkVersion == 4:
+        return (
+            isinstance(error, ovirtsdk4.Error) and
+            getattr(error, 'code', None) == 409
+        )
+    return (
+        isinstance(error, ovirtsdk.infrastructure.errors.RequestError) and
+        error.status == 409
+    )
 
 
 def activateHost(
@@ -182,8 +918,8 @@ def activateHost(
     """
     Activate (move from maintenance) oVirt/RHEV host.
     """
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
+    host = statePoller(api).host(name)
+    if host is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -200,8 +936,7 @@ def activateHost(
 
         while True:
             print('.', end='')
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > activationTimeout:
                 raise TimeoutError('Timed out activating host.')
             state = getHostState(api, name)
@@ -219,8 +954,8 @@ def deactivateHost(
     """
     Deactivate (move to the maintenance) oVirt/RHEV host.
     """
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
+    host = statePoller(api).host(name)
+    if host is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -230,15 +965,15 @@ def deactivateHost(
                 'Invalid host name %s.' % name
             )
 
-    if state == HOST_STATE_UP:
+    if state in (HOST_STATE_UP, HOST_STATE_PREPARING_FOR_MAINT):
         print('\tMoving host to the maintenance', end='')
-        host.deactivate()
+        if state == HOST_STATE_UP:
+            host.deactivate()
         secs = 0
 
         while True:
             print('.', end='')
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > maintenanceTimeout:
                 raise TimeoutError(
                     'Timed out while moving host to maintenance.'
@@ -262,8 +997,8 @@ def reinstallHost(
     Expects the host to be in the maintenance, otherwise it raises
     an InvalidState exception.
     """
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
+    host = statePoller(api).host(name)
+    if host is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -273,15 +1008,12 @@ def reinstallHost(
                 'Invalid host name %s.' % name
             )
 
-    if state == HOST_STATE_MAINTENANCE:
-        host.install(
-            ovirtsdk.xml.params.Action(
-                ssh=ovirtsdk.xml.params.SSH(
-                    authentication_method='publickey'
-                ),
-                host=ovirtsdk.xml.params.Host(override_iptables=True),
-            )
-        )
+    if state == HOST_STATE_MAINTENANCE or (
+        state == HOST_STATE_INSTALLING and
+        hostPhase(name) == HOST_PHASE_INSTALLING
+    ):
+        if state == HOST_STATE_MAINTENANCE:
+            installHost(host)
         secs = 0
         while True:
             state = getHostState(api, name)
@@ -294,8 +1026,7 @@ def reinstallHost(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > waitForInstallTimeout:
                 raise TimeoutError(
                     'Timed out while waiting for host to begin installation.'
@@ -314,8 +1045,7 @@ def reinstallHost(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > installProcessTimeout:
                 raise TimeoutError('Timed out during host installation.')
 
@@ -332,15 +1062,17 @@ def upgradeoVirtNodeLegacy(
         upgradeInstallTimeout=upgradeInstallTimeout,
         upgradeRebootTimeout=upgradeRebootTimeout,
         skipInvalidHostNames=False,
+        resumePhase=None,
 ):
     """
     Performs upgrade of oVirt Legacy node.
 
     Expects the host to be in the up or maintenance, otherwise it raises
-    an InvalidState exception.
+    an InvalidState exception. Hosts resumed from resumePhase may also be
+    installing or rebooting already.
     """
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
+    host = statePoller(api).host(name)
+    if host is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -349,12 +1081,19 @@ def upgradeoVirtNodeLegacy(
             raise InvalidHostName(
                 'Invalid host name %s.' % name
             )
-    if state == HOST_STATE_UP:
-        host.upgrade(
-            ovirtsdk.xml.params.Action(
-                image='rhev-hypervisor.iso',
-            )
-        )
+    if (
+        resumePhase == HOST_PHASE_INSTALLING and
+        state in (HOST_STATE_REBOOT, HOST_STATE_NON_RESPONSIVE)
+    ):
+        resumePhase = HOST_PHASE_REBOOT
+
+    if resumePhase == HOST_PHASE_REBOOT:
+        print('\tRebooting', end='')
+    elif state == HOST_STATE_UP or (
+        resumePhase is not None and state == HOST_STATE_INSTALLING
+    ):
+        if state == HOST_STATE_UP:
+            upgradeHost(host, image='rhev-hypervisor.iso')
         secs = 0
         while True:
             state = getHostState(api, name)
@@ -367,8 +1106,7 @@ def upgradeoVirtNodeLegacy(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > waitForUpgradeTimeout:
                 raise TimeoutError(
                     'Timed out while waiting for host to begin installation.'
@@ -380,6 +1118,7 @@ def upgradeoVirtNodeLegacy(
             state = getHostState(api, name)
             if state == HOST_STATE_REBOOT:
                 print("\n\tRebooting.", end='')
+                setHostPhase(name, HOST_PHASE_REBOOT)
                 break
             elif state in HOST_INSTALL_FAILED_STATES:
                 raise RuntimeError(
@@ -387,42 +1126,40 @@ def upgradeoVirtNodeLegacy(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > upgradeInstallTimeout:
                 raise TimeoutError(
                     'Timed out while waiting for host to be re-installed.'
                 )
 
-        secs = 0
-        nonResponsiveCounter = 0
-        while True:
-            print('.', end='')
-            state = getHostState(api, name)
-            if state == HOST_STATE_UP:
-                print("\n\tInstalled.")
-                break
-            elif state in HOST_INSTALL_FAILED_STATES:
-                print('*', end='')
-                nonResponsiveCounter += 1
-                if nonResponsiveCounter >= MAX_NON_RESPONSIVE_COUNT:
-                    raise RuntimeError(
-                        'Unable to complete the reinstall operational, '
-                        'host is in mode: {0}'.format(state)
-                    )
-
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
-            if secs > upgradeRebootTimeout:
-                raise TimeoutError(
-                    'Timed out while waiting for host to reboot and activate.'
-                )
-
     else:
         raise InvalidState(
             'Host must be up before attemting an upgrade.'
         )
 
+    secs = 0
+    nonResponsiveCounter = 0
+    while True:
+        print('.', end='')
+        state = getHostState(api, name)
+        if state == HOST_STATE_UP:
+            print("\n\tInstalled.")
+            break
+        elif state in HOST_INSTALL_FAILED_STATES:
+            print('*', end='')
+            nonResponsiveCounter += 1
+            if nonResponsiveCounter >= MAX_NON_RESPONSIVE_COUNT:
+                raise RuntimeError(
+                    'Unable to complete the reinstall operational, '
+                    'host is in mode: {0}'.format(state)
+                )
+
+        secs += waitHostState(api, name)
+        if secs > upgradeRebootTimeout:
+            raise TimeoutError(
+                'Timed out while waiting for host to reboot and activate.'
+            )
+
 
 def upgradeoVirtNode(
         api,
@@ -431,15 +1168,17 @@ def upgradeoVirtNode(
         upgradeInstallTimeout=upgradeInstallTimeout,
         upgradeRebootTimeout=upgradeRebootTimeout,
         skipInvalidHostNames=False,
+        resumePhase=None,
 ):
     """
     Performs upgrade of oVirt NGN node.
 
     Expects the host to be in the up or maintenance, otherwise it raises
-    an InvalidState exception.
+    an InvalidState exception. Hosts resumed from resumePhase may also be
+    installing or rebooting already.
     """
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
+    host = statePoller(api).host(name)
+    if host is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -448,16 +1187,28 @@ def upgradeoVirtNode(
             raise InvalidHostName(
                 'Invalid host name %s.' % name
             )
-    if state == HOST_STATE_UP:
-        try:
-            host.upgrade()
-        except ovirtsdk.infrastructure.errors.RequestError as err:
-            if err.status == 409:
-                print(
-                    '\tCannot upgrade Host. '
-                    'There are no available updates for the host.'
-                )
-                return
+    if (
+        resumePhase == HOST_PHASE_INSTALLING and
+        state in (HOST_STATE_REBOOT, HOST_STATE_NON_RESPONSIVE)
+    ):
+        resumePhase = HOST_PHASE_REBOOT
+
+    if resumePhase == HOST_PHASE_REBOOT:
+        print('\tRebooting', end='')
+    elif state == HOST_STATE_UP or (
+        resumePhase is not None and state == HOST_STATE_INSTALLING
+    ):
+        if state == HOST_STATE_UP:
+            try:
+                upgradeHost(host)
+            except Exception as err:
+                if isConflict(err):
+                    print(
+                        '\tCannot upgrade Host. '
+                        'There are no available updates for the host.'
+                    )
+                    return
+                raise
         secs = 0
         while True:
             state = getHostState(api, name)
@@ -470,8 +1221,7 @@ def upgradeoVirtNode(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > waitForUpgradeTimeout:
                 raise TimeoutError(
                     'Timed out while waiting for host to begin installation.'
@@ -483,6 +1233,7 @@ def upgradeoVirtNode(
             state = getHostState(api, name)
             if state == HOST_STATE_REBOOT:
                 print("\n\tRebooting.", end='')
+                setHostPhase(name, HOST_PHASE_REBOOT)
                 break
             elif state in HOST_INSTALL_FAILED_STATES:
                 raise RuntimeError(
@@ -490,42 +1241,40 @@ def upgradeoVirtNode(
                     'host is in mode: {0}'.format(state)
                 )
 
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
+            secs += waitHostState(api, name)
             if secs > upgradeInstallTimeout:
                 raise TimeoutError(
                     'Timed out while waiting for host to be re-installed.'
                 )
 
-        secs = 0
-        nonResponsiveCounter = 0
-        while True:
-            print('.', end='')
-            state = getHostState(api, name)
-            if state == HOST_STATE_UP:
-                print("\n\tInstalled.")
-                break
-            elif state in HOST_INSTALL_FAILED_STATES:
-                print('*', end='')
-                nonResponsiveCounter += 1
-                if nonResponsiveCounter >= MAX_NON_RESPONSIVE_COUNT:
-                    raise RuntimeError(
-                        'Unable to complete the reinstall operational, '
-                        'host is in mode: {0}'.format(state)
-                    )
-
-            time.sleep(SLEEP_TIME)
-            secs += SLEEP_TIME
-            if secs > upgradeRebootTimeout:
-                raise TimeoutError(
-                    'Timed out while waiting for host to reboot and activate.'
-                )
-
     else:
         raise InvalidState(
             'Host must be up before attemting an upgrade.'
         )
 
+    secs = 0
+    nonResponsiveCounter = 0
+    while True:
+        print('.', end='')
+        state = getHostState(api, name)
+        if state == HOST_STATE_UP:
+            print("\n\tInstalled.")
+            break
+        elif state in HOST_INSTALL_FAILED_STATES:
+            print('*', end='')
+            nonResponsiveCounter += 1
+            if nonResponsiveCounter >= MAX_NON_RESPONSIVE_COUNT:
+                raise RuntimeError(
+                    'Unable to complete the reinstall operational, '
+                    'host is in mode: {0}'.format(state)
+                )
+
+        secs += waitHostState(api, name)
+        if secs > upgradeRebootTimeout:
+            raise TimeoutError(
+                'Timed out while waiting for host to reboot and activate.'
+            )
+
 
 def verifyHost(api, name, skipInvalidHostNames=False):
     """
@@ -536,7 +1285,7 @@ def verifyHost(api, name, skipInvalidHostNames=False):
     functioning.
 
     This function checks to see if the host stays up for at least for
-    HOST_UP_VERIFY_TIME seconds long.
+    hostUpVerifyTime seconds long, HOST_UP_VERIFY_TIME by default.
 
     This function expects to find the host in the 'up' state, otherwise it
     will raise InvalidState exception.
@@ -545,7 +1294,7 @@ def verifyHost(api, name, skipInvalidHostNames=False):
     state but 'up' at the end of the verification perid then InvalidState
     exception will also be raised.
     """
-    if api.hosts.list(name=name):
+    if statePoller(api).host(name) is not None:
         state = getHostState(api, name)
     else:
         if skipInvalidHostNames:
@@ -564,9 +1313,8 @@ def verifyHost(api, name, skipInvalidHostNames=False):
     secs = 0
     while True:
         print('.', end='')
-        time.sleep(SLEEP_TIME)
-        secs += SLEEP_TIME
-        if secs >= HOST_UP_VERIFY_TIME:
+        secs += waitHostState(api, name)
+        if secs >= hostUpVerifyTime:
             break
         state = getHostState(api, name)
         if state != HOST_STATE_UP:
@@ -592,17 +1340,45 @@ def verifyHost(api, name, skipInvalidHostNames=False):
     print('\n\tVerified.')
 
 
+def errorExitCode(error):
+    for errorType, code in ERROR_EXIT_CODES:
+        if isinstance(error, errorType):
+            return code
+    return None
+
+
 def processHost(api, name, skipInvalidHostNames):
+    """
+    Perform a single oVirt/RHEV host re-installation and exit on error.
+    """
+    try:
+        updateHost(api, name, skipInvalidHostNames)
+    except Exception as error:
+        code = errorExitCode(error)
+        if code is None:
+            raise
+        print('Error: ' + repr(error))
+        reportProgress(name, 'error', error=repr(error))
+        sys.exit(code)
+
+
+def updateHost(api, name, skipInvalidHostNames):
     """
     Perform a single oVirt/RHEV host re-installation.
 
     This function will first move the host to the maintenance,
     perform re-installation, then activate and verify the host.
     """
+    try:
+        _updateHost(api, name, skipInvalidHostNames)
+    finally:
+        statePoller(api).release(name)
+
+
+def _updateHost(api, name, skipInvalidHostNames):
     print("Processing Host: %s" % name)
-    if api.hosts.list(name=name):
-        host = api.hosts.list(name=name)[0]
-    else:
+    host = statePoller(api).host(name)
+    if host is None:
         print('\tInvalid host name.\n')
         if skipInvalidHostNames:
             return
@@ -613,33 +1389,253 @@ def processHost(api, name, skipInvalidHostNames):
 
     vdsType = host.get_type()
     print('Type: %s' % vdsType)
+    resumePhase = hostPhase(name)
+    if resumePhase == HOST_PHASE_DONE:
+        print('\tAlready updated.')
+        return
+    state = getHostState(api, name)
+    if resumePhase is not None:
+        print('\tResuming from the %s phase...' % resumePhase)
+    elif state != HOST_STATE_UP:
+        return
+
+    if vdsType in OVIRT_NODE_LEGACY_HOST_TYPES:
+        if pendingPhase(resumePhase, HOST_PHASE_REBOOT):
+            print('\tPerforming oVirt Node/RHEVH (Legacy) upgrade...')
+            if resumePhase is None:
+                setHostPhase(name, HOST_PHASE_INSTALLING)
+            upgradeoVirtNodeLegacy(api, name, resumePhase=resumePhase)
+    elif vdsType in OVIRT_NODE_HOST_TYPES:
+        if pendingPhase(resumePhase, HOST_PHASE_REBOOT):
+            print('\tPerforming oVirt Node NGN upgrade...')
+            if resumePhase is None:
+                setHostPhase(name, HOST_PHASE_INSTALLING)
+            upgradeoVirtNode(api, name, resumePhase=resumePhase)
+    elif pendingPhase(resumePhase, HOST_PHASE_INSTALLING):
+        print('\tPerforming host update through reinstallation...')
+        if (
+            pendingPhase(resumePhase, HOST_PHASE_MAINTENANCE) or
+            state == HOST_STATE_UP
+        ):
+            setHostPhase(name, HOST_PHASE_MAINTENANCE)
+            deactivateHost(api, name)
+        setHostPhase(name, HOST_PHASE_INSTALLING)
+        reinstallHost(api, name)
+    if pendingPhase(resumePhase, HOST_PHASE_ACTIVATE):
+        setHostPhase(name, HOST_PHASE_ACTIVATE)
+        activateHost(api, name)
+    setHostPhase(name, HOST_PHASE_VERIFY)
+    verifyHost(api, name)
+    setHostPhase(name, HOST_PHASE_DONE)
+    if runStats is not None and resumePhase is None:
+        runStats.record(name, updateMethod(vdsType))
+
+
+def processHostsInParallel(
+        api,
+        hosts,
+        skipInvalidHostNames,
+        parallel,
+        maxUnavailable,
+):
+    """
+    Perform the re-installation of up to parallel hosts at the same time,
+    with at most maxUnavailable hosts of each cluster in process.
+
+    On the first failure no more hosts are started, the hosts in process
+    are left to complete and the tool exits with the code of the error.
+    """
+    scheduler = HostScheduler(
+        hosts,
+        hostClustersByName(api, hosts),
+        maxUnavailable,
+    )
+    errors = []
+    output = HostOutput(sys.stdout)
+
+    def worker():
+        while True:
+            name = scheduler.acquire()
+            if name is None:
+                break
+            output.setHost(name)
+            try:
+                updateHost(api, name, skipInvalidHostNames)
+            except Exception as error:
+                errors.append(error)
+                scheduler.stop()
+                print('Error: ' + repr(error))
+                reportProgress(name, 'error', error=repr(error))
+                print('Stopping, waiting for hosts in process to complete.')
+            finally:
+                scheduler.release(name)
+                output.setHost(None)
+
+    sys.stdout = output
     try:
-        state = getHostState(api, name)
-        if state == HOST_STATE_UP:
-            if vdsType in OVIRT_NODE_LEGACY_HOST_TYPES:
-                print('\tPerforming oVirt Node/RHEVH (Legacy) upgrade...')
-                upgradeoVirtNodeLegacy(api, name)
-            elif vdsType in OVIRT_NODE_HOST_TYPES:
-                print('\tPerforming oVirt Node NGN upgrade...')
-                upgradeoVirtNode(api, name)
+        workers = [
+            threading.Thread(target=worker, name='host-update-%d' % i)
+            for i in range(min(parallel, len(hosts)))
+        ]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            while thread.is_alive():
+                thread.join(SLEEP_TIME)
+    finally:
+        sys.stdout = output._stream
+
+    if errors:
+        code = errorExitCode(errors[0])
+        sys.exit(code if code is not None else 1)
+
+
+def processHosts(
+        api,
+        hosts,
+        skipInvalidHostNames,
+        parallel=defaultParallel,
+        maxUnavailable=defaultMaxUnavailable,
+):
+    if parallel > 1:
+        processHostsInParallel(
+            api,
+            hosts,
+            skipInvalidHostNames,
+            parallel,
+            maxUnavailable,
+        )
+    else:
+        for host in hosts:
+            processHost(api, host, skipInvalidHostNames)
+
+
+def updateMethod(vdsType):
+    if vdsType in OVIRT_NODE_LEGACY_HOST_TYPES:
+        return UPDATE_METHOD_NODE_LEGACY
+    elif vdsType in OVIRT_NODE_HOST_TYPES:
+        return UPDATE_METHOD_NODE
+    else:
+        return UPDATE_METHOD_REINSTALL
+
+
+def collectHosts(api, names, clusters):
+    """
+    Return the names of the given hosts and of the hosts of the given
+    clusters, collected by batched search queries of up to
+    MAX_QUERY_HOSTS terms, along with the given names of invalid hosts.
+    """
+    terms = ['name=%s' % name for name in sorted(names)]
+    terms += ['cluster=%s' % name for name in sorted(clusters)]
+    found = set()
+    for i in range(0, len(terms), MAX_QUERY_HOSTS):
+        for host in api.hosts.list(
+            query=' or '.join(terms[i:i + MAX_QUERY_HOSTS]),
+        ):
+            statePoller(api).add(host)
+            found.add(host.get_name())
+    return sorted(found), sorted(set(names) - found)
+
+
+def planWaves(hosts, hostClusters, parallel, maxUnavailable):
+    """
+    Return the hosts grouped in the waves they would be processed in,
+    were the updates of all the hosts to take the same time.
+    """
+    pending = list(hosts)
+    waves = []
+    while pending:
+        wave = []
+        unavailable = {}
+        for name in list(pending):
+            if len(wave) == parallel:
+                break
+            cluster = hostClusters.get(name)
+            if unavailable.get(cluster, 0) < maxUnavailable:
+                unavailable[cluster] = unavailable.get(cluster, 0) + 1
+                pending.remove(name)
+                wave.append(name)
+        waves.append(wave)
+    return waves
+
+
+def formatDuration(secs):
+    minutes, secs = divmod(int(round(secs)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%dh %02dm' % (hours, minutes)
+    return '%dm %02ds' % (minutes, secs)
+
+
+def planHosts(api, names, clusters, parallel, maxUnavailable):
+    """
+    Show the waves the hosts would be processed in and the estimated
+    duration of the run, without changing anything.
+    """
+    hosts, invalid = collectHosts(api, names, clusters)
+    for name in invalid:
+        print('Invalid host name %s, it will not be processed.' % name)
+
+    clusterNames = dict(
+        (cluster.id, cluster.name) for cluster in api.clusters.list()
+    )
+    targets = []
+    for name in hosts:
+        state = statePoller(api).host(name).status.state
+        if state != HOST_STATE_UP:
+            print(
+                'Host %s is %s, it will not be processed.' % (name, state)
+            )
+        else:
+            targets.append(name)
+    hostClusters = hostClustersByName(api, targets)
+
+    print(
+        'Plan of %d hosts, processing %d hosts at a time, at most %d of '
+        'each cluster:' % (
+            len(targets),
+            parallel,
+            maxUnavailable,
+        )
+    )
+    total = 0
+    unknown = 0
+    for i, wave in enumerate(
+        planWaves(targets, hostClusters, parallel, maxUnavailable)
+    ):
+        estimates = []
+        for name in wave:
+            estimate = runStats.estimate(
+                updateMethod(statePoller(api).host(name).get_type())
+            )
+            if estimate is None:
+                unknown += 1
             else:
-                print('\tPerforming host update through reinstallation...')
-                deactivateHost(api, name)
-                reinstallHost(api, name)
-            activateHost(api, name)
-            verifyHost(api, name)
-    except TimeoutError as error:
-        print('Error: ' + repr(error))
-        sys.exit(1)
-    except InvalidState as error:
-        print('Error: ' + repr(error))
-        sys.exit(2)
-    except InvalidHostName as error:
-        print('Error: ' + repr(error))
-        sys.exit(3)
-    except RuntimeError as error:
-        print('Error: ' + repr(error))
-        sys.exit(4)
+                estimates.append(estimate)
+        total += max(estimates) if estimates else 0
+        print(
+            '\tWave %d: %s%s' % (
+                i + 1,
+                ', '.join(
+                    '%s (%s)' % (
+                        name,
+                        clusterNames.get(hostClusters[name]),
+                    )
+                    for name in wave
+                ),
+                (
+                    ' ~ %s' % formatDuration(max(estimates))
+                    if estimates else ''
+                ),
+            )
+        )
+    print('Estimated duration: %s' % formatDuration(total))
+    if unknown:
+        print(
+            'Not including %d hosts without previous runs of their update '
+            'method.' % unknown
+        )
 
 
 def hostsByClusterName(api, name):
@@ -651,6 +1647,7 @@ def hostsByClusterName(api, name):
     hostObjs = api.hosts.list(query=query)
 
     for host in hostObjs:
+        statePoller(api).add(host)
         hosts.add(host.get_name())
 
     logging.debug(
@@ -662,20 +1659,88 @@ def hostsByClusterName(api, name):
     return hosts
 
 
+def hostClustersByName(api, names):
+    """
+    Return the cluster id of each of the given host names, None for
+    invalid host names.
+    """
+    hostClusters = {}
+    for name in names:
+        host = statePoller(api).host(name)
+        hostClusters[name] = (
+            host.get_cluster().get_id() if host is not None else None
+        )
+    return hostClusters
+
+
+def statePoller(api):
+    """
+    Return the host state poller shared by all the host workflows.
+    """
+    global hostStatePoller
+
+    with hostStatePollerLock:
+        if hostStatePoller is None:
+            hostStatePoller = HostStatePoller(api, events=useEvents)
+        return hostStatePoller
+
+
+def waitHostState(api, name):
+    """
+    Wait for the state of the host to change, at most SLEEP_TIME
+    seconds, returning the seconds waited.
+    """
+    return statePoller(api).wait(name)
+
+
+def hostPhase(name):
+    """
+    Return the phase of the host recorded by the run journal, None when
+    the host was not started yet.
+    """
+    return runJournal.phase(name) if runJournal is not None else None
+
+
+def setHostPhase(name, phase):
+    if runJournal is not None:
+        runJournal.setPhase(name, phase)
+    if runStats is not None:
+        runStats.setPhase(name, phase)
+    reportProgress(name, 'phase', phase=phase)
+
+
+def reportProgress(name, event, **fields):
+    """
+    Write a machine readable progress record of the host, one JSON object
+    per line, when requested by --json.
+    """
+    if jsonOutput is None:
+        return
+    record = dict(fields, time=time.time(), host=name, event=event)
+    with jsonOutputLock:
+        if event == 'state':
+            if reportedStates.get(name) == fields['state']:
+                return
+            reportedStates[name] = fields['state']
+        jsonOutput.write(json.dumps(record, sort_keys=True) + '\n')
+        jsonOutput.flush()
+
+
+def pendingPhase(resumePhase, phase):
+    """
+    Return True if the phase is still to be performed by a host resumed
+    from resumePhase.
+    """
+    return (
+        resumePhase is None or
+        HOST_PHASES.index(phase) >= HOST_PHASES.index(resumePhase)
+    )
+
+
 def getHostState(api, name, skipInvalidHostNames=False):
-    if api.hosts.list(name=name):
-        state = ''
-        while not state:
-            try:
-                state = api.hosts.get(name).status.state
-            except Exception as error:
-                state = ''
-                logging.debug(
-                    'Got an exception while was '
-                    'trying to get host\'s state : %s' % (
-                        repr(error)
-                    )
-                )
+    state = statePoller(api).state(name)
+    if state is not None:
+        reportProgress(name, 'state', state=state)
         return state
     else:
         if skipInvalidHostNames:
@@ -687,7 +1752,7 @@ def getHostState(api, name, skipInvalidHostNames=False):
 
 
 def verifyHostName(api, name):
-    if api.hosts.list(name=name):
+    if statePoller(api).host(name) is not None:
         return True
     else:
         return False
@@ -711,6 +1776,7 @@ def usage():
     """
     print('\nUpdates RHEL-H hosts and upgrades oVirt Node/RHEVH Legacy hosts.')
     print('--engine = <engine FQDN>')
+    print('--port = <engine HTTPS port> (defaults to %d)' % defaultPort)
     print(
         '--username = <Admin username> '
         '(if not provided defaults to admin@internal)'
@@ -741,8 +1807,10 @@ def usage():
         '- clusters to update.'
     )
     print(
-        '--resume - Resume operation. In this mode only one host must be '
-        'specified, from which one forwards the cluster will be upgraded.'
+        '--resume - Resume operation. Without hosts the interrupted run is '
+        'continued from the run journal, each host from the phase it was '
+        'in. Otherwise only one host must be specified, from which one '
+        'forwards the cluster will be upgraded.'
     )
     print(
         '--after - When used together with --resume it will begin with the '
@@ -751,6 +1819,56 @@ def usage():
     print(
         '--skip-invalid-host-names - Skip invalid host names and continue.'
     )
+    print(
+        '--parallel = <number> - Number of hosts to process at the same '
+        'time (defaults to %d). On the first failure no more hosts are '
+        'started and the hosts in process are left to complete.' % (
+            defaultParallel,
+        )
+    )
+    print(
+        '--max-unavailable = <number> - Maximum number of hosts of each '
+        'cluster to process at the same time, which are unavailable for '
+        'running VMs (defaults to %d).' % (
+            defaultMaxUnavailable,
+        )
+    )
+    print(
+        '--journal = <file> - Run journal recording the phase of each host, '
+        'removed once all the hosts are processed (defaults to %s).' % (
+            JOURNAL_FILE,
+        )
+    )
+    print(
+        '--plan - Show the waves the hosts would be processed in, given '
+        '--parallel and --max-unavailable, and the estimated duration '
+        'based on the previous runs, without changing anything.'
+    )
+    print(
+        '--stats = <file> - Durations of the phases of the previous runs, '
+        'used by --plan (defaults to %s).' % (
+            STATS_FILE,
+        )
+    )
+    print(
+        '--verify-time = <seconds> - Time the hosts have to stay up after '
+        'the update (defaults to %d).' % HOST_UP_VERIFY_TIME
+    )
+    print(
+        '--sdk = <4|3> - Version of the oVirt Python SDK to use (defaults '
+        'to %d). SDK v4 keeps a single connection to the engine.' % (
+            sdkVersion,
+        )
+    )
+    print(
+        '--json - Write the progress as JSON records, one per line, with '
+        'the host, the event (phase, state or error) and its time, to the '
+        'standard output, the rest of the output goes to the standard error.'
+    )
+    print(
+        '--no-events - Poll the state of the hosts every %d seconds '
+        'instead of following the engine events.' % SLEEP_TIME
+    )
     print(
         '-d | ---debug - Show debugging information. '
         'Note! This will expose admin password in clear text.'
@@ -772,11 +1890,21 @@ if __name__ == '__main__':
                 'resume',
                 'after',
                 'engine=',
+                'port=',
                 'username=',
                 'password=',
                 'ca=',
                 'insecure',
                 'skip-invalid-host-names',
+                'parallel=',
+                'max-unavailable=',
+                'verify-time=',
+                'no-events',
+                'journal=',
+                'plan',
+                'stats=',
+                'sdk=',
+                'json',
                 'debug'
             ],
         )
@@ -797,6 +1925,12 @@ if __name__ == '__main__':
     ca = '/etc/pki/ovirt-engine/ca.pem'
     insecure = False
     skipInvalidHostNames = False
+    parallel = defaultParallel
+    maxUnavailable = defaultMaxUnavailable
+    journalFile = JOURNAL_FILE
+    statsFile = STATS_FILE
+    plan = False
+    jsonProgress = False
     debug = False
     loggingLevel = logging.CRITICAL
 
@@ -824,6 +1958,45 @@ if __name__ == '__main__':
             insecure = True
         elif opt in ('--skip-invalid-host-names'):
             skipInvalidHostNames = True
+        elif opt in ('--no-events'):
+            useEvents = False
+        elif opt in ('--journal'):
+            journalFile = arg
+        elif opt in ('--plan'):
+            plan = True
+        elif opt in ('--stats'):
+            statsFile = arg
+        elif opt in ('--json'):
+            jsonProgress = True
+        elif opt in ('--sdk'):
+            if arg not in ('3', '4'):
+                print('--sdk requires either 3 or 4.')
+                sys.exit(1)
+            sdkVersion = int(arg)
+            if {3: ovirtsdk, 4: ovirtsdk4}[sdkVersion] is None:
+                print('oVirt Python SDK v%d is not installed.' % sdkVersion)
+                sys.exit(1)
+        elif opt in (
+            '--port',
+            '--parallel',
+            '--max-unavailable',
+            '--verify-time',
+        ):
+            try:
+                value = int(arg)
+            except ValueError:
+                value = 0
+            if value < 1:
+                print('%s requires a positive number.' % opt)
+                sys.exit(1)
+            if opt == '--port':
+                port = value
+            elif opt == '--parallel':
+                parallel = value
+            elif opt == '--max-unavailable':
+                maxUnavailable = value
+            else:
+                hostUpVerifyTime = value
         elif opt in ('-d', '--debug'):
             debug = True
 
@@ -888,6 +2061,7 @@ if __name__ == '__main__':
     logging.debug('cluster(s): %s' % (clusters if clusters else None))
     logging.debug('resume: %s' % resume)
     logging.debug('engine: %s' % engineFqdn)
+    logging.debug('port: %s' % port)
     logging.debug('username: %s' % username)
     logging.debug('password: %s' % ('*' * len(password) if password else None))
     logging.debug(
@@ -895,11 +2069,64 @@ if __name__ == '__main__':
     )
     logging.debug('insecure: %s' % insecure)
     logging.debug('skip invalid host names: %s' % skipInvalidHostNames)
+    logging.debug('parallel: %s' % parallel)
+    logging.debug('max unavailable: %s' % maxUnavailable)
+    logging.debug('verify time: %s' % hostUpVerifyTime)
+    logging.debug('use events: %s' % useEvents)
+    logging.debug('journal: %s' % journalFile)
+    logging.debug('stats: %s' % statsFile)
+    logging.debug('plan: %s' % plan)
+    logging.debug('sdk: %s' % sdkVersion)
+    logging.debug('json: %s' % jsonProgress)
     logging.debug('debug: %s' % debug)
 
+    if jsonProgress:
+        jsonOutput = sys.stdout
+        sys.stdout = sys.stderr
+
     api = connect()
+    runJournal = RunJournal(os.path.expanduser(journalFile))
+    runStats = RunStats(os.path.expanduser(statsFile))
 
-    if not resume:
+    if plan:
+        if resume:
+            print('Plan option cannot be used together with resume.')
+            sys.exit(1)
+        planHosts(
+            api,
+            set(host for host in hosts.split(',') if host) if hosts else (),
+            set(
+                cluster for cluster in clusters.split(',') if cluster
+            ) if clusters else (),
+            parallel,
+            maxUnavailable,
+        )
+        sys.exit(0)
+
+    if resume and not hosts:
+        if not runJournal.exists():
+            print(
+                'Resume option requires a host option to be specified '
+                'or a run journal at %s.' % journalFile
+            )
+            sys.exit(1)
+        hosts = runJournal.load()
+        pending = runJournal.pending()
+        print(
+            'Resuming run from %s, %d of %d hosts left to process' % (
+                journalFile,
+                len(pending),
+                len(hosts),
+            )
+        )
+        processHosts(
+            api,
+            pending,
+            skipInvalidHostNames,
+            parallel,
+            maxUnavailable,
+        )
+    elif not resume:
         if hosts:
             hosts = set(host for host in hosts.split(',') if host)
 
@@ -915,26 +2142,25 @@ if __name__ == '__main__':
             print('No hosts to process.\n')
             sys.exit(3)
         hosts = sorted(hosts)
-        for host in hosts:
-            processHost(api, host, skipInvalidHostNames)
+        runJournal.begin(hosts)
+        processHosts(
+            api,
+            hosts,
+            skipInvalidHostNames,
+            parallel,
+            maxUnavailable,
+        )
     else:
-        if hosts:
-            hosts = list(host for host in hosts.split(',') if host)
-            if len(hosts) > 1:
-                print('Resume option requires host option of a single host.')
-                sys.exit(1)
-        else:
-            print(
-                'Resume option requires a host option to be specified.'
-            )
+        hosts = list(host for host in hosts.split(',') if host)
+        if len(hosts) > 1:
+            print('Resume option requires host option of a single host.')
             sys.exit(1)
         name = hosts[0]
         if name.endswith('++') or name.endswith('+1'):
             name = name[:-2]
             after = True
-        if api.hosts.list(name=name):
-            hostObj = api.hosts.list(name=name)[0]
-        else:
+        hostObj = statePoller(api).host(name)
+        if hostObj is None:
             print('Invalid host name.\n')
             sys.exit(3)
         hostClusterObj = hostObj.get_cluster()
@@ -963,5 +2189,13 @@ if __name__ == '__main__':
             )
         )
         hosts = hosts[hostIndex:]
-        for host in hosts:
-            processHost(api, host, skipInvalidHostNames)
+        runJournal.begin(hosts)
+        processHosts(
+            api,
+            hosts,
+            skipInvalidHostNames,
+            parallel,
+            maxUnavailable,
+        )
+
+    runJournal.remove()
@@ -21,54 +21,217 @@
 
 from __future__ import absolute_import
 
+import argparse
 import socket
+import sys
 import time
 
 import ovirtsdk4 as sdk
 import ovirtsdk4.types as types
 
+URL_DEFAULT = 'https://%s/ovirt-engine/api' % socket.getfqdn()
+USERNAME_DEFAULT = 'admin@internal'
+CA_DEFAULT = '/etc/pki/ovirt-engine/ca.pem'
+
+HOSTS_SEARCH = 'datacenter=%s and spm_id=1'
+MAINTENANCE_TIMEOUT = 900
+
 
 def main():
-    with get_connection() as connection:
+    args = parse_args()
+    with get_connection(args) as connection:
         system_service = connection.system_service()
 
         dc_service = system_service.data_centers_service()
         datacenters = dc_service.list()
-        if len(datacenters) > 1:
-            heDc = select_dc(datacenters)
+        if args.all_datacenters:
+            heDcs = datacenters
+        elif args.datacenter:
+            heDcs = find_dcs(datacenters, args.datacenter)
+        elif len(datacenters) > 1:
+            heDcs = [select_dc(datacenters)]
         else:
-            heDc = datacenters.pop()
+            heDcs = [datacenters.pop()]
 
         host_services = system_service.hosts_service()
-        hosts = host_services.list(search='datacenter=%s and spm_id=1'
-                                   % heDc.name)
-        for host in hosts:
-            host_service = host_services.host_service(host.id)
+        searches = [HOSTS_SEARCH % heDc.name for heDc in heDcs]
+        if args.parallel:
+            deactivate_hosts(
+                host_services,
+                searches,
+                args.parallel,
+                args.timeout,
+                args.interval,
+            )
+            return
+
+        for search in searches:
+            hosts = host_services.list(search=search)
+            for host in hosts:
+                host_service = host_services.host_service(host.id)
+                if host.status == types.HostStatus.UP:
+                    print("Putting host %s to maintenance" % host.name)
+                    host_service.deactivate()
+                    while True:
+                        updated_host = host_service.get()
+                        if (
+                            updated_host.status ==
+                            types.HostStatus.MAINTENANCE
+                        ):
+                            print("Host is in Maintenance state")
+                            break
+                        print(
+                            "Waiting for host to switch into "
+                            "Maintenance state"
+                        )
+                        time.sleep(args.interval)
+
+
+def deactivate_hosts(host_services, searches, parallel, timeout, interval):
+    """
+    Put all the up hosts matching the searches to maintenance, with at
+    most parallel hosts switching at the same time, waiting on all of
+    them by a single polling loop.
+    """
+    pending = []
+    for search in searches:
+        for host in host_services.list(search=search):
             if host.status == types.HostStatus.UP:
-                print("Putting host %s to maintenance" % host.name)
-                host_service.deactivate()
-                while True:
-                    updated_host = host_service.get()
-                    if updated_host.status == types.HostStatus.MAINTENANCE:
-                        print("Host is in Maintenance state")
-                        return
-                    print("Waiting for host to switch into Maintenance state")
-                    time.sleep(1)
-
-
-def get_connection():
-    URL_DEFAULT = 'https://%s/ovirt-engine/api' % socket.getfqdn()
-    USERNAME_DEFAULT = 'admin@internal'
-    CA_DEFAULT = '/etc/pki/ovirt-engine/ca.pem'
-
-    url = raw_input("Engine REST API url[%s]:" % URL_DEFAULT)
+                pending.append(host)
+            else:
+                print(
+                    "Skipping host %s in %s state" % (
+                        host.name,
+                        host.status.value,
+                    )
+                )
+
+    switching = {}
+    deadline = time.time() + timeout
+    while pending or switching:
+        while pending and len(switching) < parallel:
+            host = pending.pop(0)
+            print("Putting host %s to maintenance" % host.name)
+            host_services.host_service(host.id).deactivate()
+            switching[host.id] = host.name
+
+        time.sleep(interval)
+        for search in searches:
+            for host in host_services.list(search=search):
+                if (
+                    host.id in switching and
+                    host.status == types.HostStatus.MAINTENANCE
+                ):
+                    del switching[host.id]
+                    print("Host %s is in Maintenance state" % host.name)
+
+        if switching:
+            if time.time() > deadline:
+                sys.exit(
+                    "Timed out waiting for hosts %s to switch into "
+                    "Maintenance state" % ', '.join(
+                        sorted(switching.values())
+                    )
+                )
+            print(
+                "Waiting for hosts %s to switch into Maintenance state" % (
+                    ', '.join(sorted(switching.values())),
+                )
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Put the hosts of the Hosted Engine Data Center to maintenance. '
+            'Connection details which are not given are prompted for.'
+        ),
+    )
+    parser.add_argument(
+        '--url',
+        help='Engine REST API url, e.g. %s' % URL_DEFAULT,
+    )
+    parser.add_argument(
+        '--username',
+        help='Engine REST API username, e.g. %s' % USERNAME_DEFAULT,
+    )
+    parser.add_argument(
+        '--password-file',
+        help='File containing the Engine REST API password',
+    )
+    parser.add_argument(
+        '--ca-file',
+        help='Engine CA certificate file, e.g. %s' % CA_DEFAULT,
+    )
+    parser.add_argument(
+        '--datacenter',
+        action='append',
+        help=(
+            'Data Center which will run Hosted Engine, may be given more '
+            'than once'
+        ),
+    )
+    parser.add_argument(
+        '--all-datacenters',
+        action='store_true',
+        help='Put the hosts of all the Data Centers to maintenance',
+    )
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=0,
+        metavar='N',
+        help=(
+            'Put all the hosts to maintenance, at most N at the same time, '
+            'instead of the first one only'
+        ),
+    )
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        default=MAINTENANCE_TIMEOUT,
+        help=(
+            'Seconds to wait for the hosts to switch into Maintenance '
+            'state with --parallel (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=1,
+        help='Seconds between host state checks (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    if args.parallel < 0:
+        parser.error('--parallel requires a positive number')
+    if args.datacenter and args.all_datacenters:
+        parser.error(
+            '--datacenter cannot be used together with --all-datacenters'
+        )
+    return args
+
+
+def get_connection(args):
+    url = args.url
+    if not url:
+        url = raw_input("Engine REST API url[%s]:" % URL_DEFAULT)
     if not url:
         url = URL_DEFAULT
-    username = raw_input("Engine REST API username[%s]:" % USERNAME_DEFAULT)
+    username = args.username
+    if not username:
+        username = raw_input(
+            "Engine REST API username[%s]:" % USERNAME_DEFAULT
+        )
     if not username:
         username = USERNAME_DEFAULT
-    password = raw_input("Engine REST API password:")
-    ca_file = raw_input("Engine CA certificate file[%s]:" % CA_DEFAULT)
+    if args.password_file:
+        with open(args.password_file) as f:
+            password = f.readline().rstrip('\n')
+    else:
+        password = raw_input("Engine REST API password:")
+    ca_file = args.ca_file
+    if not ca_file:
+        ca_file = raw_input("Engine CA certificate file[%s]:" % CA_DEFAULT)
     if not ca_file:
         ca_file = CA_DEFAULT
 
@@ -80,6 +243,14 @@ def get_connection():
     )
 
 
+def find_dcs(datacenters, names):
+    dcs = dict((dc.name, dc) for dc in datacenters)
+    missing = [name for name in names if name not in dcs]
+    if missing:
+        sys.exit("Unknown Data Center: %s" % ', '.join(missing))
+    return [dcs[name] for name in names]
+
+
 def select_dc(datacenters):
     while True:
         for i, dc in enumerate(datacenters):
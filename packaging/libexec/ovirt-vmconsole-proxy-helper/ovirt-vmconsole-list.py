@@ -228,10 +228,14 @@ def main():
     try:
         args = parse_args()
 
-        cfg_file = configfile.ConfigFile([
-            config.VMCONSOLE_PROXY_HELPER_DEFAULTS,
-            config.VMCONSOLE_PROXY_HELPER_VARS,
-        ])
+        with service.profilePhase('config'):
+            cfg_file = configfile.ConfigFile(
+                [
+                    config.VMCONSOLE_PROXY_HELPER_DEFAULTS,
+                    config.VMCONSOLE_PROXY_HELPER_VARS,
+                ],
+                cache=config.VMCONSOLE_PROXY_HELPER_CACHE,
+            )
 
         if cfg_file.getboolean('DEBUG') or args.debug:
             logger.setLevel(logging.DEBUG)
@@ -244,8 +248,9 @@ def main():
 
         logger.debug('using engine base url: %s', base_url)
 
-        enc = make_ticket_encoder(cfg_file)
-        data = enc.encode(json.dumps(make_request(args)))
+        with service.profilePhase('ticket'):
+            enc = make_ticket_encoder(cfg_file)
+            data = enc.encode(json.dumps(make_request(args)))
         req = urllib2.Request(
             urlparse.urljoin(base_url, 'services/vmconsole-proxy'),
             data=data,
@@ -264,7 +269,7 @@ def main():
                         'connecting in insecure mode')
             ca_certs = None
 
-        with urlopen(
+        with service.profilePhase('request'), urlopen(
             url=req,
             ca_certs=ca_certs,
             verify_host=cfg_file.getboolean('ENGINE_VERIFY_HOST')
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import json
+import os
 
 from ansible.plugins.callback import CallbackBase
 
@@ -11,28 +12,65 @@ class CallbackModule(CallbackBase):
     """
     This callback module print list of packages which yum module report to be
     updated. It checks only tasks with are tagged by 'updatecheck' tag.
+
+    If the OVIRT_CALLBACK_STREAMING environment variable is set to a true
+    value, a JSON record with the packages is printed per line for every
+    such task result as it arrives, followed by a final record with the
+    stats of the hosts.
     """
     CALLBACK_VERSION = 2.0
     CALLBACK_TYPE = 'stdout'
     CALLBACK_NAME = 'hostupgradeplugin'
 
     FETCH_PACKAGES_WITH_TAG = 'updatecheck'
+    STREAMING_ENV = 'OVIRT_CALLBACK_STREAMING'
 
     def __init__(self, display=None):
         super(CallbackModule, self).__init__(display)
         self.packages = []
+        self.streaming = os.environ.get(self.STREAMING_ENV, '').lower() in (
+            't', 'true', 'y', 'yes', '1',
+        )
 
-    def v2_runner_on_ok(self, result, **kwargs):
+    def _on_result(self, result, status):
         if self.FETCH_PACKAGES_WITH_TAG in result._task.tags:
             changes = result._result.get('changes', dict())
-            self.packages.extend(changes.get('installed', []))
-            self.packages.extend([
+            packages = changes.get('installed', []) + [
                 pkg[0] for pkg in changes.get('updated', [])
-            ])
+            ]
+            if self.streaming:
+                self._display.display(
+                    json.dumps({
+                        'host': result._host.get_name(),
+                        'task': result._task.get_name(),
+                        'status': status,
+                        'packages': packages,
+                    })
+                )
+            else:
+                self.packages.extend(packages)
 
-    def v2_playbook_on_stats(self, stats):
-        self._display.display(json.dumps(self.packages))
+    def v2_runner_on_ok(self, result, **kwargs):
+        self._on_result(result, 'ok')
 
-    v2_runner_on_failed = v2_runner_on_ok
-    v2_runner_on_unreachable = v2_runner_on_ok
-    v2_runner_on_skipped = v2_runner_on_ok
+    def v2_runner_on_failed(self, result, **kwargs):
+        self._on_result(result, 'failed')
+
+    def v2_runner_on_unreachable(self, result, **kwargs):
+        self._on_result(result, 'unreachable')
+
+    def v2_runner_on_skipped(self, result, **kwargs):
+        self._on_result(result, 'skipped')
+
+    def v2_playbook_on_stats(self, stats):
+        if self.streaming:
+            self._display.display(
+                json.dumps({
+                    'stats': dict(
+                        (host, stats.summarize(host))
+                        for host in sorted(stats.processed)
+                    ),
+                })
+            )
+        else:
+            self._display.display(json.dumps(self.packages))
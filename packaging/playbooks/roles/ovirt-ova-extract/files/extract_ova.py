@@ -1,36 +1,380 @@
 #!/usr/bin/python
 
+import glob
+import hashlib
 import io
+import json
 import mmap
 import os
+import Queue
+import re
 import sys
+import threading
+import time
 
 
 from contextlib import closing
+from multiprocessing.pool import ThreadPool
 
 NUL = b"\0"
-BUF_SIZE = 8 * 1024**2
+BUF_SIZE = int(os.environ.get('OVIRT_OVA_BUF_SIZE', 8 * 1024**2))
 TAR_BLOCK_SIZE = 512
+MAX_WORKERS = 4
+MANIFEST_ENTRY = re.compile(
+    flags=re.VERBOSE,
+    pattern=r"""
+        ^
+        \s*
+        (?P<algorithm>\w+)
+        \((?P<name>.+)\)
+        \s*=\s*
+        (?P<digest>[0-9a-fA-F]+)
+        \s*
+        $
+    """
+)
+
+PROGRESS_INTERVAL = 10
+PROGRESS_FILE_ENV = 'OVIRT_OVA_PROGRESS_FILE'
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_DIR = '/var/tmp'
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def log(message):
+    # the standard output is reserved for the JSON progress events
+    sys.stderr.write("%s\n" % message)
+
+
+class Checksum(threading.Thread):
+    """
+    Digest of the copied data, computed on a separate thread.
+
+    The buffer passed to update() must not be modified before wait()
+    returns, thus the copy loop alternates between two buffers so that
+    hashing one chunk overlaps with the I/O of the next one.
+    """
+
+    def __init__(self, algorithm):
+        super(Checksum, self).__init__()
+        self.daemon = True
+        self.algorithm = algorithm
+        self._hash = hashlib.new(algorithm)
+        self._chunks = Queue.Queue()
+        self.start()
+
+    def run(self):
+        while True:
+            chunk = self._chunks.get()
+            try:
+                if chunk is None:
+                    break
+                self._hash.update(chunk)
+            finally:
+                self._chunks.task_done()
+
+    def update(self, buf, size):
+        self._chunks.put(buffer(buf, 0, size))
+
+    def wait(self):
+        self._chunks.join()
+
+    def partial(self):
+        """
+        Digest of the data passed so far, recorded by checkpoints.
+        """
+        self.wait()
+        return self._hash.copy().hexdigest()
+
+    def hexdigest(self):
+        self._chunks.put(None)
+        self.join()
+        return self._hash.hexdigest()
+
+
+class Checkpoint(object):
+    """
+    Sidecar state file recording the progress of the copy, so that an
+    interrupted run can be resumed. The file is replaced atomically and
+    fsynced on every save. Without a path, the state is only kept in
+    memory, for runs which are not meant to be resumed.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.state = {}
+        self._lock = threading.Lock()
+        self._last = time.time()
+
+    def load(self):
+        if self.path is None:
+            return self.state
+        try:
+            with open(self.path, 'r') as f:
+                self.state = json.load(f)
+        except (IOError, ValueError):
+            self.state = {}
+        return self.state
+
+    def due(self):
+        # without a path there is nothing to record, nor to sync for it
+        return (
+            self.path is not None and
+            time.time() - self._last >= self.interval
+        )
+
+    def set(self, key, value):
+        with self._lock:
+            self.state[key] = value
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            fd = os.open(
+                os.path.dirname(os.path.abspath(self.path)),
+                os.O_RDONLY,
+            )
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._last = time.time()
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ProgressReporter(object):
+    """
+    Writes progress events as JSON lines to stdout or, if the
+    OVIRT_OVA_PROGRESS_FILE environment variable is set, to that file.
+    """
+
+    def __init__(self, path=None, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._copied = 0
+        self._read_time = 0.0
+        self._write_time = 0.0
+        self._output = open(path, 'a') if path else sys.stdout
+
+    def emit(self, event, **values):
+        values['event'] = event
+        values['time'] = round(time.time(), 3)
+        with self._lock:
+            self._output.write(json.dumps(values, sort_keys=True) + '\n')
+            self._output.flush()
+
+    def disk(self, name, total, resumed=0):
+        return DiskProgress(self, name, total, resumed)
+
+    def add(self, copied, read_time, write_time):
+        with self._lock:
+            self._copied += copied
+            self._read_time += read_time
+            self._write_time += write_time
+
+    def summary(self):
+        elapsed = time.time() - self._start
+        self.emit(
+            'summary',
+            bytes=self._copied,
+            elapsed=round(elapsed, 3),
+            rate=mb_per_sec(self._copied, elapsed),
+            read_time=round(self._read_time, 3),
+            write_time=round(self._write_time, 3),
+        )
+        if self._output is not sys.stdout:
+            self._output.close()
+
+
+class DiskProgress(object):
+    """
+    Progress of a single disk copy, reported at most once per interval.
+    """
+
+    def __init__(self, reporter, name, total, resumed=0):
+        self.read_time = 0.0
+        self.write_time = 0.0
+        self._reporter = reporter
+        self._name = name
+        self._total = total
+        self._resumed = resumed
+        self._copied = resumed
+        self._start = time.time()
+        self._last = self._start
+        self._reporter.emit('start', disk=name, total=total, resumed=resumed)
+
+    def update(self, copied):
+        self._copied += copied
+        now = time.time()
+        if now - self._last >= self._reporter.interval:
+            self._last = now
+            elapsed = now - self._start
+            copied = self._copied - self._resumed
+            rate = copied / elapsed if elapsed else 0
+            self._reporter.emit(
+                'progress',
+                disk=self._name,
+                done=self._copied,
+                total=self._total,
+                rate=mb_per_sec(copied, elapsed),
+                eta=(
+                    round(max(self._total - self._copied, 0) / rate, 1)
+                    if rate else None
+                ),
+            )
+
+    def done(self):
+        elapsed = time.time() - self._start
+        copied = self._copied - self._resumed
+        self._reporter.add(copied, self.read_time, self.write_time)
+        self._reporter.emit(
+            'done',
+            disk=self._name,
+            done=self._copied,
+            total=self._total,
+            elapsed=round(elapsed, 3),
+            rate=mb_per_sec(copied, elapsed),
+            read_time=round(self.read_time, 3),
+            write_time=round(self.write_time, 3),
+        )
+
+
+def mb_per_sec(size, elapsed):
+    return round(size / elapsed / 1024**2, 2) if elapsed else None
+
+
+def resume_disk(ova_path, offset, image_path, partial, algorithm=None):
+    """
+    Validate the data already extracted to the image, returning the
+    checksum primed with that data, or None if the data cannot be
+    trusted. Without a checksum, the last chunk of the image is compared
+    with the OVA instead.
+    """
+    copied = partial['copied']
+    checksum = Checksum(algorithm) if algorithm else None
+    valid = True
+    with io.open(ova_path, "rb") as ova_file, \
+            io.open(image_path, "rb") as image:
+        if checksum:
+            buf = mmap.mmap(-1, BUF_SIZE)
+            with closing(buf):
+                remaining = copied
+                while remaining > 0:
+                    read = image.readinto(buf)
+                    if read == 0:
+                        break
+                    read = min(read, remaining)
+                    checksum.update(buf, read)
+                    checksum.wait()
+                    remaining -= read
+            valid = not remaining and checksum.partial() == partial['digest']
+        else:
+            tail = min(BUF_SIZE, copied)
+            ova_file.seek(offset + copied - tail)
+            image.seek(copied - tail)
+            valid = ova_file.read(tail) == image.read(tail)
+    if not valid:
+        log("discarding partially extracted data of %s" % image_path)
+        if checksum:
+            # stop the thread of the discarded checksum
+            checksum.hexdigest()
+        return False, Checksum(algorithm) if algorithm else None
+    return True, checksum
 
 
-def extract_disk(ova_file, disk_size, image_path):
+def extract_disk(
+    ova_path,
+    name,
+    offset,
+    disk_size,
+    image_path,
+    reporter,
+    checkpoint,
+    algorithm=None,
+    partial=None,
+):
+    """
+    Copy the disk to its image, returning the digest of the copied data
+    if an algorithm is specified.
+    """
+    copied = 0
+    if partial is not None and partial['copied']:
+        resumed, checksum = resume_disk(
+            ova_path,
+            offset,
+            image_path,
+            partial,
+            algorithm,
+        )
+        if resumed:
+            copied = partial['copied']
+    else:
+        checksum = Checksum(algorithm) if algorithm else None
+    progress = reporter.disk(name, disk_size, copied)
+    # every disk gets its own descriptors so the disks can be
+    # extracted concurrently, each reading from its own position
+    ova_fd = os.open(ova_path, os.O_RDONLY | os.O_DIRECT)
     fd = os.open(image_path, os.O_RDWR | os.O_DIRECT)
-    buf = mmap.mmap(-1, BUF_SIZE)
-    with closing(buf), io.FileIO(fd, "r+", closefd=True) as image:
-        copied = 0
+    bufs = (mmap.mmap(-1, BUF_SIZE), mmap.mmap(-1, BUF_SIZE))
+    with closing(bufs[0]), closing(bufs[1]), \
+            io.FileIO(ova_fd, "r", closefd=True) as ova_file, \
+            io.FileIO(fd, "r+", closefd=True) as image:
+        ova_file.seek(offset + copied)
+        image.seek(copied)
+        chunk = 0
         while copied < disk_size:
+            buf = bufs[chunk % 2]
+            chunk += 1
+            start = time.time()
             read = ova_file.readinto(buf)
+            progress.read_time += time.time() - start
+            if read == 0:
+                raise RuntimeError(
+                    'unexpected end of file while extracting %s' % image_path
+                )
             remaining = disk_size - copied
             if remaining < read:
                 # read too much (disk size is not aligned
-                # with BUF_SIZE), thus need to go back
-                ova_file.seek(remaining - read, 1)
+                # with BUF_SIZE), the rest belongs to the next member
                 read = remaining
+            if checksum:
+                # the other buffer is reused by the next read
+                checksum.wait()
+                checksum.update(buf, read)
+            start = time.time()
             written = 0
             while written < read:
                 wbuf = buffer(buf, written, read - written)
                 written += image.write(wbuf)
+            progress.write_time += time.time() - start
+            progress.update(written)
             copied += written
+            if checkpoint.due():
+                # the data must be on disk before it is recorded
+                os.fsync(image.fileno())
+                checkpoint.set(
+                    name,
+                    {
+                        'copied': copied,
+                        'digest': checksum.partial() if checksum else None,
+                    },
+                )
+        os.fsync(image.fileno())
+    progress.done()
+    return checksum.hexdigest() if checksum else None
 
 
 def nts(s, encoding, errors):
@@ -61,44 +405,178 @@ def nti(s):
             s = nts(s, "ascii", "strict")
             n = int(s.strip() or "0", 8)
         except ValueError:
-            print 'invalid header'
+            log('invalid header')
             raise
     return n
 
 
-def extract_disks(ova_path, image_paths):
-    fd = os.open(ova_path, os.O_RDONLY | os.O_DIRECT)
-    buf = mmap.mmap(-1, TAR_BLOCK_SIZE)
-    with io.FileIO(fd, "r", closefd=True) as ova_file, \
-            closing(buf):
+def padded_size(size):
+    remainder = size % TAR_BLOCK_SIZE
+    if remainder:
+        size += TAR_BLOCK_SIZE - remainder
+    return size
+
+
+def read_members(ova_path):
+    """
+    Build an index of the tar members as (name, offset, size) tuples
+    by reading only the headers and seeking over the members data.
+    """
+    members = []
+    with io.open(ova_path, "rb") as ova_file:
         while True:
-            # read next tar info
-            ova_file.readinto(buf)
-            info = buf.read(512)
+            offset = ova_file.tell()
+            info = ova_file.read(TAR_BLOCK_SIZE)
             # tar files end with NUL blocks
-            if info == NUL*512:
+            if len(info) < TAR_BLOCK_SIZE or info == NUL * TAR_BLOCK_SIZE:
                 break
-            # preparation for the next iteration
-            buf.seek(0)
-            # extract the next disk to the corresponding image
             name = nts(info[0:100], 'utf-8', 'surrogateescape')
             size = nti(info[124:136])
-            if name.lower().endswith('ovf'):
-                jump = size
-                # ovf is typically not aligned to 512 bytes blocks
-                remainder = size % TAR_BLOCK_SIZE
-                if remainder:
-                    jump += TAR_BLOCK_SIZE - remainder
-                ova_file.seek(jump, 1)
-            else:
-                for image_path in image_paths:
-                    if name in image_path:
-                        extract_disk(ova_file, size, image_path)
-                        break
+            members.append((name, offset + TAR_BLOCK_SIZE, size))
+            ova_file.seek(padded_size(size), 1)
+    return members
+
+
+def map_images(image_paths):
+    """
+    Map every trailing part of the image paths to the image path, so a
+    member named either by file name or by a relative path is found with
+    a single lookup.
+    """
+    images = {}
+    for image_path in image_paths:
+        parts = image_path.strip('/').split('/')
+        for i in range(len(parts)):
+            images.setdefault('/'.join(parts[i:]), image_path)
+    return images
+
+
+def member_name(name):
+    return name[2:] if name.startswith('./') else name
+
+
+def read_manifest(ova_path, offset, size):
+    """
+    Return the digests listed in an OVF manifest as a dict of
+    member name to (algorithm, digest).
+    """
+    with io.open(ova_path, "rb") as ova_file:
+        ova_file.seek(offset)
+        manifest = ova_file.read(size).decode('utf-8')
+    digests = {}
+    for line in manifest.splitlines():
+        match = MANIFEST_ENTRY.match(line)
+        if match is not None:
+            digests[member_name(match.group('name'))] = (
+                match.group('algorithm').lower(),
+                match.group('digest').lower(),
+            )
+    return digests
+
+
+def extract_disks(ova_path, image_paths, reporter, checkpoint):
+    images = map_images(image_paths)
+    members = read_members(ova_path)
+    digests = {}
+    for name, offset, size in members:
+        if name.lower().endswith('.mf'):
+            digests = read_manifest(ova_path, offset, size)
+
+    jobs = []
+    for name, offset, size in members:
+        if name.lower().endswith(('ovf', '.mf')):
+            continue
+        name = member_name(name)
+        image_path = images.get(name)
+        if image_path is None:
+            continue
+        partial = checkpoint.state.get(name)
+        if partial is not None and partial.get('done'):
+            log("skipping completed disk: %s" % name)
+            continue
+        jobs.append((name, offset, size, image_path, partial))
+
+    def extract(job):
+        name, offset, size, image_path, partial = job
+        algorithm, expected = digests.get(name, (None, None))
+        actual = extract_disk(
+            ova_path,
+            name,
+            offset,
+            size,
+            image_path,
+            reporter,
+            checkpoint,
+            algorithm,
+            partial,
+        )
+        if expected is not None and actual != expected:
+            raise RuntimeError(
+                'checksum mismatch for %s: expected %s, got %s' % (
+                    name,
+                    expected,
+                    actual,
+                )
+            )
+        checkpoint.set(name, {'copied': size, 'done': True})
+
+    if not jobs:
+        return
+    pool = ThreadPool(min(len(jobs), MAX_WORKERS))
+    try:
+        # map() re-raises the first failure of any of the workers
+        pool.map(extract, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def checkpoint_path(ova_path, image_paths):
+    # the OVA may reside on read-only storage, thus the state of the
+    # extraction is kept locally, keyed by the source and the targets
+    key = hashlib.sha1(
+        '\0'.join([ova_path] + image_paths).encode('utf-8')
+    ).hexdigest()
+    return os.path.join(
+        CHECKPOINT_DIR,
+        'ovirt-ova-extract-%s.checkpoint' % key,
+    )
+
+
+def remove_stale_checkpoints():
+    # checkpoints of runs which failed and were never resumed are left
+    # behind, drop them once they are too old to be resumed anyway
+    now = time.time()
+    for path in glob.glob(
+        os.path.join(CHECKPOINT_DIR, 'ovirt-ova-extract-*.checkpoint*')
+    ):
+        try:
+            if now - os.path.getmtime(path) > CHECKPOINT_MAX_AGE:
+                os.unlink(path)
+        except OSError:
+            pass
 
 
-if len(sys.argv) < 3:
-    print ("Usage: extract_ova.py ova_path disks_paths")
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+resume = '--resume' in sys.argv
+# a checkpoint is only kept for runs which may be resumed later
+resumable = resume or '--resumable' in sys.argv
+if len(args) < 2:
+    log(
+        "Usage: extract_ova.py ova_path disks_paths "
+        "[--resumable|--resume]"
+    )
     sys.exit(2)
 
-extract_disks(sys.argv[1], sys.argv[2].split('+'))
+ova_path = args[0]
+image_paths = args[1].split('+')
+reporter = ProgressReporter(os.environ.get(PROGRESS_FILE_ENV))
+remove_stale_checkpoints()
+checkpoint = Checkpoint(
+    checkpoint_path(ova_path, image_paths) if resumable else None
+)
+if resume:
+    checkpoint.load()
+extract_disks(ova_path, image_paths, reporter, checkpoint)
+checkpoint.remove()
+reporter.summary()
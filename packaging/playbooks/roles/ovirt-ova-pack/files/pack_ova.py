@@ -1,10 +1,14 @@
 #!/usr/bin/python
 
+import hashlib
 import io
+import json
 import mmap
 import os
+import Queue
 import sys
 import tarfile
+import threading
 import time
 
 
@@ -12,7 +16,225 @@ from contextlib import closing
 
 TAR_BLOCK_SIZE = 512
 NUL = b"\0"
-BUF_SIZE = 8 * 1024**2
+BUF_SIZE = int(os.environ.get('OVIRT_OVA_BUF_SIZE', 8 * 1024**2))
+CHECKSUM_ALGORITHM = 'sha256'
+OVF_NAME = 'vm.ovf'
+MANIFEST_NAME = 'vm.mf'
+
+PROGRESS_INTERVAL = 10
+PROGRESS_FILE_ENV = 'OVIRT_OVA_PROGRESS_FILE'
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def log(message):
+    # the standard output is reserved for the JSON progress events
+    sys.stderr.write("%s\n" % message)
+
+
+class Checksum(threading.Thread):
+    """
+    Digest of the copied data, computed on a separate thread.
+
+    The buffer passed to update() must not be modified before wait()
+    returns, thus the copy loop alternates between two buffers so that
+    hashing one chunk overlaps with the I/O of the next one.
+    """
+
+    def __init__(self, algorithm=CHECKSUM_ALGORITHM):
+        super(Checksum, self).__init__()
+        self.daemon = True
+        self.algorithm = algorithm
+        self._hash = hashlib.new(algorithm)
+        self._chunks = Queue.Queue()
+        self.start()
+
+    def run(self):
+        while True:
+            chunk = self._chunks.get()
+            try:
+                if chunk is None:
+                    break
+                self._hash.update(chunk)
+            finally:
+                self._chunks.task_done()
+
+    def update(self, buf, size):
+        self._chunks.put(buffer(buf, 0, size))
+
+    def wait(self):
+        self._chunks.join()
+
+    def partial(self):
+        """
+        Digest of the data passed so far, recorded by checkpoints.
+        """
+        self.wait()
+        return self._hash.copy().hexdigest()
+
+    def hexdigest(self):
+        self._chunks.put(None)
+        self.join()
+        return self._hash.hexdigest()
+
+
+class Checkpoint(object):
+    """
+    Sidecar state file recording the progress of the copy, so that an
+    interrupted run can be resumed. The file is replaced atomically and
+    fsynced on every save. Without a path, the state is only kept in
+    memory, for runs which are not meant to be resumed.
+    """
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.state = {}
+        self._lock = threading.Lock()
+        self._last = time.time()
+
+    def load(self):
+        if self.path is None:
+            return self.state
+        try:
+            with open(self.path, 'r') as f:
+                self.state = json.load(f)
+        except (IOError, ValueError):
+            self.state = {}
+        return self.state
+
+    def due(self):
+        # without a path there is nothing to record, nor to sync for it
+        return (
+            self.path is not None and
+            time.time() - self._last >= self.interval
+        )
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            fd = os.open(
+                os.path.dirname(os.path.abspath(self.path)),
+                os.O_RDONLY,
+            )
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._last = time.time()
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ProgressReporter(object):
+    """
+    Writes progress events as JSON lines to stdout or, if the
+    OVIRT_OVA_PROGRESS_FILE environment variable is set, to that file.
+    """
+
+    def __init__(self, path=None, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._copied = 0
+        self._read_time = 0.0
+        self._write_time = 0.0
+        self._output = open(path, 'a') if path else sys.stdout
+
+    def emit(self, event, **values):
+        values['event'] = event
+        values['time'] = round(time.time(), 3)
+        with self._lock:
+            self._output.write(json.dumps(values, sort_keys=True) + '\n')
+            self._output.flush()
+
+    def disk(self, name, total, resumed=0):
+        return DiskProgress(self, name, total, resumed)
+
+    def add(self, copied, read_time, write_time):
+        with self._lock:
+            self._copied += copied
+            self._read_time += read_time
+            self._write_time += write_time
+
+    def summary(self):
+        elapsed = time.time() - self._start
+        self.emit(
+            'summary',
+            bytes=self._copied,
+            elapsed=round(elapsed, 3),
+            rate=mb_per_sec(self._copied, elapsed),
+            read_time=round(self._read_time, 3),
+            write_time=round(self._write_time, 3),
+        )
+        if self._output is not sys.stdout:
+            self._output.close()
+
+
+class DiskProgress(object):
+    """
+    Progress of a single disk copy, reported at most once per interval.
+    """
+
+    def __init__(self, reporter, name, total, resumed=0):
+        self.read_time = 0.0
+        self.write_time = 0.0
+        self._reporter = reporter
+        self._name = name
+        self._total = total
+        self._resumed = resumed
+        self._copied = resumed
+        self._start = time.time()
+        self._last = self._start
+        self._reporter.emit('start', disk=name, total=total, resumed=resumed)
+
+    def update(self, copied):
+        self._copied += copied
+        now = time.time()
+        if now - self._last >= self._reporter.interval:
+            self._last = now
+            elapsed = now - self._start
+            copied = self._copied - self._resumed
+            rate = copied / elapsed if elapsed else 0
+            self._reporter.emit(
+                'progress',
+                disk=self._name,
+                done=self._copied,
+                total=self._total,
+                rate=mb_per_sec(copied, elapsed),
+                eta=(
+                    round(max(self._total - self._copied, 0) / rate, 1)
+                    if rate else None
+                ),
+            )
+
+    def done(self):
+        elapsed = time.time() - self._start
+        copied = self._copied - self._resumed
+        self._reporter.add(copied, self.read_time, self.write_time)
+        self._reporter.emit(
+            'done',
+            disk=self._name,
+            done=self._copied,
+            total=self._total,
+            elapsed=round(elapsed, 3),
+            rate=mb_per_sec(copied, elapsed),
+            read_time=round(self.read_time, 3),
+            write_time=round(self.write_time, 3),
+        )
+
+
+def mb_per_sec(size, elapsed):
+    return round(size / elapsed / 1024**2, 2) if elapsed else None
 
 
 def create_tar_info(name, size):
@@ -29,51 +251,170 @@ def pad_to_block_size(file):
         file.write(NUL * padding_size)
 
 
-def write_ovf(ova_path, ovf):
+def write_ovf(ova_path, ovf, checkpoint):
     ovf = ovf.encode('utf-8')
-    print ("writing ovf: %s" % ovf)
+    log("writing ovf: %s" % ovf)
     with io.open(ova_path, "r+b") as ova_file:
-        tar_info = create_tar_info("vm.ovf", len(ovf))
+        tar_info = create_tar_info(OVF_NAME, len(ovf))
         ova_file.write(tar_info.tobuf())
         ova_file.write(ovf)
         pad_to_block_size(ova_file)
         os.fsync(ova_file.fileno())
+        checkpoint.state['end'] = ova_file.tell()
+    checkpoint.state['members'].append(
+        (OVF_NAME, hashlib.new(CHECKSUM_ALGORITHM, ovf).hexdigest())
+    )
+    checkpoint.save()
 
 
-def write_disk(ova_path, disk_path, disk_size):
-    print ("writing disk: path=%s size=%d" % (disk_path, disk_size))
+def resume_disk(ova_path, partial):
+    """
+    Validate the partially written disk against the digest recorded by
+    the checkpoint, returning the checksum primed with that data or None
+    if the data cannot be trusted.
+    """
+    checksum = Checksum()
+    buf = mmap.mmap(-1, BUF_SIZE)
+    with closing(buf), io.open(ova_path, "rb") as ova_file:
+        ova_file.seek(partial['offset'])
+        remaining = partial['copied']
+        while remaining > 0:
+            read = ova_file.readinto(buf)
+            if read == 0:
+                break
+            read = min(read, remaining)
+            checksum.update(buf, read)
+            checksum.wait()
+            remaining -= read
+    if remaining or checksum.partial() != partial['digest']:
+        checksum.hexdigest()
+        return None
+    return checksum
+
+
+def write_disk(ova_path, disk_path, disk_size, reporter, checkpoint):
+    log("writing disk: path=%s size=%d" % (disk_path, disk_size))
     disk_name = os.path.basename(disk_path)
-    tar_info = create_tar_info(disk_name, disk_size)
-    with io.open(ova_path, "a+b") as ova_file:
-        # write tar info
-        ova_file.write(tar_info.tobuf())
-        os.fsync(ova_file.fileno())
+    partial = checkpoint.state.get('disk')
+    checksum = None
+    if partial is not None and partial['name'] == disk_name:
+        checksum = resume_disk(ova_path, partial)
+        if checksum is None:
+            log("discarding partial disk: %s" % disk_name)
+            with io.open(ova_path, "r+b") as ova_file:
+                ova_file.truncate(partial['offset'] - TAR_BLOCK_SIZE)
+
+    if checksum is None:
+        tar_info = create_tar_info(disk_name, disk_size)
+        with io.open(ova_path, "a+b") as ova_file:
+            # write tar info
+            ova_file.write(tar_info.tobuf())
+            os.fsync(ova_file.fileno())
+            offset = ova_file.tell()
+        partial = {'name': disk_name, 'offset': offset, 'copied': 0}
+        checksum = Checksum()
+    else:
+        log("resuming disk: %s at %d" % (disk_name, partial['copied']))
 
+    copied = partial['copied']
+    progress = reporter.disk(disk_name, disk_size, copied)
     fd = os.open(ova_path, os.O_RDWR | os.O_DIRECT | os.O_APPEND)
     with io.FileIO(fd, "a+", closefd=True) as ova_file:
         # write the disk content
-        buf = mmap.mmap(-1, BUF_SIZE)
+        bufs = (mmap.mmap(-1, BUF_SIZE), mmap.mmap(-1, BUF_SIZE))
         fd = os.open(disk_path, os.O_RDONLY | os.O_DIRECT)
-        with closing(buf), \
+        with closing(bufs[0]), closing(bufs[1]), \
                 io.FileIO(fd, "r", closefd=True) as image:
+            image.seek(copied)
+            chunk = 0
             while True:
+                buf = bufs[chunk % 2]
+                chunk += 1
+                start = time.time()
                 read = image.readinto(buf)
+                progress.read_time += time.time() - start
+                # the other buffer is reused by the next read
+                checksum.wait()
                 if read == 0:
                     break  # done
+                checksum.update(buf, read)
+                start = time.time()
                 written = 0
                 while written < read:
                     wbuf = buffer(buf, written, read - written)
                     written += ova_file.write(wbuf)
+                progress.write_time += time.time() - start
+                progress.update(written)
+                copied += written
+                if checkpoint.due():
+                    # the data must be on disk before it is recorded
+                    os.fsync(ova_file.fileno())
+                    partial['copied'] = copied
+                    partial['digest'] = checksum.partial()
+                    checkpoint.state['disk'] = partial
+                    checkpoint.save()
+        start = time.time()
         os.fsync(ova_file.fileno())
+        progress.write_time += time.time() - start
+    progress.done()
+    return disk_name, checksum.hexdigest()
 
 
-def write_disks(ova_path, disks_info):
+def write_disks(ova_path, disks_info, reporter, checkpoint):
+    members = checkpoint.state['members']
+    completed = set(name for name, digest in members)
     for disk_info in disks_info:
         # disk_info is of the following structure: <full path>::<size in bytes>
         idx = disk_info.index('::')
         disk_path = disk_info[:idx]
         disk_size = int(disk_info[idx+2:])
-        write_disk(ova_path, disk_path, disk_size)
+        if os.path.basename(disk_path) in completed:
+            log("skipping completed disk: path=%s" % disk_path)
+            continue
+        members.append(
+            write_disk(ova_path, disk_path, disk_size, reporter, checkpoint)
+        )
+        checkpoint.state.pop('disk', None)
+        checkpoint.state['end'] = os.path.getsize(ova_path)
+        checkpoint.save()
+
+
+def prepare(ova_path, checkpoint, resume):
+    """
+    Load the checkpoint of a previous run and truncate the OVA to the
+    last recorded position, or start over if there is nothing valid to
+    resume from.
+    """
+    state = checkpoint.load() if resume else {}
+    size = os.path.getsize(ova_path)
+    partial = state.get('disk')
+    position = state.get('end', 0)
+    if partial is not None:
+        position = partial['offset'] + partial['copied']
+    if not state.get('members') or size < position:
+        if resume:
+            log("no valid checkpoint to resume from, starting over")
+        state = {'members': [], 'end': 0}
+        position = 0
+    checkpoint.state = state
+    with io.open(ova_path, "r+b") as ova_file:
+        ova_file.truncate(position)
+
+
+def write_manifest(ova_path, digests):
+    # the OVF specification allows the manifest to be placed at the end
+    # of the archive, so the digests are computed while packing
+    manifest = ''.join(
+        '%s(%s)= %s\n' % (CHECKSUM_ALGORITHM.upper(), name, digest)
+        for name, digest in digests
+    ).encode('utf-8')
+    log("writing manifest: %s" % manifest)
+    with io.open(ova_path, "a+b") as ova_file:
+        tar_info = create_tar_info(MANIFEST_NAME, len(manifest))
+        ova_file.write(tar_info.tobuf())
+        ova_file.write(manifest)
+        pad_to_block_size(ova_file)
+        os.fsync(ova_file.fileno())
 
 
 def write_null_blocks(ova_file):
@@ -81,15 +422,31 @@ def write_null_blocks(ova_file):
         ova_file.write(NUL * 2 * TAR_BLOCK_SIZE)
 
 
-if len(sys.argv) < 3:
-    print ("Usage: pack_ova.py output_path ovf [disks_info]")
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+resume = '--resume' in sys.argv
+# a checkpoint is only kept for runs which may be resumed later
+resumable = resume or '--resumable' in sys.argv
+if len(args) < 2:
+    log(
+        "Usage: pack_ova.py output_path ovf [disks_info] "
+        "[--resumable|--resume]"
+    )
     sys.exit(2)
 
-ova_path = sys.argv[1]
-ovf = sys.argv[2]
-write_ovf(ova_path, ovf)
-if len(sys.argv) > 3:
-    disks_info = sys.argv[3]
-    write_disks(ova_path, disks_info.split('+'))
+ova_path = args[0]
+ovf = args[1]
+reporter = ProgressReporter(os.environ.get(PROGRESS_FILE_ENV))
+checkpoint = Checkpoint(
+    ova_path + CHECKPOINT_SUFFIX if resumable else None
+)
+prepare(ova_path, checkpoint, resume)
+if not checkpoint.state['members']:
+    write_ovf(ova_path, ovf, checkpoint)
+if len(args) > 2:
+    disks_info = args[2]
+    write_disks(ova_path, disks_info.split('+'), reporter, checkpoint)
+write_manifest(ova_path, checkpoint.state['members'])
 # write two null blocks at the end of the file
 write_null_blocks(ova_path)
+checkpoint.remove()
+reporter.summary()
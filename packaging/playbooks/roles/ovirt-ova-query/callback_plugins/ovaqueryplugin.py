@@ -1,5 +1,8 @@
 from __future__ import absolute_import
 
+import json
+import os
+
 from ansible.plugins.callback import CallbackBase
 
 __metaclass__ = type
@@ -9,20 +12,57 @@ class CallbackModule(CallbackBase):
     """
     This callback module prints the output of the single task of the
     ovirt-ova-query role which is the OVF fetched from an OVA file.
+
+    If the OVIRT_CALLBACK_STREAMING environment variable is set to a true
+    value, a JSON record is printed per line for every result as it
+    arrives, followed by a final record with the stats of the hosts.
     """
     CALLBACK_VERSION = 2.0
     CALLBACK_TYPE = 'stdout'
     CALLBACK_NAME = 'ovaqueryplugin'
 
+    STREAMING_ENV = 'OVIRT_CALLBACK_STREAMING'
+
     def __init__(self, display=None):
         super(CallbackModule, self).__init__(display)
+        self.ovf = ''
+        self.streaming = os.environ.get(self.STREAMING_ENV, '').lower() in (
+            't', 'true', 'y', 'yes', '1',
+        )
 
-    def v2_runner_on_ok(self, result, **kwargs):
+    def _on_result(self, result, status):
         self.ovf = result._result.get('stdout', '')
+        if self.streaming:
+            self._display.display(
+                json.dumps({
+                    'host': result._host.get_name(),
+                    'task': result._task.get_name(),
+                    'status': status,
+                    'ovf': self.ovf,
+                })
+            )
 
-    def v2_playbook_on_stats(self, stats):
-        self._display.display(self.ovf)
+    def v2_runner_on_ok(self, result, **kwargs):
+        self._on_result(result, 'ok')
+
+    def v2_runner_on_failed(self, result, **kwargs):
+        self._on_result(result, 'failed')
+
+    def v2_runner_on_unreachable(self, result, **kwargs):
+        self._on_result(result, 'unreachable')
 
-    v2_runner_on_failed = v2_runner_on_ok
-    v2_runner_on_unreachable = v2_runner_on_ok
-    v2_runner_on_skipped = v2_runner_on_ok
+    def v2_runner_on_skipped(self, result, **kwargs):
+        self._on_result(result, 'skipped')
+
+    def v2_playbook_on_stats(self, stats):
+        if self.streaming:
+            self._display.display(
+                json.dumps({
+                    'stats': dict(
+                        (host, stats.summarize(host))
+                        for host in sorted(stats.processed)
+                    ),
+                })
+            )
+        else:
+            self._display.display(self.ovf)
@@ -0,0 +1,128 @@
+"""
+test_ova_checkpoint.py - Tests for the checkpoints of pack_ova.py and
+extract_ova.py
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+ROLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'roles',
+)
+PACK = os.path.join(ROLES_DIR, 'ovirt-ova-pack', 'files', 'pack_ova.py')
+EXTRACT = os.path.join(
+    ROLES_DIR,
+    'ovirt-ova-extract',
+    'files',
+    'extract_ova.py',
+)
+BUF_SIZE = 64 * 1024
+
+# the scripts are written for the python of the hosts
+PYTHON = which('python2')
+
+# runs a script counting its fsync calls, with a clock making every
+# checkpoint due as soon as it is checked
+WRAPPER = '''
+import os
+import runpy
+import sys
+import time
+
+calls = [0]
+now = [0.0]
+fsync = os.fsync
+
+
+def counting_fsync(fd):
+    calls[0] += 1
+    fsync(fd)
+
+
+def clock():
+    now[0] += 3600
+    return now[0]
+
+
+os.fsync = counting_fsync
+time.time = clock
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    sys.stderr.write('fsync=%d\\n' % calls[0])
+'''
+
+pytestmark = pytest.mark.skipif(PYTHON is None, reason='python2 missing')
+
+
+def _run(*args):
+    env = dict(os.environ)
+    env['OVIRT_OVA_BUF_SIZE'] = str(BUF_SIZE)
+    process = subprocess.Popen(
+        [PYTHON, '-c', WRAPPER] + list(args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+    return int(stderr.decode('utf-8').splitlines()[-1].split('=')[1])
+
+
+def _disk(tmpdir, chunks):
+    disk = tmpdir.join('disk')
+    disk.write_binary(os.urandom(chunks * BUF_SIZE))
+    return disk
+
+
+def _pack(tmpdir, chunks, *args):
+    disk = _disk(tmpdir, chunks)
+    ova = tmpdir.join('vm.ova')
+    ova.write_binary(b'')
+    return _run(
+        PACK,
+        str(ova),
+        '<ovf/>',
+        '%s::%d' % (disk, disk.size()),
+        *args
+    )
+
+
+def _extract(tmpdir, chunks, *args):
+    _pack(tmpdir, chunks)
+    # the images are found by the names of the disks in the OVA
+    image = tmpdir.mkdir('images').join('disk')
+    image.write_binary(b'\0' * (chunks * BUF_SIZE))
+    fsyncs = _run(EXTRACT, str(tmpdir.join('vm.ova')), str(image), *args)
+    assert image.read_binary() == tmpdir.join('disk').read_binary()
+    return fsyncs
+
+
+@pytest.mark.parametrize('operation', [_pack, _extract])
+def test_no_checkpoint_syncs_do_not_grow_with_chunks(tmpdir, operation):
+    assert (
+        operation(tmpdir.mkdir('1'), 1) ==
+        operation(tmpdir.mkdir('8'), 8)
+    )
+
+
+@pytest.mark.parametrize('operation', [_pack, _extract])
+def test_resumable_syncs_grow_with_chunks(tmpdir, operation):
+    assert (
+        operation(tmpdir.mkdir('8'), 8, '--resumable') >
+        operation(tmpdir.mkdir('1'), 1, '--resumable')
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__]))
@@ -17,8 +17,12 @@
 
 import gettext
 import glob
+import hashlib
+import marshal
 import os
 import re
+import sys
+import tempfile
 
 from . import base
 
@@ -31,29 +35,58 @@ class ConfigFile(base.Base):
     """
     Parsing of shell style config file.
     Follow closly the java LocalConfig implementaiton.
+
+    Every value is compiled once into its parts, literal strings and
+    [name] variable references, which are expanded when loaded.
+
+    If a cache directory is provided, the compiled files are kept there,
+    keyed by path, mtime and size, and are not parsed again as long as
+    they do not change. The directory must be private to the user.
     """
 
-    _EMPTY_LINE = re.compile(r'^\s*(#.*|)$')
-    _KEY_VALUE_EXPRESSION = re.compile(r'^\s*(?P<key>\w+)=(?P<value>.*)$')
+    _LINE = re.compile(r'^\s*(?:#.*|(?P<key>\w+)=(?P<value>.*))?$')
+    _TOKEN = re.compile(
+        r"""
+            \\(?P<escaped>.)? |
+            \$(?:\{(?P<name>[^}]*)\})? |
+            " |
+            [\ \#] |
+            [^\\$"\ \#]+
+        """,
+        re.VERBOSE | re.DOTALL,
+    )
 
     @property
     def values(self):
         return self._values
 
-    def _loadLine(self, line):
-        emptyMatch = self._EMPTY_LINE.search(line)
-        if emptyMatch is None:
-            keyValueMatch = self._KEY_VALUE_EXPRESSION.search(line)
-            if keyValueMatch is None:
-                raise RuntimeError(_('Invalid sytax'))
-            self._values[keyValueMatch.group('key')] = self.expandString(
-                keyValueMatch.group('value')
-            )
+    @property
+    def files(self):
+        return self._files
 
-    def __init__(self, files=[]):
+    def __init__(self, files=[], cache=None):
         super(ConfigFile, self).__init__()
 
+        self._files = tuple(files)
+        self._cacheDir = cache
         self._values = {}
+        self._cacheFile = None
+        self._cache = {}
+        self._cacheChanged = False
+        self._loaded = set()
+
+        if cache is not None:
+            self._cacheFile = os.path.join(
+                cache,
+                'configfile-%s.py%d%d' % (
+                    hashlib.sha1(
+                        '\0'.join(files).encode('utf-8')
+                    ).hexdigest(),
+                    sys.version_info[0],
+                    sys.version_info[1],
+                ),
+            )
+            self._loadCache()
 
         for file in files:
             self.loadFile(file)
@@ -67,67 +100,157 @@ class ConfigFile(base.Base):
             ):
                 self.loadFile(filed)
 
-    def loadFile(self, file):
-        if os.path.exists(file):
-            self.logger.debug("loading config '%s'", file)
-            index = 0
+        if self._cacheFile is not None:
+            for file in set(self._cache) - self._loaded:
+                del self._cache[file]
+                self._cacheChanged = True
+            if self._cacheChanged:
+                self._saveCache()
+
+    def _loadCache(self):
+        try:
+            with open(self._cacheFile, 'rb') as f:
+                self._cache = marshal.loads(f.read())
+        except Exception as e:
+            self.logger.debug(
+                "cannot load config cache '%s': %s",
+                self._cacheFile,
+                e,
+            )
+
+    def _saveCache(self):
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self._cacheFile),
+                prefix='.configfile-',
+            )
             try:
-                with open(file, 'r') as f:
-                    for line in f:
-                        index += 1
-                        self._loadLine(line)
-            except Exception as e:
-                self.logger.error(
-                    "File '%s' index %d error" % (file, index),
-                    exc_info=True,
-                )
-                raise RuntimeError(
-                    _(
-                        "Cannot parse configuration file "
-                        "'{file}' line {line}: {error}"
-                    ).format(
-                        file=file,
-                        line=index,
-                        error=e
-                    )
-                )
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(marshal.dumps(self._cache))
+                os.rename(tmp, self._cacheFile)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except Exception as e:
+            self.logger.debug(
+                "cannot save config cache '%s': %s",
+                self._cacheFile,
+                e,
+            )
 
-    def expandString(self, value):
-        ret = ""
+    def _compileLine(self, line):
+        stripped = line.lstrip()
+        if not stripped or stripped[0] == '#':
+            return None
+        match = self._LINE.match(line)
+        if match is None:
+            raise RuntimeError(_('Invalid sytax'))
+        if match.group('key') is None:
+            return None
+        return (
+            match.group('key'),
+            self._compileValue(match.group('value')),
+        )
 
-        escape = False
+    def _compileValue(self, value):
+        parts = []
+        literal = []
         inQuotes = False
-        index = 0
-        while (index < len(value)):
-            c = value[index]
-            index += 1
-            if escape:
-                escape = False
-                ret += c
+        for match in self._TOKEN.finditer(value):
+            token = match.group(0)
+            if token[0] == '\\':
+                if match.group('escaped') is not None:
+                    literal.append(match.group('escaped'))
+            elif token[0] == '$':
+                if match.group('name') is None:
+                    raise RuntimeError('Malformed variable assignment')
+                if literal:
+                    parts.append(''.join(literal))
+                    literal = []
+                parts.append([match.group('name')])
+            elif token == '"':
+                inQuotes = not inQuotes
+            elif token in (' ', '#'):
+                if not inQuotes:
+                    break
+                literal.append(token)
             else:
-                if c == '\\':
-                    escape = True
-                elif c == '$':
-                    if value[index] != '{':
-                        raise RuntimeError('Malformed variable assignment')
+                literal.append(token)
+        if literal:
+            parts.append(''.join(literal))
+        return parts
+
+    def _expand(self, parts):
+        return ''.join(
+            self._values.get(part[0], '') if isinstance(part, list)
+            else part
+            for part in parts
+        )
+
+    def _compileFile(self, file):
+        self._loaded.add(file)
+        stat = os.stat(file)
+        cached = self._cache.get(file)
+        if (
+            cached is not None and
+            cached[0] == stat.st_mtime and
+            cached[1] == stat.st_size
+        ):
+            return cached[2]
+
+        entries = []
+        index = 0
+        try:
+            with open(file, 'r') as f:
+                for line in f:
                     index += 1
-                    i = value.find('}', index)
-                    if i == -1:
-                        raise RuntimeError('Malformed variable assignment')
-                    name = value[index:i]
-                    index = i + 1
-                    ret += self._values.get(name, "")
-                elif c == '"':
-                    inQuotes = not inQuotes
-                elif c in (' ', '#'):
-                    if inQuotes:
-                        ret += c
-                    else:
-                        index = len(value)
-                else:
-                    ret += c
-
-        return ret
+                    entry = self._compileLine(line)
+                    if entry is not None:
+                        entries.append(entry)
+        except Exception as e:
+            self.logger.error(
+                "File '%s' index %d error" % (file, index),
+                exc_info=True,
+            )
+            raise RuntimeError(
+                _(
+                    "Cannot parse configuration file "
+                    "'{file}' line {line}: {error}"
+                ).format(
+                    file=file,
+                    line=index,
+                    error=e
+                )
+            )
+        if self._cacheFile is not None:
+            self._cache[file] = (stat.st_mtime, stat.st_size, entries)
+            self._cacheChanged = True
+        return entries
+
+    def loadFile(self, file):
+        if os.path.exists(file):
+            self.logger.debug("loading config '%s'", file)
+            for key, parts in self._compileFile(file):
+                self._values[key] = self._expand(parts)
+
+    def expandString(self, value):
+        return self._expand(self._compileValue(value))
+
+    def reload(self):
+        """
+        Load the files again, including the files of their .d directories.
+        Return the changed keys, mapped to (old, new) values, a missing
+        value is None. The values are left intact if any file is invalid.
+        """
+        values = ConfigFile(self._files, cache=self._cacheDir).values
+        changes = {}
+        for key in set(self._values) | set(values):
+            old = self._values.get(key)
+            new = values.get(key)
+            if old != new:
+                changes[key] = (old, new)
+        self._values = values
+        return changes
 
     def get(self, name, default=None):
         return self._values.get(name, default)
@@ -16,8 +16,10 @@
 
 
 import gettext
+import json
 import os
 import subprocess
+import tempfile
 
 from . import base
 from . import config
@@ -28,19 +30,113 @@ def _(m):
 
 
 class Java(base.Base):
+    """
+    JAVA_HOME resolution by the java-home script.
+
+    The result is cached in ENGINE_CACHE per component, keyed by the
+    environment and the mtimes of what java-home looks at. A cached
+    entry is used only if its bin/java did not change, so the script is
+    executed only when the JVMs or alternatives change.
+    """
+
+    _DEPENDENCIES = (
+        '/usr/lib/jvm',
+        '/etc/alternatives',
+    )
+    _ENVIRONMENT = (
+        'OVIRT_ENGINE_JAVA_HOME',
+        'OVIRT_ENGINE_JAVA_HOME_FORCE',
+    )
 
     def __init__(self, component=None):
         super(Java, self).__init__()
         self._component = component if component else 'engine'
+        self._script = os.path.join(
+            config.ENGINE_USR,
+            'bin',
+            'java-home',
+        )
+        self._cacheFile = os.path.join(
+            config.ENGINE_CACHE,
+            'java-home-%s.json' % self._component,
+        )
 
-    def getJavaHome(self):
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _cacheKey(self):
+        return [
+            self._component,
+            [os.environ.get(name) for name in self._ENVIRONMENT],
+            [
+                self._mtime(path)
+                for path in (
+                    self._script,
+                    '%s.local' % self._script,
+                ) + self._DEPENDENCIES
+            ],
+        ]
+
+    def _javaStat(self, javaHome):
+        java = os.path.join(javaHome, 'bin', 'java')
+        st = os.stat(java)
+        return [os.path.realpath(java), st.st_mtime, st.st_size]
+
+    def _loadCache(self, key):
+        try:
+            with open(self._cacheFile) as f:
+                # JAVA_HOME is executed, trust only ourselves or root
+                if os.fstat(f.fileno()).st_uid not in (0, os.geteuid()):
+                    return None
+                cached = json.load(f)
+            if (
+                cached['key'] == key and
+                cached['java'] == self._javaStat(cached['javaHome'])
+            ):
+                return cached['javaHome']
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.debug(
+                "cannot use JAVA_HOME cache '%s': %s",
+                self._cacheFile,
+                e,
+            )
+        return None
+
+    def _saveCache(self, key, javaHome):
+        try:
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self._cacheFile),
+                prefix='.java-home-',
+            )
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(
+                        {
+                            'key': key,
+                            'javaHome': javaHome,
+                            'java': self._javaStat(javaHome),
+                        },
+                        f,
+                    )
+                os.chmod(tmp, 0o644)
+                os.rename(tmp, self._cacheFile)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except Exception as e:
+            self.logger.debug(
+                "cannot save JAVA_HOME cache '%s': %s",
+                self._cacheFile,
+                e,
+            )
+
+    def _runJavaHome(self):
         p = subprocess.Popen(
             args=(
-                os.path.join(
-                    config.ENGINE_USR,
-                    'bin',
-                    'java-home',
-                ),
+                self._script,
                 '--component=%s' % self._component,
             ),
             stdout=subprocess.PIPE,
@@ -60,7 +156,14 @@ class Java(base.Base):
                 )
             )
 
-        javaHome = stdout[0]
+        return stdout[0]
+
+    def getJavaHome(self):
+        key = self._cacheKey()
+        javaHome = self._loadCache(key)
+        if javaHome is None:
+            javaHome = self._runJavaHome()
+            self._saveCache(key, javaHome)
         self.logger.debug('JAVA_HOME: %s', javaHome)
         return javaHome
 
@@ -0,0 +1,338 @@
+#
+# Copyright (C) 2018 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import gettext
+import logging
+import multiprocessing
+import os
+
+from . import base
+from . import mem
+from . import util
+
+
+def _(m):
+    return gettext.dgettext(message=m, domain='ovirt-engine')
+
+
+def _parseList(value):
+    """
+    Return the number of items in a kernel list such as '0-3,6'.
+    """
+    count = 0
+    for item in value.split(','):
+        if '-' in item:
+            first, last = item.split('-')
+            count += int(last) - int(first) + 1
+        elif item:
+            count += 1
+    return count
+
+
+@util.export
+class Topology(base.Base):
+    """
+    Memory and CPUs available to this process.
+
+    Physical memory and CPUs as limited by the cgroup (v1 or v2) of the
+    process and its CPU affinity, and the number of NUMA nodes.
+    """
+
+    _CGROUP_ROOT = '/sys/fs/cgroup'
+
+    def __init__(self):
+        super(Topology, self).__init__()
+        self._cgroups = self._readCgroups()
+
+        self.totalMB = mem.get_total_mb()
+        self.limitMB = self._memoryLimitMB()
+        self.availableMB = (
+            self.totalMB if self.limitMB is None
+            else min(self.totalMB, self.limitMB)
+        )
+
+        self.hostCpus = multiprocessing.cpu_count()
+        self.cpus = self._cpus()
+
+        self.numaNodes = 1
+        online = self._read('/sys/devices/system/node/online')
+        if online:
+            self.numaNodes = max(1, _parseList(online))
+
+        self.logger.debug(
+            'Topology: memory=%sMB limit=%sMB cpus=%s/%s numa=%s',
+            self.totalMB,
+            self.limitMB,
+            self.cpus,
+            self.hostCpus,
+            self.numaNodes,
+        )
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _readCgroups(self):
+        """
+        Return controller -> (directory, path), v2 is under ''.
+        """
+        cgroups = {}
+        for line in (self._read('/proc/self/cgroup') or '').splitlines():
+            hierarchy, controllers, path = line.split(':', 2)
+            for controller in controllers.split(','):
+                cgroups[controller] = (controllers, path.lstrip('/'))
+        return cgroups
+
+    def _cgroupValue(self, controller, name):
+        """
+        Read a file of the cgroup of the process, in v1 hierarchy of the
+        controller if available, otherwise in v2 hierarchy. Within a
+        container the path of the cgroup may not be visible, so the
+        root of the hierarchy is tried as well.
+        """
+        if controller in self._cgroups:
+            directory, path = self._cgroups[controller]
+            directory = os.path.join(self._CGROUP_ROOT, directory)
+        elif '' in self._cgroups:
+            path = self._cgroups[''][1]
+            directory = self._CGROUP_ROOT
+        else:
+            return None
+        for candidate in (
+            os.path.join(directory, path, name),
+            os.path.join(directory, name),
+        ):
+            value = self._read(candidate)
+            if value is not None:
+                return value
+        return None
+
+    def _memoryLimitMB(self):
+        if 'memory' in self._cgroups:
+            value = self._cgroupValue('memory', 'memory.limit_in_bytes')
+        else:
+            value = self._cgroupValue('memory', 'memory.max')
+        if not value or value == 'max':
+            return None
+        limit = int(value) // 1024 // 1024
+        # v1 reports unlimited as a huge number
+        return limit if limit < self.totalMB else None
+
+    def _cpus(self):
+        cpus = self.hostCpus
+
+        allowed = [
+            line.split(':', 1)[1].strip()
+            for line in (self._read('/proc/self/status') or '').splitlines()
+            if line.startswith('Cpus_allowed_list:')
+        ]
+        if allowed:
+            cpus = min(cpus, max(1, _parseList(allowed[0])))
+
+        if 'cpu' in self._cgroups:
+            quota = self._cgroupValue('cpu', 'cpu.cfs_quota_us')
+            period = self._cgroupValue('cpu', 'cpu.cfs_period_us')
+        else:
+            quota, period = (
+                (self._cgroupValue('cpu', 'cpu.max') or 'max') + ' '
+            ).split(' ')[:2]
+        if quota and period and quota not in ('max', '-1'):
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+
+        return cpus
+
+
+@util.export
+class Sizing(base.Base):
+    """
+    JVM sizing derived from the topology.
+
+    The heap is limited to what is left from the available memory after
+    reserving memory for other services on the machine and a quarter
+    for the JVM itself beyond its heap. The GC threads are limited to
+    the CPUs available when they are fewer than the CPUs of the host,
+    which a JVM which is not aware of cgroups would use.
+
+    With selectGC, G1 is selected for large heaps and the parallel
+    collector with NUMA awareness for smaller heaps on NUMA machines.
+    The choice follows the configured heap, not the one adjusted to the
+    machine, so that it does not change with the memory available, and
+    it is made only for a configured heap, options set in jvmArgs are
+    left alone.
+
+    Usage:
+        sizing = Sizing(heapMin='1g', heapMax='4g')
+        args = ['-Xms%s' % sizing.heapMin, '-Xmx%s' % sizing.heapMax]
+        args += sizing.args
+    """
+
+    _G1_HEAP_MB = 4096
+
+    def __init__(
+        self,
+        heapMin=None,
+        heapMax=None,
+        enforceHeap=False,
+        reservedMB=None,
+        localDatabase=False,
+        jvmArgs=(),
+        mallocArenaMax=None,
+        selectGC=False,
+        topology=None,
+    ):
+        super(Sizing, self).__init__()
+        self._topology = topology if topology else Topology()
+        self._jvmArgs = jvmArgs
+        self.heapMin = heapMin
+        self.heapMax = heapMax
+        self.args = []
+
+        self._sizeHeap(enforceHeap, reservedMB, localDatabase)
+        self._selectGC(heapMax if selectGC else None)
+        self.mallocArenaMax = self._mallocArenaMax(mallocArenaMax)
+
+    def _reason(self, message, *args, **kwargs):
+        self.logger.log(
+            kwargs.get('level', logging.INFO),
+            'JVM sizing: ' + message,
+            *args
+        )
+
+    def _hasArg(self, *prefixes):
+        return any(
+            arg.startswith(prefix)
+            for arg in self._jvmArgs
+            for prefix in prefixes
+        )
+
+    def _sizeHeap(self, enforceHeap, reservedMB, localDatabase):
+        t = self._topology
+        if enforceHeap:
+            self._reason('heap %s-%s is enforced', self.heapMin, self.heapMax)
+            return
+
+        # without a configured heap only make the default of the JVM, a
+        # quarter of the memory, follow a limit the JVM may not be aware of
+        if self.heapMax is None and t.limitMB is None:
+            return
+
+        if t.limitMB is not None:
+            self._reason(
+                'cgroup memory limit %sMB of %sMB',
+                t.limitMB,
+                t.totalMB,
+            )
+
+        if reservedMB is None:
+            reservedMB = max(256, t.availableMB // 10)
+            if localDatabase:
+                reservedMB += t.availableMB // 4
+                self._reason(
+                    'reserving %sMB for the system and local database',
+                    reservedMB,
+                )
+            else:
+                self._reason('reserving %sMB for the system', reservedMB)
+        else:
+            self._reason('reserving configured %sMB', reservedMB)
+
+        capMB = max(256, (t.availableMB - reservedMB) * 3 // 4)
+
+        if self.heapMax is None:
+            self.heapMax = '%sM' % min(capMB, t.availableMB // 4)
+            self._reason('heap maximum %s', self.heapMax)
+            return
+
+        if mem.javaX_mb(self.heapMax) > capMB:
+            self._reason(
+                'heap maximum %s exceeds %sMB, a quarter kept for the JVM '
+                'out of %sMB available, using %sMB',
+                self.heapMax,
+                capMB,
+                t.availableMB - reservedMB,
+                capMB,
+                level=logging.WARNING,
+            )
+            self.heapMax = '%sM' % capMB
+        if (
+            self.heapMin is not None and
+            mem.javaX_mb(self.heapMin) > mem.javaX_mb(self.heapMax)
+        ):
+            self._reason(
+                'heap minimum %s lowered to heap maximum %s',
+                self.heapMin,
+                self.heapMax,
+            )
+            self.heapMin = self.heapMax
+
+    def _selectGC(self, configuredHeapMax):
+        t = self._topology
+        gc = None
+        if configuredHeapMax is not None and not self._hasArg(
+            '-XX:+UseG1GC',
+            '-XX:+UseParallelGC',
+            '-XX:+UseConcMarkSweepGC',
+            '-XX:+UseSerialGC',
+        ):
+            if mem.javaX_mb(configuredHeapMax) >= self._G1_HEAP_MB:
+                gc = '-XX:+UseG1GC'
+                self._reason('G1 for heap of %s', configuredHeapMax)
+            elif t.numaNodes > 1:
+                gc = '-XX:+UseParallelGC'
+                self._reason(
+                    'parallel collector for %s NUMA nodes',
+                    t.numaNodes,
+                )
+            if gc:
+                self.args.append(gc)
+
+        if (
+            gc == '-XX:+UseParallelGC' and
+            not self._hasArg('-XX:+UseNUMA', '-XX:-UseNUMA')
+        ):
+            self.args.append('-XX:+UseNUMA')
+
+        if (
+            t.cpus < t.hostCpus and
+            not self._hasArg('-XX:ParallelGCThreads=')
+        ):
+            self._reason(
+                'GC threads limited to %s of %s CPUs',
+                t.cpus,
+                t.hostCpus,
+            )
+            self.args.append('-XX:ParallelGCThreads=%s' % t.cpus)
+            if (
+                gc == '-XX:+UseG1GC' and
+                not self._hasArg('-XX:ConcGCThreads=')
+            ):
+                self.args.append(
+                    '-XX:ConcGCThreads=%s' % max(1, (t.cpus + 2) // 4)
+                )
+
+    def _mallocArenaMax(self, mallocArenaMax):
+        if mallocArenaMax:
+            return mallocArenaMax
+        arenas = str(min(self._topology.cpus, self._topology.numaNodes))
+        self._reason('%s malloc arenas', arenas)
+        return arenas
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
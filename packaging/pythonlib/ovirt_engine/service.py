@@ -14,67 +14,370 @@
 # limitations under the License.
 
 
+import atexit
+import calendar
 import contextlib
-import datetime
+import ctypes
+import ctypes.util
+import errno
 import gettext
+import json
 import logging
 import logging.handlers
 import optparse
 import os
 import resource
+import select
 import shutil
 import signal
 import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 import daemon
 
-
-from dateutil import tz
-
 from . import base
 from . import util
 
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
 
 def _(m):
     return gettext.dgettext(message=m, domain='ovirt-engine')
 
 
+class _Profile(object):
+    """Startup timings of the process
+
+    Records the time of each import while installed, and the phases
+    entered through profilePhase(). The report is written to file, on
+    readiness of a daemon and on exit.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._started = time.time()
+        self._age = self._processAge()
+        self._phases = []
+        self._imports = []
+        self._depth = 0
+        self._import = builtins.__import__
+        builtins.__import__ = self._timedImport
+        atexit.register(self.write)
+
+    def _processAge(self):
+        """Seconds since the process started, before the profile"""
+        try:
+            with open('/proc/self/stat') as f:
+                started = int(f.read().rsplit(')', 1)[1].split()[19])
+            with open('/proc/uptime') as f:
+                uptime = float(f.read().split()[0])
+            return uptime - float(started) / os.sysconf('SC_CLK_TCK')
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+    def _timedImport(self, name, *args, **kwargs):
+        if not name or name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        entry = [self._depth, name, time.time() - self._started, None]
+        self._imports.append(entry)
+        self._depth += 1
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            entry[3] = time.time() - self._started - entry[2]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        entry = [name, time.time() - self._started, None]
+        self._phases.append(entry)
+        try:
+            yield
+        finally:
+            entry[2] = time.time() - self._started - entry[1]
+
+    def write(self):
+        lines = [
+            '%s[%s] startup profile' % (
+                os.path.basename(sys.argv[0]),
+                os.getpid(),
+            ),
+            'before profile: %s' % (
+                'unknown' if self._age is None
+                else '%.3fs' % self._age
+            ),
+            'elapsed: %.3fs' % (time.time() - self._started),
+            '',
+            'phases (start, duration):',
+        ]
+        for name, start, duration in self._phases:
+            lines.append('%9.3f %9s  %s' % (
+                start,
+                'running' if duration is None else '%.3f' % duration,
+                name,
+            ))
+        lines += ['', 'imports (start, duration):']
+        for depth, name, start, duration in self._imports:
+            if duration is not None and duration >= 0.001:
+                lines.append('%9.3f %9.3f  %s%s' % (
+                    start,
+                    duration,
+                    '  ' * depth,
+                    name,
+                ))
+        try:
+            with open(self._file, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        except (IOError, OSError):
+            logging.getLogger('ovirt').debug(
+                "Cannot write profile '%s'",
+                self._file,
+                exc_info=True,
+            )
+
+
+@contextlib.contextmanager
+def _noPhase():
+    yield
+
+
+_profile = None
+if os.environ.get('OVIRT_SERVICE_PROFILE'):
+    _profile = _Profile(os.environ['OVIRT_SERVICE_PROFILE'])
+
+
 @util.export
-def setupLogger():
-    class _MyFormatter(logging.Formatter):
-        """Needed as syslog will truncate any lines after first."""
+def profilePhase(name):
+    """Context of a startup phase
 
-        def __init__(
-            self,
-            fmt=None,
-            datefmt=None,
-        ):
-            logging.Formatter.__init__(self, fmt=fmt, datefmt=datefmt)
+    When the environment sets OVIRT_SERVICE_PROFILE to a file, the
+    phases and the imports of the process are timed and reported to
+    the file.
+
+    Usage:
+        with service.profilePhase('setup'):
+            ...
+    """
+    if _profile is None:
+        return _noPhase()
+    return _profile.phase(name)
+
+
+@util.export
+def profileWrite():
+    """Write the report of the profile, if any"""
+    if _profile is not None:
+        _profile.write()
+
+
+class _Formatter(logging.Formatter):
+    """Needed as syslog will truncate any lines after first.
 
-        def format(self, record):
-            return logging.Formatter.format(self, record).replace('\n', ' | ')
+    The local time of records is formatted without a timezone database,
+    the offset from UTC is computed once per hour and the formatted
+    time once per second.
+    """
+
+    def __init__(self, fmt=None, datefmt=None):
+        logging.Formatter.__init__(self, fmt=fmt, datefmt=datefmt)
+        self._offset = (None, None)
+        self._second = (None, None)
 
-        def converter(self, timestamp):
-            return datetime.datetime.fromtimestamp(
-                timestamp,
-                tz.tzlocal()
+    def format(self, record):
+        return logging.Formatter.format(self, record).replace('\n', ' | ')
+
+    def _utcOffset(self, timestamp):
+        hour = int(timestamp) // 3600
+        if self._offset[0] != hour:
+            seconds = calendar.timegm(time.localtime(hour * 3600)) - (
+                hour * 3600
+            )
+            self._offset = (
+                hour,
+                '%s%02d%02d' % (
+                    '-' if seconds < 0 else '+',
+                    abs(seconds) // 3600,
+                    abs(seconds) % 3600 // 60,
+                ),
+            )
+        return self._offset[1]
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return time.strftime(datefmt, time.localtime(record.created))
+        second = int(record.created)
+        if self._second[0] != second:
+            self._second = (
+                second,
+                time.strftime(
+                    '%Y-%m-%d %H:%M:%S',
+                    time.localtime(record.created),
+                ),
             )
+        return '%s,%03d%s' % (
+            self._second[1],
+            record.msecs,
+            self._utcOffset(record.created),
+        )
 
-        def formatTime(self, record, datefmt=None):
-            ct = self.converter(record.created)
-            if datefmt:
-                s = ct.strftime(datefmt, ct)
-            else:
-                s = "%s,%03d%s" % (
-                    ct.strftime('%Y-%m-%d %H:%M:%S'),
-                    record.msecs,
-                    ct.strftime('%z')
+
+class _JsonFormatter(_Formatter):
+    """Format records as single line JSON objects"""
+
+    def __init__(self, process):
+        _Formatter.__init__(self)
+        self._process = process
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'process': self._process,
+            'pid': record.process,
+            'thread': record.threadName,
+            'logger': record.name,
+            'level': record.levelname,
+            'function': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, sort_keys=True)
+
+
+class _RateLimitFilter(logging.Filter):
+    """Pass at most rate records per second of each logger
+
+    Warnings and errors are always passed. The number of suppressed
+    records is appended to the next record passed for the logger.
+    """
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self._rate = rate
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        second = int(record.created)
+        window = self._windows.get(record.name)
+        if window is None or window[0] != second:
+            suppressed = window[2] if window else 0
+            self._windows[record.name] = [second, 1, 0]
+            if suppressed:
+                record.msg = '%s (%s previous records suppressed)' % (
+                    record.getMessage(),
+                    suppressed,
                 )
-            return s
+                record.args = None
+            return True
+        if window[1] < self._rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class _QueueHandler(logging.Handler):
+    """Emit records to target from a background thread
+
+    Logging does not block on the target, records are rendered when
+    queued and formatted by the thread. When the queue is full records
+    are dropped and counted. The thread is started by the first record
+    of each process, so it survives the fork into the background, and
+    the queue is drained on close.
+    """
+
+    def __init__(self, target, capacity=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self._capacity = capacity
+        self._pid = None
+        self._thread = None
+        self._dropped = 0
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(self._capacity)
+        self._thread = threading.Thread(target=self._run, name='LogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start()
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                if not record.exc_text:
+                    record.exc_text = self.target.formatter.formatException(
+                        record.exc_info
+                    )
+                record.exc_info = None
+            if self._dropped:
+                dropped = logging.makeLogRecord({
+                    'name': record.name,
+                    'levelno': logging.WARNING,
+                    'levelname': logging.getLevelName(logging.WARNING),
+                    'msg': '%s log records dropped' % self._dropped,
+                })
+                self._queue.put_nowait(dropped)
+                self._dropped = 0
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(5)
+            self._thread = None
+        self.target.close()
+        logging.Handler.close(self)
+
+
+@util.export
+def setupLogger():
+    """Log to syslog
+
+    The environment may set:
+        OVIRT_SERVICE_DEBUG=1 to log debug records.
+        OVIRT_SERVICE_LOG_ASYNC=1 to log from a background thread.
+        OVIRT_SERVICE_LOG_JSON=1 to log records as JSON objects.
+        OVIRT_SERVICE_LOG_RATE=n to log at most n records below warning
+            per second of each logger.
+    """
+    process = os.path.splitext(os.path.basename(sys.argv[0]))[0]
 
     logger = logging.getLogger('ovirt')
     logger.propagate = False
@@ -89,19 +392,28 @@ def setupLogger():
             facility=logging.handlers.SysLogHandler.LOG_DAEMON,
         )
         h.setLevel(logging.DEBUG)
-        h.setFormatter(
-            _MyFormatter(
-                fmt=(
-                    '%(asctime)s '
-                    '{process}: '
-                    '%(levelname)s '
-                    '%(funcName)s:%(lineno)d '
-                    '%(message)s'
-                ).format(
-                    process=os.path.splitext(os.path.basename(sys.argv[0]))[0],
+        if os.environ.get('OVIRT_SERVICE_LOG_JSON', '0') != '0':
+            h.setFormatter(_JsonFormatter(process=process))
+        else:
+            h.setFormatter(
+                _Formatter(
+                    fmt=(
+                        '%(asctime)s '
+                        '{process}: '
+                        '%(levelname)s '
+                        '%(funcName)s:%(lineno)d '
+                        '%(message)s'
+                    ).format(
+                        process=process,
+                    ),
                 ),
-            ),
-        )
+            )
+        if os.environ.get('OVIRT_SERVICE_LOG_ASYNC', '0') != '0':
+            h = _QueueHandler(h)
+            h.setLevel(logging.DEBUG)
+        rate = int(os.environ.get('OVIRT_SERVICE_LOG_RATE', '0'))
+        if rate > 0:
+            h.addFilter(_RateLimitFilter(rate))
         logger.addHandler(h)
     except IOError:
         logging.debug('Cannot open syslog logger', exc_info=True)
@@ -201,6 +513,167 @@ class PidFile(base.Base):
                     self.logger.debug('exception', exc_info=True)
 
 
+@util.export
+class ConfigWatcher(base.Base):
+    """
+    Reload configuration files when they change
+
+    The directories of the files and their .d directories are watched
+    using inotify, changes are collected until the directories are quiet
+    for delay seconds, then the files are reloaded and the changed keys
+    are delivered to callback(changes), see ConfigFile.reload().
+
+    Usage:
+        ConfigWatcher(configs, callback).start()
+    """
+
+    # inotify(7)
+    _IN_CLOEXEC = 0o2000000
+    _IN_MASK = (
+        0x00000008 |  # IN_CLOSE_WRITE
+        0x00000040 |  # IN_MOVED_FROM
+        0x00000080 |  # IN_MOVED_TO
+        0x00000100 |  # IN_CREATE
+        0x00000200    # IN_DELETE
+    )
+
+    def __init__(self, configs, callback, delay=1):
+        super(ConfigWatcher, self).__init__()
+        self._configs = configs
+        self._callback = callback
+        self._delay = delay
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True,
+        )
+        self._fd = self._libc.inotify_init1(self._IN_CLOEXEC)
+        if self._fd == -1:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def _watch(self):
+        directories = set()
+        for config in self._configs:
+            for file in config.files:
+                directories.add(os.path.dirname(os.path.abspath(file)))
+                directories.add('%s.d' % os.path.abspath(file))
+        for directory in directories:
+            if os.path.isdir(directory):
+                # watching the same directory again is a no-op
+                if self._libc.inotify_add_watch(
+                    self._fd,
+                    directory.encode('utf-8'),
+                    self._IN_MASK,
+                ) == -1:
+                    self.logger.debug(
+                        "cannot watch '%s': %s",
+                        directory,
+                        os.strerror(ctypes.get_errno()),
+                    )
+
+    def _wait(self, timeout=None):
+        while True:
+            try:
+                return bool(select.select([self._fd], [], [], timeout)[0])
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _reload(self):
+        changes = {}
+        for config in self._configs:
+            try:
+                changes.update(config.reload())
+            except Exception as e:
+                self.logger.error(
+                    _('Cannot reload configuration: {error}').format(
+                        error=e,
+                    )
+                )
+                self.logger.debug('exception', exc_info=True)
+        if changes:
+            self.logger.info(
+                _('Configuration changed: {keys}').format(
+                    keys=', '.join(sorted(changes)),
+                )
+            )
+            try:
+                self._callback(changes)
+            except Exception as e:
+                self.logger.error(
+                    _('Cannot apply configuration: {error}').format(
+                        error=e,
+                    )
+                )
+                self.logger.debug('exception', exc_info=True)
+
+    def _run(self):
+        while True:
+            self._watch()
+            self._wait()
+            # drain events until quiet, editors write in several steps
+            while self._wait(self._delay):
+                os.read(self._fd, 4096)
+            self._reload()
+
+    def start(self):
+        t = threading.Thread(target=self._run, name='ConfigWatcher')
+        t.daemon = True
+        t.start()
+
+
+@util.export
+class HttpProbe(base.Base):
+    """
+    Probe passing when url responds with HTTP status 200
+
+    Usage:
+        probe = HttpProbe('http://127.0.0.1:8080/health')
+        if probe():
+            ...
+    """
+
+    def __init__(self, url, timeout=5):
+        super(HttpProbe, self).__init__()
+        self._url = url
+        self._timeout = timeout
+
+    def __str__(self):
+        return self._url
+
+    def __call__(self):
+        try:
+            with contextlib.closing(
+                urlopen(self._url, timeout=self._timeout)
+            ) as response:
+                return response.getcode() == 200
+        except Exception as e:
+            self.logger.debug("probe '%s' failed: %s", self._url, e)
+            return False
+
+
+@util.export
+class SocketProbe(base.Base):
+    """
+    Probe passing when a TCP connection to host:port is accepted
+    """
+
+    def __init__(self, host, port, timeout=5):
+        super(SocketProbe, self).__init__()
+        self._address = (host, int(port))
+        self._timeout = timeout
+
+    def __str__(self):
+        return '%s:%s' % self._address
+
+    def __call__(self):
+        try:
+            socket.create_connection(self._address, self._timeout).close()
+            return True
+        except socket.error as e:
+            self.logger.debug("probe '%s' failed: %s", self, e)
+            return False
+
+
 @util.export
 class Daemon(base.Base):
 
@@ -215,8 +688,15 @@ class Daemon(base.Base):
     def debug(self):
         return self._options.debug
 
+    @property
+    def externalProcess(self):
+        """The process run by daemonAsExternalProcess, if running"""
+        return self._externalProcess
+
     def __init__(self):
         super(Daemon, self).__init__()
+        self._externalProcess = None
+        self._ready = False
 
     def check(
         self,
@@ -302,6 +782,119 @@ class Daemon(base.Base):
                     )
                 )
 
+    def _stopExternalProcess(self, p, stopTime, stopInterval):
+        """
+        Terminate the process, kill it if it is still running after
+        stopTime seconds. Return whether it had to be killed.
+        """
+        try:
+            self.logger.debug('terminating pid=%s', p.pid)
+            p.terminate()
+            for i in range(stopTime // stopInterval):
+                if p.poll() is not None:
+                    self.logger.debug('terminated pid=%s', p.pid)
+                    break
+                self.logger.debug(
+                    'waiting for termination of pid=%s',
+                    p.pid,
+                )
+                time.sleep(stopInterval)
+        except OSError as e:
+            self.logger.warning(
+                _('Cannot terminate pid {pid}: {error}').format(
+                    pid=p.pid,
+                    error=e,
+                )
+            )
+            self.logger.debug('exception', exc_info=True)
+
+        try:
+            if p.poll() is None:
+                self.logger.debug('killing pid=%s', p.pid)
+                p.kill()
+                p.wait()
+                return True
+        except OSError as e:
+            self.logger.warning(
+                _('Cannot kill pid {pid}: {error}').format(
+                    pid=p.pid,
+                    error=e
+                )
+            )
+            self.logger.debug('exception', exc_info=True)
+            raise
+        return False
+
+    def _probeExternalProcess(
+        self,
+        p,
+        probe,
+        probeInterval,
+        probeFailures,
+        startTimeout,
+        stopTime,
+        stopInterval,
+    ):
+        """
+        Wait for the process to terminate, stop it when it does not pass
+        the probe within startTimeout seconds or, once it passed, fails
+        it probeFailures times in a row. Return whether it passed.
+        """
+        passed = False
+        failures = 0
+        started = time.time()
+        while True:
+            for i in range(max(1, probeInterval)):
+                if p.poll() is not None:
+                    return passed
+                time.sleep(1)
+
+            if probe():
+                if not passed:
+                    message = _(
+                        "Process pid {pid} passed probe '{probe}'"
+                    ).format(
+                        pid=p.pid,
+                        probe=probe,
+                    )
+                    self.logger.info(message)
+                    self._daemonStatus(message)
+                passed = True
+                failures = 0
+                continue
+
+            if passed:
+                failures += 1
+                self.logger.warning(
+                    _(
+                        "Process pid {pid} failed probe '{probe}' "
+                        "({failures}/{max})"
+                    ).format(
+                        pid=p.pid,
+                        probe=probe,
+                        failures=failures,
+                        max=probeFailures,
+                    )
+                )
+                if failures < probeFailures:
+                    continue
+            elif time.time() - started < startTimeout:
+                continue
+            else:
+                self.logger.warning(
+                    _(
+                        "Process pid {pid} did not pass probe '{probe}' "
+                        "within {timeout} seconds"
+                    ).format(
+                        pid=p.pid,
+                        probe=probe,
+                        timeout=startTimeout,
+                    )
+                )
+
+            self._stopExternalProcess(p, stopTime, stopInterval)
+            return passed
+
     def daemonAsExternalProcess(
         self,
         executable,
@@ -309,7 +902,23 @@ class Daemon(base.Base):
         env,
         stopTime=30,
         stopInterval=1,
+        supervise=False,
+        probeInterval=10,
+        probeFailures=3,
+        startTimeout=300,
+        restartDelay=1,
+        restartDelayMax=60,
     ):
+        """Execute the daemon process and wait for its termination
+
+        When supervised, the process is restarted when it terminates with
+        an error or stops passing daemonProbe(), see _probeExternalProcess.
+        Restarts are delayed by restartDelay seconds, doubled for each
+        restart up to restartDelayMax, and reset once the process passed
+        the probe, or without a probe, ran for restartDelayMax seconds.
+        daemonRestart() is called before each restart, the environment
+        prepared by daemonSetup() is kept.
+        """
         self.logger.debug(
             'executing daemon: exe=%s, args=%s, env=%s',
             executable,
@@ -317,35 +926,72 @@ class Daemon(base.Base):
             env,
         )
 
+        probe = self.daemonProbe() if supervise else None
+        delay = restartDelay
+        p = None
         try:
-            self.logger.debug('creating process')
-            p = subprocess.Popen(
-                args=args,
-                executable=executable,
-                env=env,
-                close_fds=True,
-            )
+            while True:
+                self.logger.debug('creating process')
+                p = subprocess.Popen(
+                    args=args,
+                    executable=executable,
+                    env=env,
+                    close_fds=True,
+                )
+                self._externalProcess = p
+                started = time.time()
 
-            self.logger.debug(
-                'waiting for termination of pid=%s',
-                p.pid,
-            )
-            p.wait()
-            self.logger.debug(
-                'terminated pid=%s rc=%s',
-                p.pid,
-                p.returncode,
-            )
+                self.logger.debug(
+                    'waiting for termination of pid=%s',
+                    p.pid,
+                )
+                if probe is not None:
+                    passed = self._probeExternalProcess(
+                        p=p,
+                        probe=probe,
+                        probeInterval=probeInterval,
+                        probeFailures=probeFailures,
+                        startTimeout=startTimeout,
+                        stopTime=stopTime,
+                        stopInterval=stopInterval,
+                    )
+                else:
+                    p.wait()
+                    passed = time.time() - started >= restartDelayMax
+                self._externalProcess = None
+                self.logger.debug(
+                    'terminated pid=%s rc=%s',
+                    p.pid,
+                    p.returncode,
+                )
 
-            if p.returncode != 0:
-                raise RuntimeError(
-                    _(
-                        'process terminated with status '
-                        'code {code}'
-                    ).format(
-                        code=p.returncode,
+                if p.returncode == 0:
+                    break
+                if not supervise:
+                    raise RuntimeError(
+                        _(
+                            'process terminated with status '
+                            'code {code}'
+                        ).format(
+                            code=p.returncode,
+                        )
                     )
+
+                if passed:
+                    delay = restartDelay
+                message = _(
+                    'Process terminated with status code {code}, '
+                    'restarting in {delay} seconds'
+                ).format(
+                    code=p.returncode,
+                    delay=delay,
                 )
+                self.logger.warning(message)
+                self._daemonStatus(message)
+                p = None
+                time.sleep(delay)
+                delay = min(delay * 2, restartDelayMax)
+                self.daemonRestart()
 
         except self.TerminateException:
             self.logger.debug('got stop signal')
@@ -354,45 +1000,16 @@ class Daemon(base.Base):
             for sig in (signal.SIGTERM, signal.SIGINT):
                 signal.signal(sig, signal.SIG_IGN)
 
-            try:
-                self.logger.debug('terminating pid=%s', p.pid)
-                p.terminate()
-                for i in range(stopTime // stopInterval):
-                    if p.poll() is not None:
-                        self.logger.debug('terminated pid=%s', p.pid)
-                        break
-                    self.logger.debug(
-                        'waiting for termination of pid=%s',
-                        p.pid,
-                    )
-                    time.sleep(stopInterval)
-            except OSError as e:
-                self.logger.warning(
-                    _('Cannot terminate pid {pid}: {error}').format(
-                        pid=p.pid,
-                        error=e,
-                    )
-                )
-                self.logger.debug('exception', exc_info=True)
-
-            try:
-                if p.poll() is None:
-                    self.logger.debug('killing pid=%s', p.pid)
-                    p.kill()
-                    raise RuntimeError(
-                        _('Had to kill process {pid}').format(
-                            pid=p.pid
-                        )
-                    )
-            except OSError as e:
-                self.logger.warning(
-                    _('Cannot kill pid {pid}: {error}').format(
-                        pid=p.pid,
-                        error=e
+            if p is not None and self._stopExternalProcess(
+                p,
+                stopTime,
+                stopInterval,
+            ):
+                raise RuntimeError(
+                    _('Had to kill process {pid}').format(
+                        pid=p.pid
                     )
                 )
-                self.logger.debug('exception', exc_info=True)
-                raise
 
             raise
 
@@ -402,7 +1019,7 @@ class Daemon(base.Base):
             soft, hard = resource.getrlimit(resource.RLIMIT_NPROC)
             resource.setrlimit(resource.RLIMIT_NPROC, (hard, hard))
 
-    def _sd_notify_ready(self):
+    def _sd_notify(self, state):
         """
         NOTICE: systemd-notify is not working!
         SEE: rhbz#820448
@@ -415,11 +1032,44 @@ class Daemon(base.Base):
                 # abstract namespace socket
                 e = '\0%s' % e[1:]
             s.connect(e)
-            s.sendall('READY=1')
+            s.sendall(state.encode('utf-8'))
+
+    def _daemonReload(self, changes):
+        for key in self.daemonRestartKeys():
+            if key in changes:
+                self.logger.warning(
+                    _(
+                        "Change of '{key}' requires restart of the service"
+                    ).format(
+                        key=key,
+                    )
+                )
+        self.daemonReload(changes)
 
     def _daemonReady(self):
+        if not self._ready:
+            self._ready = True
+            if self._options.systemd == 'notify':
+                self._sd_notify('READY=1')
+            profileWrite()
+
+    def _daemonStatus(self, status):
         if self._options.systemd == 'notify':
-            self._sd_notify_ready()
+            self._sd_notify('STATUS=%s' % status)
+
+    def _waitReady(self, probe, interval=1):
+        """
+        Report readiness once the probe passes
+        """
+        def _run():
+            while not probe():
+                time.sleep(interval)
+            self.logger.debug("probe '%s' passed", probe)
+            self._daemonReady()
+
+        t = threading.Thread(target=_run, name='ReadinessProbe')
+        t.daemon = True
+        t.start()
 
     def _daemon(self):
 
@@ -428,9 +1078,12 @@ class Daemon(base.Base):
 
         os.umask(0o022)
 
-        self.daemonSetup()
+        with profilePhase('daemonSetup'):
+            self.daemonSetup()
 
-        self._daemonReady()
+        probe = self.daemonProbe()
+        if probe is None:
+            self._daemonReady()
 
         stdout, stderr = (sys.stdout, sys.stderr)
         if self._options.redirectOutput:
@@ -444,9 +1097,11 @@ class Daemon(base.Base):
         # bit undocumented.
         #
         handles = []
-        for l in logging.getLogger('ovirt').handlers:
-            if hasattr(l, 'socket'):
-                handles.append(l.socket)
+        for handler in logging.getLogger('ovirt').handlers:
+            # the syslog handler may be wrapped by the queue handler
+            target = getattr(handler, 'target', handler)
+            if hasattr(target, 'socket'):
+                handles.append(target.socket)
 
         with daemon.DaemonContext(
             detach_process=self._options.background,
@@ -464,6 +1119,24 @@ class Daemon(base.Base):
 
             self._setLimits()
 
+            configs = self.daemonConfigs()
+            if configs:
+                try:
+                    ConfigWatcher(configs, self._daemonReload).start()
+                except OSError as e:
+                    self.logger.warning(
+                        _(
+                            'Cannot watch configuration, changes will '
+                            'require restart: {error}'
+                        ).format(
+                            error=e,
+                        )
+                    )
+                    self.logger.debug('exception', exc_info=True)
+
+            if probe is not None:
+                self._waitReady(probe)
+
             try:
                 with PidFile(self._options.pidfile):
                     self.daemonContext()
@@ -581,5 +1254,37 @@ class Daemon(base.Base):
         """Cleanup"""
         pass
 
+    def daemonConfigs(self):
+        """Return the ConfigFile objects to reload on change
+        Called within daemon context
+        """
+        return []
+
+    def daemonRestartKeys(self):
+        """Return the configuration keys whose change is applied only
+        by a restart of the service
+        """
+        return ()
+
+    def daemonReload(self, changes):
+        """Apply configuration changes
+        Called from the configuration watcher thread with the changed
+        keys mapped to (old, new) values
+        """
+        pass
+
+    def daemonProbe(self):
+        """Return the probe of the daemon, a callable returning whether
+        it is healthy, or None
+        Readiness is reported only once the probe passes, and the
+        process of a supervised daemonAsExternalProcess is restarted
+        when it stops passing it
+        """
+        return None
+
+    def daemonRestart(self):
+        """Prepare the restart of a supervised external process"""
+        pass
+
 
 # vim: expandtab tabstop=4 shiftwidth=4
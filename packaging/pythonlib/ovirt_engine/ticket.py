@@ -2,9 +2,8 @@ import base64
 import datetime
 import json
 
-from M2Crypto import EVP
-from M2Crypto import X509
-from M2Crypto import Rand
+# M2Crypto is imported by the objects which use it, as it is slow to
+# import and not needed by all the users of this module
 
 
 class TicketEncoder():
@@ -14,11 +13,16 @@ class TicketEncoder():
         return d.strftime("%Y%m%d%H%M%S")
 
     def __init__(self, cert, key, lifetime=5):
+        from M2Crypto import EVP
+        from M2Crypto import X509
+
         self._lifetime = lifetime
         self._x509 = X509.load_cert(cert)
         self._pkey = EVP.load_key(key)
 
     def encode(self, data):
+        from M2Crypto import Rand
+
         d = {
             'salt': base64.b64encode(Rand.rand_bytes(8)),
             'digest': 'sha1',
@@ -67,6 +71,8 @@ class TicketDecoder():
             raise ValueError('Certificate expired')
 
     def __init__(self, ca, eku, peer=None):
+        from M2Crypto import X509
+
         self._eku = eku
         if peer is not None:
             self._peer = X509.load_cert_string(peer)
@@ -74,6 +80,8 @@ class TicketDecoder():
             self._ca = X509.load_cert(ca)
 
     def decode(self, ticket):
+        from M2Crypto import X509
+
         decoded = json.loads(base64.b64decode(ticket))
 
         if self._peer is not None:
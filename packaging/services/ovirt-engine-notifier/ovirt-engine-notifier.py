@@ -26,6 +26,7 @@ import config
 
 from ovirt_engine import configfile
 from ovirt_engine import java
+from ovirt_engine import jvmtune
 from ovirt_engine import service
 
 
@@ -118,11 +119,12 @@ class Daemon(service.Daemon):
         #
         # the earliest so we can abort early.
         #
-        self._executable = os.path.join(
-            java.Java().getJavaHome(),
-            'bin',
-            'java',
-        )
+        with service.profilePhase('java'):
+            self._executable = os.path.join(
+                java.Java().getJavaHome(),
+                'bin',
+                'java',
+            )
 
         jbossModulesJar = os.path.join(
             self._config.get('JBOSS_HOME'),
@@ -139,6 +141,15 @@ class Daemon(service.Daemon):
             'ovirt-engine-notifier',
         ]
 
+        # Follow the memory and CPUs available:
+        sizing = jvmtune.Sizing(
+            jvmArgs=shlex.split(self._config.get('NOTIFIER_JVM_ARGS')),
+            mallocArenaMax=self._config.get('NOTIFIER_MALLOC_ARENA_MAX'),
+        )
+        if sizing.heapMax is not None:
+            self._engineArgs.append('-Xmx%s' % sizing.heapMax)
+        self._engineArgs.extend(sizing.args)
+
         # Add extra system properties provided in the configuration:
         for notifierProperty in shlex.split(
                 self._config.get('NOTIFIER_PROPERTIES')
@@ -188,7 +199,7 @@ class Daemon(service.Daemon):
             'ENGINE_VARS': config.ENGINE_VARS,
             'ENGINE_NOTIFIER_DEFAULTS': self._defaults,
             'ENGINE_NOTIFIER_VARS': config.ENGINE_NOTIFIER_VARS,
-            'MALLOC_ARENA_MAX': self._config.get('NOTIFIER_MALLOC_ARENA_MAX'),
+            'MALLOC_ARENA_MAX': sizing.mallocArenaMax,
         })
 
         self._validateConfig()
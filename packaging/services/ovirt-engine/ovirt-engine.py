@@ -16,19 +16,24 @@
 
 
 import gettext
+import hashlib
+import json
 import os
 import re
 import shlex
+import shutil
+import signal
 import subprocess
 import sys
-
-from jinja2 import Template
+import threading
+import time
 
 import config
 
 
 from ovirt_engine import configfile
 from ovirt_engine import java
+from ovirt_engine import jvmtune
 from ovirt_engine import mem
 from ovirt_engine import service
 
@@ -39,6 +44,16 @@ def _(m):
 
 class Daemon(service.Daemon):
 
+    _DEPLOYMENT_MARKERS = (
+        '.dodeploy',
+        '.deployed',
+        '.failed',
+        '.isdeploying',
+        '.isundeploying',
+        '.pending',
+        '.undeployed',
+    )
+
     _JBOSS_VERSION_REGEX = re.compile(
         flags=re.VERBOSE,
         pattern=r"""
@@ -59,6 +74,10 @@ class Daemon(service.Daemon):
         self._jbossRuntime = None
         self._jbossVersion = None
         self._jbossConfigFile = None
+        self._incremental = False
+        self._diagnosticArgs = []
+        self._jfrEnabled = False
+        self._probe = None
         self._defaults = os.path.abspath(
             os.path.join(
                 os.path.dirname(sys.argv[0]),
@@ -66,23 +85,67 @@ class Daemon(service.Daemon):
             )
         )
 
+    def _templateHash(self, template):
+        st = os.stat(template)
+        return hashlib.sha1(
+            json.dumps(
+                [
+                    template,
+                    st.st_mtime,
+                    st.st_size,
+                    self._config.values,
+                    self._jbossVersion,
+                    self._jbossRuntime.directory,
+                ],
+                sort_keys=True,
+            ).encode('utf-8')
+        ).hexdigest()
+
+    def _outputStamp(self, out, digest):
+        st = os.stat(out)
+        return [digest, st.st_mtime, st.st_size]
+
     def _processTemplate(self, template, dir, mode=None):
         out = os.path.join(
             dir,
             re.sub('\.in$', '', os.path.basename(template)),
         )
-        with open(template, 'r') as f:
-            t = Template(f.read())
-        with open(out, 'w') as f:
-            if mode is not None:
-                os.chmod(out, mode)
-            f.write(
-                t.render(
-                    config=self._config,
-                    jboss_version=self._jbossVersion,
-                    jboss_runtime=self._jbossRuntime.directory,
+        stampFile = os.path.join(
+            dir,
+            '.%s.stamp' % os.path.basename(out),
+        )
+
+        if self._incremental:
+            digest = self._templateHash(template)
+            try:
+                with open(stampFile) as f:
+                    if json.load(f) == self._outputStamp(out, digest):
+                        self.logger.debug("Reusing '%s'", out)
+                        return out
+            except (IOError, OSError, ValueError):
+                pass
+
+        with service.profilePhase(os.path.basename(template)):
+            # jinja2 is needed only when rendering
+            from jinja2 import Template
+            with open(template, 'r') as f:
+                t = Template(f.read())
+            tmp = '%s.tmp' % out
+            with open(tmp, 'w') as f:
+                if mode is not None:
+                    os.chmod(tmp, mode)
+                f.write(
+                    t.render(
+                        config=self._config,
+                        jboss_version=self._jbossVersion,
+                        jboss_runtime=self._jbossRuntime.directory,
+                    )
                 )
-            )
+            os.rename(tmp, out)
+
+        if self._incremental:
+            with open(stampFile, 'w') as f:
+                json.dump(self._outputStamp(out, digest), f)
         return out
 
     def _checkInstallation(
@@ -144,13 +207,70 @@ class Daemon(service.Daemon):
                 mustExist=False,
             )
 
+    def _prepareJBossRuntime(self):
+        """
+        In incremental mode the runtime directory of the previous run is
+        reused, only its temporary directory and the configuration
+        history of JBoss are cleared.
+        """
+        if not self._incremental:
+            self._jbossRuntime.create()
+            return
+
+        if not os.path.isdir(self._jbossRuntime.directory):
+            os.makedirs(self._jbossRuntime.directory, 0o700)
+        for name in (
+            'tmp',
+            os.path.join('config', 'ovirt-engine_xml_history'),
+        ):
+            path = os.path.join(self._jbossRuntime.directory, name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def _linkEngineApp(self, engineAppDir, engineAppLink):
+        if os.path.islink(engineAppLink):
+            if os.readlink(engineAppLink) == engineAppDir:
+                return
+            # replace the link atomically
+            tmp = '%s.tmp' % engineAppLink
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            os.symlink(engineAppDir, tmp)
+            os.rename(tmp, engineAppLink)
+        else:
+            os.symlink(engineAppDir, engineAppLink)
+
     def _setupEngineApps(self):
 
         deploymentsDir = os.path.join(
             self._jbossRuntime.directory,
             'deployments',
         )
-        os.mkdir(deploymentsDir)
+        if not os.path.isdir(deploymentsDir):
+            os.mkdir(deploymentsDir)
+
+        # Remove the links and the markers of the previous run, the
+        # links of applications which are still deployed are reused:
+        engineAppLinks = set()
+        for engineAppDir in shlex.split(self._config.get('ENGINE_APPS')):
+            if not os.path.isabs(engineAppDir):
+                engineAppDir = os.path.join(
+                    self._config.get('ENGINE_USR'),
+                    engineAppDir,
+                )
+            if os.path.exists(engineAppDir):
+                engineAppLinks.add(os.path.basename(engineAppDir))
+        for name in os.listdir(deploymentsDir):
+            path = os.path.join(deploymentsDir, name)
+            if (
+                os.path.splitext(name)[1] in self._DEPLOYMENT_MARKERS or
+                name not in engineAppLinks or
+                not os.path.islink(path)
+            ):
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
 
         # The list of applications to be deployed:
         for engineAppDir in shlex.split(self._config.get('ENGINE_APPS')):
@@ -175,11 +295,76 @@ class Daemon(service.Daemon):
                 deploymentsDir,
                 os.path.basename(engineAppDir),
             )
-            os.symlink(engineAppDir, engineAppLink)
+            self._linkEngineApp(engineAppDir, engineAppLink)
             with open('%s.dodeploy' % engineAppLink, 'w'):
                 pass
 
-    def _detectJBossVersion(self):
+    def _jbossVersionCacheKey(self, jbossModulesJar):
+        jar = os.stat(jbossModulesJar)
+        java = os.path.realpath(self._executable)
+        return [
+            os.path.realpath(jbossModulesJar),
+            jar.st_size,
+            jar.st_mtime,
+            java,
+            os.stat(java).st_mtime,
+        ]
+
+    def _loadJBossVersion(self, cacheFile, key):
+        try:
+            with open(cacheFile) as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                return dict(
+                    (str(k), int(v))
+                    for k, v in cached['version'].items()
+                )
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.debug(
+                "Cannot use JBoss version cache '%s': %s",
+                cacheFile,
+                e,
+            )
+        return None
+
+    def _saveJBossVersion(self, cacheFile, key):
+        try:
+            tmp = '%s.tmp' % cacheFile
+            with open(tmp, 'w') as f:
+                json.dump(
+                    {
+                        'key': key,
+                        'version': self._jbossVersion,
+                    },
+                    f,
+                )
+            os.rename(tmp, cacheFile)
+        except (IOError, OSError) as e:
+            self.logger.debug(
+                "Cannot save JBoss version cache '%s': %s",
+                cacheFile,
+                e,
+            )
+
+    def _detectJBossVersion(self, jbossModulesJar):
+        """
+        Running the version probe starts a whole JVM, so the result is
+        cached by jboss-modules.jar and java, and the probe runs only
+        when either of them changes.
+        """
+        cacheFile = os.path.join(
+            self._config.get('ENGINE_CACHE'),
+            'jboss-version.json',
+        )
+        key = self._jbossVersionCacheKey(jbossModulesJar)
+        self._jbossVersion = self._loadJBossVersion(cacheFile, key)
+        if self._jbossVersion is not None:
+            self.logger.debug(
+                "Cached JBoss version: %s",
+                self._jbossVersion,
+            )
+            return
+
         args = ['ovirt-engine-version'] + self._engineArgs + ['-v']
         self.logger.info(
             "Detecting JBoss version. Running: {exe} {args}".format(
@@ -223,6 +408,177 @@ class Daemon(service.Daemon):
             "Detected JBoss version: %s",
             self._jbossVersion,
         )
+        self._saveJBossVersion(cacheFile, key)
+
+    def _setupDiagnostics(self):
+        """
+        GC logging and flight recording are kept out of the engine
+        arguments, as these are used by the version probe as well.
+        """
+        # Java 9 and later have a modules image instead of rt.jar:
+        unified = os.path.exists(
+            os.path.join(self._javaHome, 'lib', 'modules')
+        )
+
+        if self._config.getboolean('ENGINE_GC_LOG'):
+            gcLog = os.path.join(self._config.get('ENGINE_LOG'), 'gc.log')
+            if unified:
+                self._diagnosticArgs.append(
+                    '-Xlog:gc*:file=%s:time,uptime,level,tags:'
+                    'filecount=%s,filesize=%s' % (
+                        gcLog,
+                        self._config.getinteger('ENGINE_GC_LOG_FILES'),
+                        self._config.get('ENGINE_GC_LOG_FILE_SIZE'),
+                    )
+                )
+            else:
+                self._diagnosticArgs.extend([
+                    '-Xloggc:%s' % gcLog,
+                    '-XX:+PrintGCDetails',
+                    '-XX:+PrintGCDateStamps',
+                    '-XX:+PrintGCApplicationStoppedTime',
+                    '-XX:+UseGCLogFileRotation',
+                    '-XX:NumberOfGCLogFiles=%s' % self._config.getinteger(
+                        'ENGINE_GC_LOG_FILES'
+                    ),
+                    '-XX:GCLogFileSize=%s' % self._config.get(
+                        'ENGINE_GC_LOG_FILE_SIZE'
+                    ),
+                ])
+
+        if self._config.getboolean('ENGINE_JFR'):
+            # an unknown option would prevent the JVM from starting
+            if not os.path.isdir(os.path.join(self._javaHome, 'lib', 'jfr')):
+                self.logger.warning(
+                    _(
+                        "Java Flight Recorder is not available in "
+                        "'{java}', ENGINE_JFR is ignored"
+                    ).format(
+                        java=self._javaHome,
+                    )
+                )
+                return
+
+            self.check(
+                self._config.get('ENGINE_JFR_DUMP_DIR'),
+                directory=True,
+                writable=True,
+            )
+            self._diagnosticArgs.extend([
+                '-XX:FlightRecorderOptions=repository=%s' % os.path.join(
+                    self._tempDir.directory,
+                    'jfr',
+                ),
+                (
+                    '-XX:StartFlightRecording=name=ovirt-engine,'
+                    'settings=%s,disk=true,maxage=%s,maxsize=%s,'
+                    'dumponexit=true,filename=%s'
+                ) % (
+                    self._config.get('ENGINE_JFR_SETTINGS'),
+                    self._config.get('ENGINE_JFR_MAX_AGE'),
+                    self._config.get('ENGINE_JFR_MAX_SIZE'),
+                    os.path.join(
+                        self._config.get('ENGINE_JFR_DUMP_DIR'),
+                        'ovirt-engine-exit.jfr',
+                    ),
+                ),
+            ])
+            self._jfrEnabled = True
+
+    def _jcmd(self):
+        # jcmd is part of the JDK, JAVA_HOME may be the jre within it
+        for jcmd in (
+            os.path.join(self._javaHome, 'bin', 'jcmd'),
+            os.path.join(os.path.dirname(self._javaHome), 'bin', 'jcmd'),
+        ):
+            if os.access(jcmd, os.X_OK):
+                return jcmd
+        return None
+
+    def _dumpFlightRecording(self):
+        process = self.externalProcess
+        jcmd = self._jcmd()
+        if process is None:
+            return
+        if jcmd is None:
+            self.logger.error(
+                _('Cannot dump flight recording, jcmd is not installed')
+            )
+            return
+
+        filename = os.path.join(
+            self._config.get('ENGINE_JFR_DUMP_DIR'),
+            'ovirt-engine-%s.jfr' % time.strftime('%Y%m%d%H%M%S'),
+        )
+        self.logger.info(
+            _("Dumping flight recording to '{file}'").format(
+                file=filename,
+            )
+        )
+        p = subprocess.Popen(
+            args=(
+                jcmd,
+                str(process.pid),
+                'JFR.dump',
+                'name=ovirt-engine',
+                'filename=%s' % filename,
+            ),
+            env=self._engineEnv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+        )
+        stdout, stderr = p.communicate()
+        if p.returncode != 0:
+            self.logger.error(
+                _('Cannot dump flight recording: {error}').format(
+                    error=stdout.decode('utf-8', 'replace'),
+                )
+            )
+
+    def _onDumpSignal(self, signum, frame):
+        if not self._jfrEnabled:
+            self.logger.warning(
+                _('Flight recording dump requested, but ENGINE_JFR is off')
+            )
+            return
+        # do not block waiting for the engine
+        t = threading.Thread(
+            target=self._dumpFlightRecording,
+            name='JFRDump',
+        )
+        t.daemon = True
+        t.start()
+
+    def _setupProbe(self):
+        if not self._config.getboolean('ENGINE_SUPERVISE'):
+            return
+        url = self._config.get('ENGINE_HEALTH_URL')
+        if not url:
+            # the HTTP connector of the engine, or the web server in
+            # front of it
+            for enabled, port in (
+                ('ENGINE_HTTP_ENABLED', 'ENGINE_HTTP_PORT'),
+                ('ENGINE_PROXY_ENABLED', 'ENGINE_PROXY_HTTP_PORT'),
+            ):
+                if self._config.getboolean(enabled):
+                    url = 'http://127.0.0.1:%s%s/services/health' % (
+                        self._config.get(port),
+                        self._config.get('ENGINE_URI'),
+                    )
+                    break
+        if not url:
+            self.logger.warning(
+                _(
+                    'No health url is available, the engine will be '
+                    'restarted only when it exits'
+                )
+            )
+            return
+        self._probe = service.HttpProbe(
+            url=url,
+            timeout=self._config.getinteger('ENGINE_PROBE_TIMEOUT'),
+        )
 
     def daemonSetup(self):
 
@@ -251,8 +607,10 @@ class Daemon(service.Daemon):
         #
         # the earliest so we can abort early.
         #
+        with service.profilePhase('java'):
+            self._javaHome = java.Java().getJavaHome()
         self._executable = os.path.join(
-            java.Java().getJavaHome(),
+            self._javaHome,
             'bin',
             'java',
         )
@@ -270,10 +628,14 @@ class Daemon(service.Daemon):
         self._tempDir = service.TempDir(self._config.get('ENGINE_TMP'))
         self._tempDir.create()
 
+        self._incremental = self._config.getboolean(
+            'ENGINE_RUNTIME_INCREMENTAL'
+        )
         self._jbossRuntime = service.TempDir(self._config.get('JBOSS_RUNTIME'))
-        self._jbossRuntime.create()
+        self._prepareJBossRuntime()
 
-        self._setupEngineApps()
+        with service.profilePhase('engineApps'):
+            self._setupEngineApps()
 
         jbossTempDir = os.path.join(
             self._jbossRuntime.directory,
@@ -294,7 +656,8 @@ class Daemon(service.Daemon):
         )
 
         os.mkdir(jbossTempDir)
-        os.mkdir(jbossConfigDir)
+        if not os.path.isdir(jbossConfigDir):
+            os.mkdir(jbossConfigDir)
         os.chmod(jbossConfigDir, 0o700)
 
         jbossBootLoggingFile = self._processTemplate(
@@ -308,43 +671,36 @@ class Daemon(service.Daemon):
         # We start with an empty list of arguments:
         self._engineArgs = []
 
-        # HEAP size
-        heap_min_conf = self._config.get('ENGINE_HEAP_MIN')
-        heap_max_conf = self._config.get('ENGINE_HEAP_MAX')
-
-        if not self._config.getboolean('ENFORCE_ENGINE_HEAP_PARAMS'):
-            total = mem.get_total_mb()
-
-            # Do not allow more than available memory
-            if mem.javaX_mb(heap_min_conf) > total:
-                new_min = total * 9 // 10
-                self.logger.warn(
-                    "ENGINE_HEAP_MIN is [%s], total available memory is %s "
-                    "MB. Setting to %s MB.",
-                    heap_min_conf,
-                    total,
-                    new_min,
-                )
-                heap_min_conf = '%sM' % new_min
-            if mem.javaX_mb(heap_max_conf) > total:
-                new_max = total * 9 // 10
-                self.logger.warn(
-                    "ENGINE_HEAP_MAX is [%s], total available memory is %s "
-                    "MB. Setting to %s MB.",
-                    heap_max_conf,
-                    total,
-                    new_max,
-                )
-                heap_max_conf = '%sM' % new_max
+        # HEAP size, GC and threads by the memory and CPUs available:
+        sizing = jvmtune.Sizing(
+            heapMin=self._config.get('ENGINE_HEAP_MIN'),
+            heapMax=self._config.get('ENGINE_HEAP_MAX'),
+            enforceHeap=self._config.getboolean('ENFORCE_ENGINE_HEAP_PARAMS'),
+            reservedMB=(
+                mem.javaX_mb(self._config.get('ENGINE_MEMORY_RESERVED'))
+                if self._config.get('ENGINE_MEMORY_RESERVED')
+                else None
+            ),
+            localDatabase=self._config.get('ENGINE_DB_HOST') in (
+                'localhost',
+                '127.0.0.1',
+                '::1',
+                self._config.get('ENGINE_FQDN'),
+            ),
+            jvmArgs=shlex.split(self._config.get('ENGINE_JVM_ARGS')),
+            mallocArenaMax=self._config.get('ENGINE_MALLOC_ARENA_MAX'),
+            selectGC=self._config.getboolean('ENGINE_SELECT_GC'),
+        )
+        self._mallocArenaMax = sizing.mallocArenaMax
 
         # Add arguments for the java virtual machine:
         self._engineArgs.extend([
             # Virtual machine options:
             '-server',
             '-XX:+TieredCompilation',
-            '-Xms%s' % heap_min_conf,
-            '-Xmx%s' % heap_max_conf,
-        ])
+            '-Xms%s' % sizing.heapMin,
+            '-Xmx%s' % sizing.heapMax,
+        ] + sizing.args)
 
         # Add extra system properties provided in the configuration:
         for engineProperty in shlex.split(
@@ -418,10 +774,15 @@ class Daemon(service.Daemon):
             'ENGINE_USR': self._config.get('ENGINE_USR'),
             'ENGINE_VAR': self._config.get('ENGINE_VAR'),
             'ENGINE_CACHE': self._config.get('ENGINE_CACHE'),
-            'MALLOC_ARENA_MAX': self._config.get('ENGINE_MALLOC_ARENA_MAX'),
+            'MALLOC_ARENA_MAX': self._mallocArenaMax,
         })
 
-        self._detectJBossVersion()
+        with service.profilePhase('jbossVersion'):
+            self._detectJBossVersion(jbossModulesJar)
+
+        self._setupDiagnostics()
+
+        self._setupProbe()
 
         self._jbossConfigFile = self._processTemplate(
             template=os.path.join(
@@ -450,6 +811,8 @@ class Daemon(service.Daemon):
             with open(self._config.get('ENGINE_UP_MARK'), 'w') as f:
                 f.write('%s\n' % os.getpid())
 
+            signal.signal(signal.SIGUSR1, self._onDumpSignal)
+
             #
             # NOTE:
             # jdwp must be set only for the process we are trying
@@ -467,6 +830,7 @@ class Daemon(service.Daemon):
                         self._config.get('ENGINE_DEBUG_ADDRESS')
                     )] if self._config.get('ENGINE_DEBUG_ADDRESS') else []) +
                     self._engineArgs +
+                    self._diagnosticArgs +
                     ['-c', os.path.basename(self._jbossConfigFile)]
                 ),
                 env=self._engineEnv,
@@ -476,6 +840,22 @@ class Daemon(service.Daemon):
                 stopInterval=self._config.getinteger(
                     'ENGINE_STOP_INTERVAL'
                 ),
+                supervise=self._config.getboolean('ENGINE_SUPERVISE'),
+                probeInterval=self._config.getinteger(
+                    'ENGINE_PROBE_INTERVAL'
+                ),
+                probeFailures=self._config.getinteger(
+                    'ENGINE_PROBE_FAILURES'
+                ),
+                startTimeout=self._config.getinteger(
+                    'ENGINE_START_TIMEOUT'
+                ),
+                restartDelay=self._config.getinteger(
+                    'ENGINE_RESTART_DELAY'
+                ),
+                restartDelayMax=self._config.getinteger(
+                    'ENGINE_RESTART_DELAY_MAX'
+                ),
             )
 
             raise self.TerminateException()
@@ -484,10 +864,22 @@ class Daemon(service.Daemon):
             if os.path.exists(self._config.get('ENGINE_UP_MARK')):
                 os.remove(self._config.get('ENGINE_UP_MARK'))
 
+    def daemonProbe(self):
+        return self._probe
+
+    def daemonRestart(self):
+        # the runtime directory is kept, only the temporary files and the
+        # deployment markers of the failed run are reset
+        jbossTempDir = os.path.join(self._jbossRuntime.directory, 'tmp')
+        if os.path.exists(jbossTempDir):
+            shutil.rmtree(jbossTempDir)
+        os.mkdir(jbossTempDir)
+        self._setupEngineApps()
+
     def daemonCleanup(self):
         if self._tempDir:
             self._tempDir.destroy()
-        if self._jbossRuntime:
+        if self._jbossRuntime and not self._incremental:
             self._jbossRuntime.destroy()
 
 
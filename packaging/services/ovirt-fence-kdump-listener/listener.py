@@ -62,6 +62,27 @@ class FenceKdumpListener(base.Base):
         self._db_connection_valid = True
         self._afterFirstDbSync = False
 
+        self.set_intervals(
+            heartbeat_interval=heartbeat_interval,
+            session_sync_interval=session_sync_interval,
+            reopen_db_connection_interval=reopen_db_connection_interval,
+            session_expiration_time=session_expiration_time,
+        )
+        self._lastHeartbeat = None
+        self._lastSessionSync = None
+        self._lastWakeup = None
+        self._lastDbConnectionAttempt = None
+        self._sessions = {}
+
+    def set_intervals(
+            self,
+            heartbeat_interval,
+            session_sync_interval,
+            reopen_db_connection_interval,
+            session_expiration_time,
+    ):
+        # may be called while running, new intervals are used from the
+        # next wakeup
         self._heartbeatInterval = heartbeat_interval
         self._sessionSyncInterval = session_sync_interval
         self._wakeupInterval = min(
@@ -70,11 +91,6 @@ class FenceKdumpListener(base.Base):
         )
         self._reopenDbConnInterval = reopen_db_connection_interval
         self._sessionExpirationTime = session_expiration_time
-        self._lastHeartbeat = None
-        self._lastSessionSync = None
-        self._lastWakeup = None
-        self._lastDbConnectionAttempt = None
-        self._sessions = {}
 
     def __enter__(self):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
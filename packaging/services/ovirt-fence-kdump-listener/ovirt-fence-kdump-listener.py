@@ -35,6 +35,7 @@ class Daemon(service.Daemon):
 
     def __init__(self):
         super(Daemon, self).__init__()
+        self._listener = None
         self._defaults = os.path.abspath(
             os.path.join(
                 os.path.dirname(sys.argv[0]),
@@ -89,6 +90,37 @@ class Daemon(service.Daemon):
             pidfile=self.pidfile,
         )
 
+    def _intervals(self):
+        return dict(
+            heartbeat_interval=(
+                self._config.getinteger('HEARTBEAT_INTERVAL')
+            ),
+            session_sync_interval=(
+                self._config.getinteger('SESSION_SYNC_INTERVAL')
+            ),
+            reopen_db_connection_interval=(
+                self._config.getinteger(
+                    'REOPEN_DB_CONNECTION_INTERVAL'
+                )
+            ),
+            session_expiration_time=(
+                self._config.getinteger('KDUMP_FINISHED_TIMEOUT')
+            ),
+        )
+
+    def daemonConfigs(self):
+        return (self._config,)
+
+    def daemonRestartKeys(self):
+        return (
+            'LISTENER_ADDRESS',
+            'LISTENER_PORT',
+        )
+
+    def daemonReload(self, changes):
+        if self._listener is not None:
+            self._listener.set_intervals(**self._intervals())
+
     def daemonContext(self):
         with db.DbManager(
                 host=self._engineConfig.get('ENGINE_DB_HOST'),
@@ -108,21 +140,9 @@ class Daemon(service.Daemon):
                         self._config.getinteger('LISTENER_PORT')
                     ),
                     db_manager=db_manager,
-                    heartbeat_interval=(
-                        self._config.getinteger('HEARTBEAT_INTERVAL')
-                    ),
-                    session_sync_interval=(
-                        self._config.getinteger('SESSION_SYNC_INTERVAL')
-                    ),
-                    reopen_db_connection_interval=(
-                        self._config.getinteger(
-                            'REOPEN_DB_CONNECTION_INTERVAL'
-                        )
-                    ),
-                    session_expiration_time=(
-                        self._config.getinteger('KDUMP_FINISHED_TIMEOUT')
-                    ),
+                    **self._intervals()
             ) as server:
+                self._listener = server
                 server.run()
 
 
@@ -78,11 +78,23 @@ class OvirtWebSocketProxy(websockify.WebSocketProxy):
     def get_logger(self):
         return self._logger
 
+    def reconfigure(self, ticketDecoder, cert, key, record):
+        """
+        Apply settings which are used per connection, new connections
+        are handled by forked children, so existing sessions are left
+        intact.
+        """
+        self._ticketDecoder = ticketDecoder
+        self.cert = os.path.abspath(cert)
+        self.key = os.path.abspath(key) if key else ''
+        self.record = os.path.abspath(record) if record else ''
+
 
 class Daemon(service.Daemon):
 
     def __init__(self):
         super(Daemon, self).__init__()
+        self._proxy = None
         self._defaults = os.path.abspath(
             os.path.join(
                 os.path.dirname(sys.argv[0]),
@@ -147,7 +159,7 @@ class Daemon(service.Daemon):
             pidfile=self.pidfile,
         )
 
-    def daemonContext(self):
+    def _ticketDecoder(self):
         with open(
             self._config.get(
                 'CERT_FOR_DATA_VERIFICATION'
@@ -155,30 +167,68 @@ class Daemon(service.Daemon):
         ) as f:
             peer = f.read()
 
+        return ticket.TicketDecoder(
+            ca=None,
+            eku=None,
+            peer=peer,
+        )
+
+    def _record(self):
+        return (
+            None if not self._config.getboolean('TRACE_ENABLE')
+            else self._config.get('TRACE_FILE')
+        )
+
+    def daemonConfigs(self):
+        return (self._config,)
+
+    def daemonRestartKeys(self):
+        return (
+            'PROXY_HOST',
+            'PROXY_PORT',
+            'SOURCE_IS_IPV6',
+            'SSL_ONLY',
+        )
+
+    def daemonReload(self, changes):
+        if self._proxy is not None:
+            self._checkInstallation(
+                pidfile=None,
+            )
+            self._proxy.reconfigure(
+                ticketDecoder=self._ticketDecoder(),
+                cert=self._config.get('SSL_CERTIFICATE'),
+                key=self._config.get('SSL_KEY'),
+                record=self._record(),
+            )
+
+    def daemonProbe(self):
+        # the proxy runs within the service, it is only probed for being
+        # ready to accept connections
+        host = self._config.get('PROXY_HOST')
+        return service.SocketProbe(
+            host='localhost' if host in ('', '*') else host,
+            port=self._config.getinteger('PROXY_PORT'),
+        )
+
+    def daemonContext(self):
         if websockify_has_plugins():
             kwargs = {'token_plugin': 'TokenFile'}
         else:
             kwargs = {'target_cfg': '/dummy'}
 
-        OvirtWebSocketProxy(
+        self._proxy = OvirtWebSocketProxy(
             listen_host=self._config.get('PROXY_HOST'),
             listen_port=self._config.get('PROXY_PORT'),
             source_is_ipv6=self._config.getboolean('SOURCE_IS_IPV6'),
             verbose=self.debug,
-            ticketDecoder=ticket.TicketDecoder(
-                ca=None,
-                eku=None,
-                peer=peer,
-            ),
+            ticketDecoder=self._ticketDecoder(),
             logger=self._logger,
             cert=self._config.get('SSL_CERTIFICATE'),
             key=self._config.get('SSL_KEY'),
             ssl_only=self._config.getboolean('SSL_ONLY'),
             daemon=False,
-            record=(
-                None if not self._config.getboolean('TRACE_ENABLE')
-                else self._config.get('TRACE_FILE')
-            ),
+            record=self._record(),
             web=None,
             target_host=None,
             target_port=None,
@@ -186,7 +236,8 @@ class Daemon(service.Daemon):
             wrap_cmd=None,
             RequestHandlerClass=OvirtProxyRequestHandler,
             **kwargs
-        ).start_server()
+        )
+        self._proxy.start_server()
 
 
 if __name__ == '__main__':
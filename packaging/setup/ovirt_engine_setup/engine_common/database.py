@@ -95,6 +95,26 @@ def getInvalidConfigItemsMessage(invalid_config_items):
     )
 
 
+# Connections of Statement.execute(ownConnection=True) kept for the
+# run by their parameters and the effective user, which authenticates
+# unix socket connections, idle between statements
+_connections = {}
+
+
+@util.export
+def closeConnections():
+    """Close the connections kept by Statement.execute"""
+    while _connections:
+        key, connection = _connections.popitem()
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+atexit.register(closeConnections)
+
+
 @util.export
 class Statement(base.Base):
 
@@ -117,7 +137,7 @@ class Statement(base.Base):
             )
         self._dbenvkeys = dbenvkeys
 
-    def connect(
+    def _connectionParameters(
         self,
         host=None,
         port=None,
@@ -154,7 +174,7 @@ class Statement(base.Base):
         # uselss parameters
         #
         if not host:
-            connection = psycopg2.connect(
+            return dict(
                 dbname=database,
             )
         else:
@@ -163,7 +183,7 @@ class Statement(base.Base):
             # does not support unicode strings for port.
             # do not cast to int to avoid breaking usock.
             #
-            connection = psycopg2.connect(
+            return dict(
                 host=host,
                 port=str(port),
                 user=user,
@@ -172,7 +192,75 @@ class Statement(base.Base):
                 sslmode=sslmode,
             )
 
-        return connection
+    def connect(
+        self,
+        host=None,
+        port=None,
+        secured=None,
+        securedHostValidation=None,
+        user=None,
+        password=None,
+        database=None,
+    ):
+        return psycopg2.connect(
+            **self._connectionParameters(
+                host=host,
+                port=port,
+                secured=secured,
+                securedHostValidation=securedHostValidation,
+                user=user,
+                password=password,
+                database=database,
+            )
+        )
+
+    def _acquireConnection(self, key):
+        """
+        Return the kept connection for the key if it is still usable,
+        otherwise a new one. poll() reads the termination notice a
+        server sends its idle connections on shutdown.
+        """
+        connection = _connections.pop(key, None)
+        if connection is not None:
+            try:
+                connection.poll()
+                if (
+                    connection.closed == 0 and
+                    connection.get_transaction_status() ==
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    self.logger.debug('Reusing own connection')
+                    return connection
+            except psycopg2.Error:
+                self.logger.debug('Own connection lost', exc_info=True)
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+        self.logger.debug('Creating own connection')
+        return psycopg2.connect(**dict(key[1]))
+
+    def _releaseConnection(self, key, connection):
+        """
+        Keep the connection for the next statement of the run if it is
+        idle, each statement commits or rolls back its transaction.
+        """
+        try:
+            if (
+                connection.closed == 0 and
+                connection.get_transaction_status() ==
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE and
+                key not in _connections
+            ):
+                _connections[key] = connection
+                return
+        except psycopg2.Error:
+            pass
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
 
     def execute(
         self,
@@ -226,17 +314,23 @@ class Statement(base.Base):
             if not ownConnection:
                 connection = _ind_env(self, DEK.CONNECTION)
             else:
-                self.logger.debug('Creating own connection')
-
-                _connection = connection = self.connect(
-                    host=host,
-                    port=port,
-                    secured=secured,
-                    securedHostValidation=securedHostValidation,
-                    user=user,
-                    password=password,
-                    database=database,
+                key = (
+                    os.geteuid(),
+                    tuple(
+                        sorted(
+                            self._connectionParameters(
+                                host=host,
+                                port=port,
+                                secured=secured,
+                                securedHostValidation=securedHostValidation,
+                                user=user,
+                                password=password,
+                                database=database,
+                            ).items()
+                        )
+                    ),
                 )
+                _connection = connection = self._acquireConnection(key)
 
             if not transaction:
                 old_autocommit = __backup_autocommit(connection)
@@ -269,7 +363,7 @@ class Statement(base.Base):
             if cursor is not None:
                 cursor.close()
             if _connection is not None:
-                _connection.close()
+                self._releaseConnection(key, _connection)
 
         self.logger.debug('Result: %s', ret)
         return ret
@@ -391,13 +391,15 @@ class Provisioning(base.Base):
         )
 
     def restartPG(self):
-            for state in (False, True):
-                self.services.state(
-                    name=self.environment[
-                        oengcommcons.ProvisioningEnv.POSTGRES_SERVICE
-                    ],
-                    state=state,
-                )
+        # the kept connections would not survive the restart
+        database.closeConnections()
+        for state in (False, True):
+            self.services.state(
+                name=self.environment[
+                    oengcommcons.ProvisioningEnv.POSTGRES_SERVICE
+                ],
+                state=state,
+            )
 
     def _waitForDatabase(self, environment=None):
         dbovirtutils = database.OvirtUtils(
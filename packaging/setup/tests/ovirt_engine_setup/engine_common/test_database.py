@@ -32,3 +32,146 @@ import ovirt_engine_setup.engine_common.database as under_test  # isort:skip # n
 def test_value_extraction_from_conf(given, expected):
     match = under_test.RE_KEY_VALUE.match('key=%s' % given)
     assert match.group('value') == expected
+
+
+class _Cursor(object):
+
+    description = None
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, statement, args):
+        self._connection.autocommits.append(self._connection.autocommit)
+        if statement == 'fail':
+            raise under_test.psycopg2.ProgrammingError(statement)
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+
+    def __init__(self, **kwargs):
+        self.parameters = kwargs
+        self.closed = 0
+        self.lost = False
+        self.autocommit = False
+        self.autocommits = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def poll(self):
+        if self.lost:
+            self.closed = 2
+            raise under_test.psycopg2.OperationalError('server closed')
+
+    def get_transaction_status(self):
+        return under_test.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections():
+    created = []
+
+    def connect(**kwargs):
+        created.append(_Connection(**kwargs))
+        return created[-1]
+
+    with mock.patch.object(under_test.psycopg2, 'connect', connect):
+        yield created
+    under_test.closeConnections()
+
+
+@pytest.fixture
+def statement():
+    under_test.DEK.REQUIRED_KEYS = ()
+    keys = (
+        'HOST',
+        'PORT',
+        'SECURED',
+        'HOST_VALIDATION',
+        'USER',
+        'PASSWORD',
+        'DATABASE',
+    )
+    return under_test.Statement(
+        dbenvkeys=dict((getattr(under_test.DEK, k), k) for k in keys),
+        environment={
+            'HOST': 'db.example.com',
+            'PORT': 5432,
+            'SECURED': True,
+            'HOST_VALIDATION': True,
+            'USER': 'engine',
+            'PASSWORD': 'secret',
+            'DATABASE': 'engine',
+        },
+    )
+
+
+def test_own_connection_reused(connections, statement):
+    statement.execute('select 1', ownConnection=True)
+    statement.execute('select 2', ownConnection=True)
+    assert len(connections) == 1
+    assert connections[0].parameters['sslmode'] == 'verify-full'
+    assert connections[0].commits == 2
+    assert connections[0].closed == 0
+
+
+def test_own_connection_keyed_by_parameters(connections, statement):
+    statement.execute('select 1', ownConnection=True)
+    statement.execute('select 1', ownConnection=True, database='postgres')
+    statement.execute('select 1', ownConnection=True, user='postgres')
+    statement.execute('select 1', ownConnection=True, database='postgres')
+    assert [c.parameters['dbname'] for c in connections] == [
+        'engine',
+        'postgres',
+        'engine',
+    ]
+
+
+def test_own_connection_autocommit_restored(connections, statement):
+    statement.execute('select 1', ownConnection=True, transaction=False)
+    statement.execute('select 1', ownConnection=True)
+    assert len(connections) == 1
+    assert connections[0].autocommits == [True, False]
+    assert connections[0].autocommit is False
+
+
+def test_own_connection_kept_after_rollback(connections, statement):
+    with pytest.raises(under_test.psycopg2.ProgrammingError):
+        statement.execute('fail', ownConnection=True)
+    statement.execute('select 1', ownConnection=True)
+    assert len(connections) == 1
+    assert connections[0].rollbacks == 1
+    assert connections[0].commits == 1
+
+
+def test_own_connection_lost_replaced(connections, statement):
+    statement.execute('select 1', ownConnection=True)
+    connections[0].lost = True
+    statement.execute('select 1', ownConnection=True)
+    assert len(connections) == 2
+    assert connections[0].closed
+    assert connections[1].commits == 1
+
+
+def test_close_connections(connections, statement):
+    statement.execute('select 1', ownConnection=True)
+    statement.execute('select 1', ownConnection=True, database='postgres')
+    under_test.closeConnections()
+    assert all(c.closed == 1 for c in connections)
+    statement.execute('select 1', ownConnection=True)
+    assert len(connections) == 3